@@ -5,7 +5,32 @@ import random
 import os
 import json
 import time
+import argparse
+import asyncio
+import socket
+import signal
+import threading
+import queue
+import weakref
+import pickle
+import shutil
+import mmap
+import struct
+import zlib
+import bisect
+import cProfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Command-line tools that never open a window run on SDL's dummy drivers
+HEADLESS_COMMANDS = ("--build-pack", "--rate-pack", "--serve", "--render-replay", "--telemetry-report")
+if any(arg in HEADLESS_COMMANDS for arg in sys.argv[1:]):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")  # Leave SIGINT/SIGTERM to Python
 
 # Initialize pygame
 pygame.init()
@@ -47,8 +72,115 @@ BUBBLE_COLORS = [
     {"main": ORANGE, "light": (255, 200, 150), "dark": (180, 100, 0)}
 ]
 
-# Create the screen
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
+# Rainbow powerup bubble (matches any color)
+RAINBOW_COLOR = {"main": GOLD, "light": (255, 255, 150), "dark": (200, 150, 0)}
+
+# Compact cell codes used by SimBoard and level packs: 0 is empty,
+# 1..len(BUBBLE_COLORS) are colors and RAINBOW_CODE is a rainbow bubble
+COLOR_CODES = {color["main"]: i + 1 for i, color in enumerate(BUBBLE_COLORS)}
+RAINBOW_CODE = 255
+
+# Powerup types, in the order used by their wire codes (0 is none)
+POWERUP_TYPES = ("bomb", "rainbow", "lightning", "freeze", "magnet", "time_slow", "multi_shot")
+POWERUP_COLORS = {
+    "bomb": (255, 50, 50),       # Red
+    "rainbow": (255, 215, 0),    # Gold
+    "lightning": (100, 100, 255), # Blue
+    "freeze": (200, 200, 255),   # Light blue
+    "magnet": (255, 105, 180),   # Pink
+    "time_slow": (50, 205, 50),  # Lime
+    "multi_shot": (0, 128, 128)  # Teal
+}
+POWERUP_NAMES = {
+    "bomb": "BOMB",
+    "rainbow": "RAINBOW",
+    "lightning": "LIGHTNING",
+    "freeze": "FREEZE",
+    "magnet": "MAGNET",
+    "time_slow": "TIME SLOW",
+    "multi_shot": "MULTI-SHOT"
+}
+
+# Grid neighbour offsets (row, col) for even and odd rows
+NEIGHBOR_DIRECTIONS = (
+    ((-1, -1), (-1, 0), (0, -1), (0, 1), (1, -1), (1, 0)),  # Even row
+    ((-1, 0), (-1, 1), (0, -1), (0, 1), (1, 0), (1, 1))     # Odd row
+)
+
+class RenderTarget:
+    # The offscreen target everything draws into, always in layout
+    # coordinates (WIDTH x HEIGHT). Its pixels are at the internal
+    # resolution: below the layout size, blitted surfaces are scaled down
+    # once and cached while they live, and shapes are drawn at the scaled
+    # size, so fill-rate follows the internal resolution. Window.present()
+    # scales the result to the actual window.
+    def __init__(self, size=(WIDTH, HEIGHT)):
+        self.resize(size)
+    
+    def resize(self, size):
+        self.surface = pygame.Surface(size)
+        self.native = tuple(size) == (WIDTH, HEIGHT)
+        self.sx, self.sy = size[0] / WIDTH, size[1] / HEIGHT
+        self.scaled = weakref.WeakKeyDictionary()  # Source surface -> scaled copy
+        self.tints = {}  # RGBA -> full-target overlay
+    
+    def get_size(self):
+        return self.surface.get_size()
+    
+    def point(self, pos):
+        return int(pos[0] * self.sx), int(pos[1] * self.sy)
+    
+    def scale_surface(self, source):
+        # Sources are not changed after they are drawn, so copies are reused
+        scaled = self.scaled.get(source)
+        if scaled is None:
+            width, height = source.get_size()
+            size = (max(1, round(width * self.sx)), max(1, round(height * self.sy)))
+            scale = pygame.transform.smoothscale if source.get_bitsize() >= 24 else pygame.transform.scale
+            scaled = self.scaled[source] = scale(source, size)
+        return scaled
+    
+    def blit(self, source, pos):
+        if self.native:
+            return self.surface.blit(source, pos)
+        return self.surface.blit(self.scale_surface(source), self.point(pos))
+    
+    def blits(self, sequence, doreturn=True):
+        if self.native:
+            return self.surface.blits(sequence, doreturn)
+        return self.surface.blits([(self.scale_surface(source), self.point(pos)) for source, pos in sequence],
+                                  doreturn)
+    
+    def tint(self, color):
+        # Translucent full-screen overlay, kept at the target's own size so
+        # it is never rescaled
+        overlay = self.tints.get(color)
+        if overlay is None:
+            overlay = self.tints[color] = pygame.Surface(self.get_size(), pygame.SRCALPHA)
+            overlay.fill(color)
+        return self.surface.blit(overlay, (0, 0))
+    
+    def circle(self, color, center, radius, width=0):
+        if self.native:
+            return pygame.draw.circle(self.surface, color, center, radius, width)
+        scale = min(self.sx, self.sy)
+        return pygame.draw.circle(self.surface, color, self.point(center), radius * scale,
+                                  width and max(1, round(width * scale)))
+    
+    def line(self, color, start, end, width=1):
+        if self.native:
+            return pygame.draw.line(self.surface, color, start, end, width)
+        return pygame.draw.line(self.surface, color, self.point(start), self.point(end),
+                                max(1, round(width * min(self.sx, self.sy))))
+    
+    def rect(self, color, rect, width=0):
+        if self.native:
+            return pygame.draw.rect(self.surface, color, rect, width)
+        rect = pygame.Rect(rect)
+        scaled = pygame.Rect(self.point(rect.topleft), self.point(rect.size))
+        return pygame.draw.rect(self.surface, color, scaled, width and max(1, round(width * min(self.sx, self.sy))))
+
+screen = RenderTarget()
 pygame.display.set_caption("Puzzle Bobble")
 clock = pygame.time.Clock()
 font = pygame.font.SysFont('Arial', 24)
@@ -93,6 +225,333 @@ def create_explosion_frames(radius):
 
 explosion_frames = create_explosion_frames(BUBBLE_RADIUS)
 
+def alpha_bucket(alpha):
+    # Effects fade in 16 steps so their sprites can be shared
+    return 255 if alpha >= 255 else max(0, int(alpha)) & 0xF0
+
+class SpriteCache:
+    # Pre-rasterized effect sprites keyed by (kind, size, colour, alpha) so
+    # particles are submitted with one Surface.blits per layer instead of a
+    # draw call each. Cleared when it outgrows LIMIT (shockwave radii are
+    # the only unbounded key).
+    LIMIT = 2048
+    BOLT_VARIANTS = 16  # Zigzag shapes sparks pick from
+    
+    def __init__(self):
+        self.surfaces = {}
+        self.fonts = {}
+        self.bolts = []
+    
+    def store(self, key, surface):
+        if len(self.surfaces) >= self.LIMIT:
+            self.surfaces.clear()
+        self.surfaces[key] = surface
+        return surface
+    
+    def circle(self, radius, color, alpha=255, width=0):
+        key = ("circle", radius, color, alpha, width)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(surface, color[:3] + (alpha,), (radius, radius), radius, width)
+            surface = self.store(key, surface)
+        return surface
+    
+    def bar(self, width, height, color, alpha=255):
+        key = ("bar", width, height, color, alpha)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = pygame.Surface((width, height), pygame.SRCALPHA)
+            surface.fill(color[:3] + (alpha,))
+            surface = self.store(key, surface)
+        return surface
+    
+    def bolt(self, variant, alpha):
+        # Returns the spark sprite and its offset from the spark's origin
+        key = ("bolt", variant, alpha)
+        sprite = self.surfaces.get(key)
+        if sprite is None:
+            while len(self.bolts) <= variant:
+                self.bolts.append(self.bolt_shape())
+            points = self.bolts[variant]
+            left = int(min(x for x, y in points)) - 2
+            top = int(min(y for x, y in points)) - 2
+            width = int(max(x for x, y in points)) - left + 3
+            height = int(max(y for x, y in points)) - top + 3
+            surface = pygame.Surface((width, height), pygame.SRCALPHA)
+            pygame.draw.lines(surface, (200, 200, 255, alpha), False,
+                              [(x - left, y - top) for x, y in points], 2)
+            sprite = self.store(key, (surface, (left, top)))
+        return sprite
+    
+    def bolt_shape(self):
+        # Zigzag points around (0, 0)
+        num_points = random.randint(3, 6)
+        angle = random.uniform(0, 2*math.pi)
+        max_dist = random.uniform(10, 30)
+        points = []
+        for i in range(num_points):
+            dist = max_dist * (i / (num_points - 1))
+            offset = random.uniform(-10, 10)
+            points.append((math.cos(angle) * dist + offset, math.sin(angle) * dist + offset))
+        return points
+    
+    def text(self, size, text, color, alpha=255, scale=1.0):
+        key = ("text", size, text, color, alpha, scale)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            if size not in self.fonts:
+                self.fonts[size] = pygame.font.SysFont('Arial', size)
+            surface = self.fonts[size].render(text, True, color)
+            if scale != 1.0:
+                width, height = surface.get_size()
+                surface = pygame.transform.scale(surface, (max(1, int(width * scale)), max(1, int(height * scale))))
+            surface.set_alpha(alpha)
+            surface = self.store(key, surface)
+        return surface
+
+sprites = SpriteCache()
+
+class GameLog:
+    # Leveled, categorized log that is cheap on the game thread. A call
+    # below its category's level returns before touching its arguments,
+    # and an enabled one only stores the unformatted record: in a ring
+    # buffer of recent history, and on a queue to a writer thread that
+    # formats it, echoes it to stderr and appends it to the log file.
+    DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+    NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+    
+    def __init__(self, level=INFO, echo=INFO, capacity=2000):
+        self.level = level  # Default for categories without their own
+        self.categories = {}  # Category -> level
+        self.echo = echo  # Records at this level or above also go to stderr
+        self.history = deque(maxlen=capacity)
+        self.path = None
+        self.dump_dir = "logs"  # Where dump() writes
+        self.queue = None
+        self.thread = None
+        self.pid = None  # A forked worker starts its own writer
+    
+    @classmethod
+    def parse_level(cls, name):
+        return {value: key for key, value in cls.NAMES.items()}[name.upper()]
+    
+    def configure(self, level=None, categories=None, path=None):
+        if level is not None:
+            self.level = level
+        self.categories.update(categories or {})
+        self.path = path
+    
+    def enabled(self, level, category):
+        # For callers that would do real work just to build the arguments
+        return level >= self.categories.get(category, self.level)
+    
+    def log(self, level, category, message, *args):
+        # message is %-formatted with args on the writer thread
+        if level < self.categories.get(category, self.level):
+            return
+        record = (time.time(), level, category, message, args)
+        self.history.append(record)
+        if self.pid != os.getpid():
+            self.start()
+        self.queue.put(record)
+    
+    def start(self):
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.write, args=(self.queue,), daemon=True)
+        self.thread.start()
+    
+    def debug(self, category, message, *args):
+        self.log(self.DEBUG, category, message, *args)
+    
+    def info(self, category, message, *args):
+        self.log(self.INFO, category, message, *args)
+    
+    def warning(self, category, message, *args):
+        self.log(self.WARNING, category, message, *args)
+    
+    def error(self, category, message, *args):
+        self.log(self.ERROR, category, message, *args)
+    
+    def dump(self):
+        # Writes the recent history to its own file, off the game thread
+        path = os.path.join(self.dump_dir, datetime.now().strftime("dump-%Y%m%d-%H%M%S.log"))
+        history = list(self.history)
+        self.log(self.INFO, "log", "Dumping %d records to %s", len(history), path)
+        if self.pid != os.getpid():
+            self.start()
+        self.queue.put((path, history))
+        return path
+    
+    def close(self):
+        # Waits for everything logged so far to be written
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = None
+    
+    @classmethod
+    def format(cls, record):
+        stamp, level, category, message, args = record
+        if args:
+            message = message % args
+        clock = datetime.fromtimestamp(stamp).strftime("%H:%M:%S.%f")[:-3]
+        return f"{clock} {cls.NAMES[level]:7} [{category}] {message}"
+    
+    def write(self, records):
+        out = None
+        while True:
+            if out and records.empty():
+                out.flush()  # Only once there is a lull
+            item = records.get()
+            if item is None:
+                break
+            if isinstance(item[0], str):
+                path, history = item
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, "w") as f:
+                    f.writelines(self.format(record) + "\n" for record in history)
+                continue
+            line = self.format(item)
+            if item[1] >= self.echo:
+                print(line, file=sys.stderr)
+            if self.path:
+                if out is None:
+                    out = open(self.path, "a")
+                out.write(line + "\n")
+        if out:
+            out.close()
+
+log = GameLog()
+
+class MetricCounter:
+    # Metrics are plain attributes updated by exactly one thread each (the
+    # game loop, the simulation thread or the session server), so hot loops
+    # pay for an attribute add and no lock. The scrape thread only reads.
+    def __init__(self, labels=""):
+        self.labels = labels
+        self.value = 0
+    
+    def inc(self, amount=1):
+        self.value += amount
+    
+    def samples(self, name):
+        yield name + self.labels, self.value
+
+class MetricGauge(MetricCounter):
+    def set(self, value):
+        self.value = value
+
+class MetricHistogram:
+    # Counts and sum change together under a sequence number (odd while
+    # an observation is half done), so a scrape can retry until it reads
+    # both from the same state without the writer taking a lock
+    def __init__(self, bounds, labels=""):
+        self.labels = labels
+        self.bounds = bounds  # Upper bounds, ascending; +Inf is implied
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.sequence = 0
+    
+    def observe(self, value):
+        self.sequence += 1
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.sequence += 1
+    
+    def read(self):
+        # (counts, sum) from one consistent state
+        while True:
+            sequence = self.sequence
+            counts, total = list(self.counts), self.sum
+            if not sequence % 2 and sequence == self.sequence:
+                return counts, total
+            time.sleep(0)
+    
+    def samples(self, name):
+        counts, value_sum = self.read()
+        inner = self.labels[1:-1] + "," if self.labels else ""
+        total = 0
+        for bound, count in zip(list(self.bounds) + ["+Inf"], counts):
+            total += count
+            yield f'{name}_bucket{{{inner}le="{bound}"}}', total
+        yield name + "_sum" + self.labels, value_sum
+        yield name + "_count" + self.labels, total
+
+class Metrics:
+    # Registry rendered in the Prometheus text format, served over HTTP by
+    # serve() on its own thread
+    FRAME_BOUNDS = (0.004, 0.008, 0.0125, 0.0167, 0.025, 0.0333, 0.05, 0.1, 0.25)
+    
+    def __init__(self):
+        self.families = {}  # Name -> (type, help, [metrics])
+        self.server = None
+    
+    def add(self, kind, name, help, metric):
+        self.families.setdefault(name, (kind, help, []))[2].append(metric)
+        return metric
+    
+    def counter(self, name, help, labels=""):
+        return self.add("counter", name, help, MetricCounter(labels))
+    
+    def gauge(self, name, help, labels=""):
+        return self.add("gauge", name, help, MetricGauge(labels))
+    
+    def histogram(self, name, help, bounds, labels=""):
+        return self.add("histogram", name, help, MetricHistogram(bounds, labels))
+    
+    def render(self):
+        lines = []
+        for name, (kind, help, family) in list(self.families.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in family:
+                lines.extend(f"{sample} {value}" for sample, value in metric.samples(name))
+        return "\n".join(lines) + "\n"
+    
+    def serve(self, address):
+        # address is HOST:PORT; GET /metrics returns render()
+        registry = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                log.debug("metrics", format, *args)
+        
+        host, port = address.rsplit(":", 1)
+        self.server = ThreadingHTTPServer((host, int(port)), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        log.info("metrics", "Serving metrics on http://%s:%d/metrics", *self.server.server_address[:2])
+
+metrics = Metrics()
+frame_seconds = metrics.histogram("puzzle_bobble_frame_seconds", "Time between frames", Metrics.FRAME_BOUNDS)
+fps_gauge = metrics.gauge("puzzle_bobble_fps", "Frames per second over the last ten frames")
+update_seconds = metrics.histogram("puzzle_bobble_phase_seconds", "Time spent in each phase of a frame",
+                                   Metrics.FRAME_BOUNDS, '{phase="update"}')
+draw_seconds = metrics.histogram("puzzle_bobble_phase_seconds", "Time spent in each phase of a frame",
+                                 Metrics.FRAME_BOUNDS, '{phase="draw"}')
+entity_gauges = {kind: metrics.gauge("puzzle_bobble_entities", "Live entities on the drawn frame", f'{{kind="{kind}"}}')
+                 for kind in ("bubbles", "falling", "particles", "explosions", "powerups")}
+games_total = metrics.counter("puzzle_bobble_games_total", "Games finished")
+score_histogram = metrics.histogram("puzzle_bobble_game_score", "Final score of finished games",
+                                    (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000))
+leaderboard_write_seconds = metrics.histogram("puzzle_bobble_leaderboard_write_seconds", "Leaderboard save latency",
+                                              (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+sessions_gauge = metrics.gauge("puzzle_bobble_sessions", "Open headless sessions")
+session_shots_total = metrics.counter("puzzle_bobble_session_shots_total", "Shots played by headless sessions")
+
 # Sound effects
 try:
     pygame.mixer.init()
@@ -103,7 +562,98 @@ try:
     sounds_loaded = True
 except:
     sounds_loaded = False
-    print("Sounds could not be loaded. Continuing without sound.")
+    log.warning("sound", "Sounds could not be loaded. Continuing without sound.")
+
+class QualityGovernor:
+    # Scales effect density to hold the frame rate. main() reports how long
+    # each frame's work took; when the recent average runs over budget the
+    # level drops quickly, and it creeps back up when there is headroom.
+    # Emitters ask for counts and chances through it, and the hard caps
+    # bound each kind of effect at any level.
+    CAPS = {"particles": 800, "explosions": 60, "trail": 30}
+    FEATURES = {"pulse": 0.6, "snow": 0.3}  # Level each optional effect needs
+    MIN_LEVEL = 0.1
+    
+    def __init__(self, budget_ms=1000 / 60 * 0.85, window=30):
+        self.budget_ms = budget_ms  # Work per frame, leaving some slack under 60 FPS
+        self.window = window  # Frames averaged
+        self.times = []
+        self.level = 1.0  # 1.0 is full detail
+        self.fixed = False
+        self.cooldown = 0  # Frames until the next adjustment
+    
+    def fix(self, level):
+        # Pin the level, e.g. for benchmarks or offline rendering
+        self.level = max(self.MIN_LEVEL, min(1.0, level))
+        self.fixed = True
+    
+    def update(self, frame_ms):
+        if self.fixed:
+            return
+        self.times.append(frame_ms)
+        del self.times[:-self.window]
+        if self.cooldown:
+            self.cooldown -= 1
+            return
+        average = sum(self.times) / len(self.times)
+        if average > self.budget_ms and self.level > self.MIN_LEVEL:
+            self.level = max(self.MIN_LEVEL, self.level - 0.15)
+            self.cooldown = self.window // 2
+        elif average < self.budget_ms * 0.6 and self.level < 1.0:
+            self.level = min(1.0, self.level + 0.05)
+            self.cooldown = self.window
+    
+    def count(self, n):
+        return int(n * self.level + 0.5)
+    
+    def chance(self, p):
+        return random.random() < p * self.level
+    
+    def allows(self, feature):
+        return self.level >= self.FEATURES[feature]
+    
+    def has_room(self, kind, current):
+        return current < self.CAPS[kind]
+
+quality = QualityGovernor()
+
+class FrameScheduler:
+    # Deferred, non-critical work (effect spawning, file writes) drained in
+    # whatever is left of each frame's budget. Tasks run in priority order,
+    # and one whose deadline (in frames) has come runs even over budget, so
+    # nothing waits forever.
+    HIGH, NORMAL, LOW = 0, 1, 2
+    
+    def __init__(self):
+        self.tasks = []  # (priority, due frame, sequence, callable)
+        self.frame = 0
+        self.sequence = 0  # Keeps equal priorities first-in first-out
+    
+    def schedule(self, task, priority=NORMAL, deadline=30):
+        self.sequence += 1
+        self.tasks.append((priority, self.frame + deadline, self.sequence, task))
+    
+    def run(self, budget_ms):
+        # Once per frame, with the milliseconds left in it
+        self.frame += 1
+        if not self.tasks:
+            return
+        end = time.perf_counter() + budget_ms / 1000
+        tasks, self.tasks = sorted(self.tasks), []
+        pending = []
+        for item in tasks:
+            if item[1] <= self.frame or time.perf_counter() < end:
+                item[3]()
+            else:
+                pending.append(item)
+        self.tasks.extend(pending)  # After anything the tasks scheduled
+    
+    def flush(self):
+        # Run everything now, e.g. before drawing an offline frame or quitting
+        while self.tasks:
+            tasks, self.tasks = sorted(self.tasks), []
+            for item in tasks:
+                item[3]()
 
 class Particle:
     def __init__(self, x, y, color, size=3):
@@ -122,14 +672,17 @@ class Particle:
         self.size = max(0, self.size - 0.1)
         return self.lifetime <= 0
     
-    def draw(self):
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), int(self.size))
+    def submit(self, batch):
+        radius = int(self.size)
+        if radius > 0:
+            batch.append((sprites.circle(radius, self.color), (int(self.x) - radius, int(self.y) - radius)))
 
 class Powerup:
-    def __init__(self, x, y, type):
+    def __init__(self, x, y, type, trail=True):
         self.x = x
         self.y = y
         self.type = type
+        self.trail = trail  # Emit trail particles (off for simulation-only games)
         self.radius = BUBBLE_RADIUS * 0.8
         self.vy = 2  # Fall speed
         self.rotation = 0
@@ -146,20 +699,12 @@ class Powerup:
         self.target_x = 0  # Target x position for attraction
         self.target_y = 0  # Target y position for attraction
         
-        # Powerup types: "bomb", "rainbow", "lightning", "freeze", "magnet", "time_slow", "multi_shot"
-        self.colors = {
-            "bomb": (255, 50, 50),       # Red
-            "rainbow": (255, 215, 0),    # Gold
-            "lightning": (100, 100, 255), # Blue
-            "freeze": (200, 200, 255),   # Light blue
-            "magnet": (255, 105, 180),   # Pink
-            "time_slow": (50, 205, 50),  # Lime
-            "multi_shot": (0, 128, 128)  # Teal
-        }
+        self.colors = POWERUP_COLORS
         
         # Create trail particles
-        for _ in range(3):
-            self.particles.append(Particle(self.x, self.y, self.colors[self.type], random.uniform(1, 3)))
+        if self.trail:
+            for _ in range(quality.count(3)):
+                self.particles.append(Particle(self.x, self.y, self.colors[self.type], random.uniform(1, 3)))
     
     def update(self, shooter_x=None, shooter_y=None):
         # Check if powerup should be attracted to shooter
@@ -192,7 +737,7 @@ class Powerup:
                     self.y += (dy / distance) * self.attraction_speed
                 
                 # Create attraction particles
-                if random.random() < 0.3:
+                if self.trail and quality.chance(0.3) and quality.has_room("trail", len(self.particles)):
                     self.particles.append(Particle(
                         self.x + random.uniform(-10, 10),
                         self.y + random.uniform(-10, 10),
@@ -228,7 +773,7 @@ class Powerup:
                 self.particles.remove(particle)
                 
         # Add new trail particles
-        if random.random() < 0.3:
+        if self.trail and quality.chance(0.3) and quality.has_room("trail", len(self.particles)):
             self.particles.append(Particle(self.x, self.y, self.colors[self.type], random.uniform(1, 3)))
         
         # Check if off screen
@@ -241,7 +786,7 @@ class Powerup:
         color = self.colors[self.type]
         
         # Draw pulse effect
-        if self.pulse_size > 0:
+        if self.pulse_size > 0 and quality.allows("pulse"):
             pulse_surf = pygame.Surface((self.radius*2 + self.pulse_size*2, self.radius*2 + self.pulse_size*2), pygame.SRCALPHA)
             pulse_color = list(color) + [100 - self.pulse_size * 15]  # Add alpha value
             pygame.draw.circle(pulse_surf, pulse_color, 
@@ -316,7 +861,7 @@ class Powerup:
             pygame.draw.polygon(surf, (255, 255, 100), points)
             
             # Add electric sparks
-            for _ in range(3):
+            for _ in range(quality.count(3)):
                 spark_angle = random.uniform(0, 2*math.pi)
                 spark_dist = self.radius * 0.8
                 spark_x = self.radius + math.cos(spark_angle) * spark_dist
@@ -356,7 +901,7 @@ class Powerup:
                                2)
                 
             # Add frost particles
-            for _ in range(2):
+            for _ in range(quality.count(2)):
                 frost_angle = random.uniform(0, 2*math.pi)
                 frost_dist = random.uniform(self.radius * 0.3, self.radius * 0.9)
                 frost_x = self.radius + math.cos(frost_angle) * frost_dist
@@ -467,8 +1012,10 @@ class Powerup:
         screen.blit(rotated_surf, rotated_rect.topleft)
         
         # Draw particles
+        batch = []
         for particle in self.particles:
-            particle.draw()
+            particle.submit(batch)
+        screen.blits(batch, False)
     
     def check_collision(self, x, y, radius):
         # Check if powerup collides with given coordinates
@@ -478,14 +1025,14 @@ class Powerup:
         return distance < self.radius + radius
 
 class Explosion:
-    def __init__(self, x, y, color):
+    def __init__(self, x, y, color, particles=20):
         self.x = x
         self.y = y
         self.color = color
         self.frame = 0
         self.max_frames = len(explosion_frames)
         self.particles = []
-        for _ in range(20):
+        for _ in range(particles):
             self.particles.append(Particle(x, y, color))
     
     def update(self):
@@ -495,15 +1042,16 @@ class Explosion:
                 self.particles.remove(particle)
         return self.frame >= self.max_frames and not self.particles
     
-    def draw(self):
+    def submit(self, batch):
         if self.frame < self.max_frames:
-            screen.blit(explosion_frames[self.frame], 
-                       (self.x - BUBBLE_RADIUS, self.y - BUBBLE_RADIUS))
+            batch.append((explosion_frames[self.frame], 
+                          (self.x - BUBBLE_RADIUS, self.y - BUBBLE_RADIUS)))
         for particle in self.particles:
-            particle.draw()
+            particle.submit(batch)
 
 class Bubble:
     def __init__(self, x, y, color=None):
+        self.view = None  # Game whose scroll offset applies while on the grid
         self.x = x
         self.y = y
         self.color = color if color else random.choice(BUBBLE_COLORS)
@@ -518,12 +1066,23 @@ class Bubble:
         self.shine_angle = random.uniform(0, 2*math.pi)  # For shine effect animation
         self.shine_speed = random.uniform(0.02, 0.05)
         self.is_rainbow = False  # For rainbow powerup
+        self.handle = None  # Slot in the BubbleRegistry while on the grid
+    
+    # Grid bubbles keep their unscrolled position; the screen position is
+    # derived from the game's scroll offset so pushing rows moves nothing
+    @property
+    def y(self):
+        return self.world_y - self.view.scroll_y if self.view else self.world_y
+    
+    @y.setter
+    def y(self, value):
+        self.world_y = value + self.view.scroll_y if self.view else value
     
     def draw(self):
         # Draw bubble with gradient
-        pygame.draw.circle(screen, self.color["dark"], (int(self.x), int(self.y)), self.radius)
-        pygame.draw.circle(screen, self.color["main"], (int(self.x), int(self.y)), self.radius - 3)
-        pygame.draw.circle(screen, self.color["light"], (int(self.x), int(self.y)), self.radius - 6)
+        screen.circle(self.color["dark"], (int(self.x), int(self.y)), self.radius)
+        screen.circle(self.color["main"], (int(self.x), int(self.y)), self.radius - 3)
+        screen.circle(self.color["light"], (int(self.x), int(self.y)), self.radius - 6)
         
         # Draw rainbow effect if applicable
         if hasattr(self, 'is_rainbow') and self.is_rainbow:
@@ -536,15 +1095,14 @@ class Bubble:
                 
                 # Rainbow colors
                 rainbow_colors = [(255,0,0), (255,165,0), (255,255,0), (0,255,0), (0,0,255), (128,0,128)]
-                pygame.draw.circle(screen, rainbow_colors[i], (int(x), int(y)), self.radius * 0.2)
-        
-        # Draw shine effect
-        shine_x = self.x + math.cos(self.shine_angle) * self.radius * 0.5
-        shine_y = self.y + math.sin(self.shine_angle) * self.radius * 0.5
-        pygame.draw.circle(screen, (255, 255, 255, 150), (int(shine_x), int(shine_y)), self.radius // 4)
+                screen.circle(rainbow_colors[i], (int(x), int(y)), self.radius * 0.2)
         
-        # Update shine position for animation
-        self.shine_angle += self.shine_speed
+        # Draw shine effect; it drifts with time (shine_speed per 60 FPS
+        # frame) so drawing leaves the bubble untouched
+        shine_angle = self.shine_angle + self.shine_speed * pygame.time.get_ticks() * 0.06
+        shine_x = self.x + math.cos(shine_angle) * self.radius * 0.5
+        shine_y = self.y + math.sin(shine_angle) * self.radius * 0.5
+        screen.circle((255, 255, 255, 150), (int(shine_x), int(shine_y)), self.radius // 4)
     
     def update(self):
         # Update position based on velocity
@@ -570,13 +1128,1174 @@ class Bubble:
                 return True
         return False
 
-class Game:
+def grid_to_pixel(row, col):
+    # Even rows are offset by half a bubble
+    x_offset = BUBBLE_RADIUS if row % 2 == 0 else 0
+    return col * GRID_SIZE + BUBBLE_RADIUS + x_offset, row * GRID_SIZE + BUBBLE_RADIUS
+
+def trace_shot(angle, is_occupied, speed=SHOOT_SPEED, max_steps=400, scroll_y=0):
+    # Step a shot the same way Game.update moves the shooting bubble and
+    # return the bounce path plus the position where it would stop.
+    # Rows are world rows; scroll_y is the game's scroll offset.
+    angle_rad = math.radians(angle)
+    x, y = WIDTH // 2, SHOOTER_Y
+    vx = speed * math.sin(angle_rad)
+    vy = -speed * math.cos(angle_rad)
+    path = [(x, y)]
+    
+    for _ in range(max_steps):
+        x += vx
+        y += vy
+        
+        # Bounce off walls
+        if x - BUBBLE_RADIUS <= 0 or x + BUBBLE_RADIUS >= WIDTH:
+            vx = -vx
+            x = BUBBLE_RADIUS if x - BUBBLE_RADIUS <= 0 else WIDTH - BUBBLE_RADIUS
+            path.append((x, y))
+        
+        # Top of the board
+        if y - BUBBLE_RADIUS <= 0:
+            path.append((x, y))
+            return path, (x, y)
+        
+        # Only cells around the bubble can be within touching distance
+        row = int((y + scroll_y) / GRID_SIZE)
+        col = int(x / GRID_SIZE)
+        for r in range(row - 1, row + 2):
+            for c in range(col - 2, col + 3):
+                if is_occupied(r, c):
+                    bx, by = grid_to_pixel(r, c)
+                    dx = x - bx
+                    dy = y + scroll_y - by
+                    if dx*dx + dy*dy < GRID_SIZE * GRID_SIZE:
+                        path.append((x, y))
+                        return path, (x, y)
+    
+    path.append((x, y))
+    return path, None
+
+class AimPreview:
+    def __init__(self, bucket_size=0.5):
+        self.bucket_size = bucket_size  # Degrees covered by one cached result
+        self.cache = {}
+        self.board_version = -1
+    
+    def get(self, game):
+        # Cached results are only valid for the board they were computed on
+        if game.board_version != self.board_version:
+            self.cache.clear()
+            self.board_version = game.board_version
+        
+        bucket = round(game.shooter_angle / self.bucket_size)
+        speed = SHOOT_SPEED
+        if game.active_powerup == "time_slow":
+            speed *= game.time_slow_factor
+        color = game.next_bubble.color
+        
+        key = (bucket, color["main"], speed)
+        result = self.cache.get(key)
+        if result is None:
+            result = game.predict_shot(bucket * self.bucket_size, color, speed)
+            self.cache[key] = result
+        return result
+
+class RingGrid:
+    # Fixed number of grid rows addressed by world row. Endless mode pushes
+    # rows in at the top, reusing the slot of the (empty) bottom row.
+    def __init__(self, rows=GRID_ROWS, cols=GRID_COLS):
+        self.rows = [[None] * cols for _ in range(rows)]
+    
+    def __getitem__(self, row):
+        return self.rows[row % len(self.rows)]
+
+class BubbleRegistry:
+    # Slot array with a free list: O(1) insert and delete by handle, with
+    # iteration in slot order for drawing
+    def __init__(self):
+        self.slots = []
+        self.free = []
+        self.count = 0
+    
+    def add(self, bubble):
+        if self.free:
+            handle = self.free.pop()
+            self.slots[handle] = bubble
+        else:
+            handle = len(self.slots)
+            self.slots.append(bubble)
+        bubble.handle = handle
+        self.count += 1
+        return handle
+    
+    def remove(self, bubble):
+        self.slots[bubble.handle] = None
+        self.free.append(bubble.handle)
+        bubble.handle = None
+        self.count -= 1
+    
+    def remove_many(self, bubbles):
+        # Batched removal for cascades; skips bubbles that are not registered
+        removed = []
+        for bubble in bubbles:
+            if bubble in self:
+                self.remove(bubble)
+                removed.append(bubble)
+        return removed
+    
+    def get(self, handle):
+        return self.slots[handle]
+    
+    def __contains__(self, bubble):
+        handle = bubble.handle
+        return handle is not None and handle < len(self.slots) and self.slots[handle] is bubble
+    
+    def __iter__(self):
+        return (bubble for bubble in self.slots if bubble is not None)
+    
+    def __len__(self):
+        return self.count
+
+class BoardStats:
     def __init__(self):
+        self.total = 0
+        self.column_counts = [0] * GRID_COLS
+        self.row_counts = [0] * GRID_ROWS
+        self.color_counts = {}  # Main color -> number of bubbles
+        self.color_bubbles = {}  # Main color -> set of bubbles
+        self.top_row = 0  # World row at the top of the grid
+        self.lowest_row = -1  # Lowest occupied world row, top_row - 1 when empty
+    
+    def add(self, bubble):
+        color = bubble.color["main"]
+        self.total += 1
+        self.column_counts[bubble.col] += 1
+        self.row_counts[bubble.row % GRID_ROWS] += 1
+        self.color_counts[color] = self.color_counts.get(color, 0) + 1
+        self.color_bubbles.setdefault(color, set()).add(bubble)
+        if bubble.row > self.lowest_row:
+            self.lowest_row = bubble.row
+    
+    def remove(self, bubble):
+        color = bubble.color["main"]
+        self.total -= 1
+        self.column_counts[bubble.col] -= 1
+        self.row_counts[bubble.row % GRID_ROWS] -= 1
+        self.color_counts[color] -= 1
+        self.color_bubbles[color].discard(bubble)
+        if not self.color_counts[color]:
+            del self.color_counts[color]
+            del self.color_bubbles[color]
+        
+        # Walk up past rows that just became empty
+        while self.lowest_row >= self.top_row and not self.row_counts[self.lowest_row % GRID_ROWS]:
+            self.lowest_row -= 1
+    
+    def set_top_row(self, row):
+        self.top_row = row
+        if not self.total:
+            self.lowest_row = row - 1
+    
+    def present_colors(self):
+        return list(self.color_counts)
+
+class ColorComponents:
+    def __init__(self):
+        self.board_version = -1
+        self.labels = [[-1] * GRID_COLS for _ in range(GRID_ROWS)]  # Component id per cell
+        self.members = []  # Bubbles in each component
+        self.colors = []  # Main color of each component
+        self.wildcards = []  # Rainbow cells touching each component
+    
+    def update(self, game):
+        # Relabel only when the board changed since the last build
+        if game.board_version == self.board_version:
+            return self
+        self.board_version = game.board_version
+        
+        labels = self.labels
+        for row in labels:
+            for col in range(GRID_COLS):
+                row[col] = -1
+        self.members = []
+        self.colors = []
+        self.wildcards = []
+        
+        for start in game.bubbles:
+            if start.is_rainbow or labels[start.row % GRID_ROWS][start.col] != -1:
+                continue
+            label = len(self.members)
+            color = start.color["main"]
+            members = [start]
+            wildcards = set()
+            labels[start.row % GRID_ROWS][start.col] = label
+            stack = [start]
+            while stack:
+                bubble = stack.pop()
+                for nrow, ncol in game.get_neighbors(bubble.row, bubble.col):
+                    if not game.valid_cell(nrow, ncol):
+                        continue
+                    neighbor = game.grid[nrow][ncol]
+                    if neighbor is None or labels[nrow % GRID_ROWS][ncol] != -1:
+                        continue
+                    if neighbor.is_rainbow:
+                        wildcards.add((nrow, ncol))
+                    elif neighbor.color["main"] == color:
+                        labels[nrow % GRID_ROWS][ncol] = label
+                        members.append(neighbor)
+                        stack.append(neighbor)
+            self.members.append(members)
+            self.colors.append(color)
+            self.wildcards.append(wildcards)
+        return self
+    
+    def size(self, row, col):
+        label = self.labels[row % GRID_ROWS][col]
+        return len(self.members[label]) if label != -1 else 0
+    
+    def largest_by_color(self):
+        largest = {}
+        for color, members in zip(self.colors, self.members):
+            largest[color] = max(largest.get(color, 0), len(members))
+        return largest
+    
+    def best_rainbow_merge(self, game, row, col):
+        # Pick the neighbour colour whose adjacent groups give the biggest
+        # match for a rainbow bubble at (row, col). Returns None when other
+        # rainbow bubbles are involved, since they bridge groups of any colour.
+        groups = {}  # Color -> adjacent component ids, in neighbour order
+        for nrow, ncol in game.get_neighbors(row, col):
+            if not game.valid_cell(nrow, ncol):
+                continue
+            neighbor = game.grid[nrow][ncol]
+            if neighbor is None:
+                continue
+            label = self.labels[nrow % GRID_ROWS][ncol]
+            if label == -1 or self.wildcards[label] - {(row, col)}:
+                return None
+            ids = groups.setdefault(self.colors[label], [])
+            if label not in ids:
+                ids.append(label)
+        
+        best = []
+        for ids in groups.values():
+            size = sum(len(self.members[label]) for label in ids)
+            if size > len(best):
+                best = [bubble for label in ids for bubble in self.members[label]]
+        return best
+
+neighbor_tables = {}
+
+def get_neighbor_table(rows, cols, parity=0):
+    # In-bounds neighbour indices for every cell of a flat rows x cols grid,
+    # in the same order as Game.get_neighbors. parity is the world row
+    # parity of the first row (endless mode scrolls by single rows).
+    key = (rows, cols, parity)
+    if key not in neighbor_tables:
+        table = []
+        for row in range(rows):
+            for col in range(cols):
+                table.append(tuple((row + dr) * cols + col + dc
+                                   for dr, dc in NEIGHBOR_DIRECTIONS[(row + parity) % 2]
+                                   if 0 <= row + dr < rows and 0 <= col + dc < cols))
+        neighbor_tables[key] = table
+    return neighbor_tables[key]
+
+class SimBoard:
+    # Flat copy of the grid as one byte per cell (see COLOR_CODES), with the
+    # attach_bubble match and drop rules, for solvers and what-if analysis
+    def __init__(self, cells=None, rows=GRID_ROWS, cols=GRID_COLS, parity=0):
+        self.rows = rows
+        self.cols = cols
+        self.parity = parity
+        self.cells = cells if cells is not None else bytearray(rows * cols)
+        self.neighbors = get_neighbor_table(rows, cols, parity)
+        self.settled = False  # True once known to have no floating bubbles
+    
+    @classmethod
+    def from_game(cls, game):
+        # Row 0 of the board is the game's current top row
+        board = cls(parity=game.row_origin % 2)
+        for bubble in game.bubbles:
+            code = RAINBOW_CODE if bubble.is_rainbow else COLOR_CODES.get(bubble.color["main"], RAINBOW_CODE)
+            board.cells[(bubble.row - game.row_origin) * GRID_COLS + bubble.col] = code
+        return board
+    
+    def copy(self):
+        board = SimBoard(bytearray(self.cells), self.rows, self.cols, self.parity)
+        board.settled = self.settled
+        return board
+    
+    def count(self):
+        return len(self.cells) - self.cells.count(0)
+    
+    def present_codes(self):
+        return sorted(code for code in set(self.cells) if code and code != RAINBOW_CODE)
+    
+    def reaches_bottom(self):
+        # Game over rule: anything in the last row
+        return any(self.cells[(self.rows - 1) * self.cols:])
+    
+    def group(self, start):
+        # Cells connected to start by matching colors (rainbows match anything)
+        cells = self.cells
+        neighbors = self.neighbors
+        seen = {start}
+        stack = [start]
+        while stack:
+            index = stack.pop()
+            code = cells[index]
+            for other in neighbors[index]:
+                if other in seen:
+                    continue
+                other_code = cells[other]
+                if other_code and (other_code == code or code == RAINBOW_CODE or other_code == RAINBOW_CODE):
+                    seen.add(other)
+                    stack.append(other)
+        return seen
+    
+    def rainbow_group(self, start):
+        # A rainbow shot takes whichever neighbour color matches the most
+        cells = self.cells
+        best = {start}
+        for other in self.neighbors[start]:
+            code = cells[other]
+            if code and code != RAINBOW_CODE:
+                cells[start] = code
+                group = self.group(start)
+                if len(group) > len(best):
+                    best = group
+        cells[start] = RAINBOW_CODE
+        return best
+    
+    def floating(self):
+        # Occupied cells no longer connected to the top row
+        cells = self.cells
+        neighbors = self.neighbors
+        anchored = bytearray(len(cells))
+        stack = [i for i in range(self.cols) if cells[i]]
+        for index in stack:
+            anchored[index] = 1
+        while stack:
+            index = stack.pop()
+            for other in neighbors[index]:
+                if cells[other] and not anchored[other]:
+                    anchored[other] = 1
+                    stack.append(other)
+        return [i for i, code in enumerate(cells) if code and not anchored[i]]
+    
+    def attach(self, index, code):
+        # Place a bubble and resolve matches and drops like attach_bubble,
+        # returning the popped and dropped cell indices
+        cells = self.cells
+        cells[index] = code
+        group = self.rainbow_group(index) if code == RAINBOW_CODE else self.group(index)
+        popped = []
+        if len(group) >= 3:
+            popped = list(group)
+            for other in popped:
+                cells[other] = 0
+        elif self.settled and (index < self.cols or any(cells[other] for other in self.neighbors[index])):
+            # Nothing was removed and the new bubble hangs on to the board
+            return popped, []
+        dropped = self.floating()
+        for other in dropped:
+            cells[other] = 0
+        self.settled = True
+        return popped, dropped
+    
+    def frontier(self):
+        # Empty cells a shot can come to rest in: touching the ceiling or a
+        # bubble, and reachable from the bottom row through empty cells
+        cells = self.cells
+        neighbors = self.neighbors
+        reachable = bytearray(len(cells))
+        stack = [i for i in range((self.rows - 1) * self.cols, len(cells)) if not cells[i]]
+        for index in stack:
+            reachable[index] = 1
+        while stack:
+            index = stack.pop()
+            for other in neighbors[index]:
+                if not cells[other] and not reachable[other]:
+                    reachable[other] = 1
+                    stack.append(other)
+        return [i for i in range(len(cells))
+                if reachable[i] and (i < self.cols or any(cells[other] for other in neighbors[i]))]
+
+class ShotAnalyzer:
+    # Batched what-if evaluation of shots against one board state. Same-colour
+    # components are labelled once per board so most candidates are scored
+    # from component sizes; results are memoised per landing cell and color.
+    # With a ShotPool, big batches of angles are traced by its workers.
+    def __init__(self, pool=None):
+        self.key = None
+        self.board = None
+        self.memo = {}
+        self.pool = pool
+        self.shared = None  # Pool version holding this board
+    
+    def update(self, game):
+        # Rebuild only when the board, combo or pending row push changed
+        push_pending = game.push_pending()
+        key = (game.board_version, game.combo, game.row_origin, push_pending)
+        if key != self.key:
+            self.key = key
+            self.load(SimBoard.from_game(game), game.combo, game.row_origin, push_pending)
+        return self
+    
+    def load(self, board, combo=0, row_origin=0, push_pending=False):
+        # Analyse a SimBoard directly (bots and analytics without a Game)
+        self.board = board
+        self.combo = combo
+        self.row_origin = row_origin  # World row of the board's first row
+        self.memo = {}
+        self.shared = None
+        cells = board.cells
+        neighbors = board.neighbors
+        
+        # Same-colour components; wild ones touch a rainbow, which can
+        # bridge groups of any colour, so those fall back to a flood fill
+        self.labels = labels = [-1] * len(cells)
+        self.members = []
+        self.wild = []
+        for start, code in enumerate(cells):
+            if not code or code == RAINBOW_CODE or labels[start] != -1:
+                continue
+            label = len(self.members)
+            members = [start]
+            wild = False
+            labels[start] = label
+            stack = [start]
+            while stack:
+                index = stack.pop()
+                for other in neighbors[index]:
+                    other_code = cells[other]
+                    if other_code == RAINBOW_CODE:
+                        wild = True
+                    elif other_code == code and labels[other] == -1:
+                        labels[other] = label
+                        members.append(other)
+                        stack.append(other)
+            self.members.append(members)
+            self.wild.append(wild)
+        
+        # Bubbles already cut off from the ceiling (random boards can start
+        # with some); they fall on the next attach whatever it hits
+        self.floating = board.floating()
+        
+        # Game over once anything is left at or below this row (a pending
+        # endless push moves everything down one more row)
+        self.limit_row = board.rows - (2 if push_pending else 1)
+        self.below_limit = sum(1 for code in cells[self.limit_row * board.cols:] if code)
+        return self
+    
+    def view(self, board, row_origin=0):
+        # Trace-only use of a board, without the labelling load does, for
+        # pool workers reading a shared board they must not write to
+        self.board = board
+        self.row_origin = row_origin
+        return self
+    
+    def landing_cell(self, x, y):
+        # Board index a shot stopping at screen (x, y) attaches to, following
+        # Game.find_landing_cell, or None
+        board = self.board
+        row = int((y + self.row_origin * GRID_SIZE) / GRID_SIZE)
+        col = int((x - BUBBLE_RADIUS) / GRID_SIZE) if row % 2 == 0 else int(x / GRID_SIZE)
+        row -= self.row_origin
+        if not (0 <= row < board.rows and 0 <= col < board.cols):
+            return None
+        index = row * board.cols + col
+        if board.cells[index]:
+            for other in board.neighbors[index]:
+                if not board.cells[other]:
+                    return other
+            return None
+        return index
+    
+    def trace(self, angle, speed=SHOOT_SPEED):
+        # Bounce path and landing index of a shot at this angle
+        board = self.board
+        
+        def is_occupied(r, c):
+            r -= self.row_origin
+            return 0 <= r < board.rows and 0 <= c < board.cols and board.cells[r * board.cols + c] != 0
+        
+        path, stop = trace_shot(angle, is_occupied, speed, scroll_y=self.row_origin * GRID_SIZE)
+        return path, self.landing_cell(*stop) if stop is not None else None
+    
+    def group(self, index, code):
+        # Match set for a bubble of this code placed at an empty index
+        board = self.board
+        cells = board.cells
+        by_color = {}  # Code -> adjacent component ids, in neighbour order
+        for other in board.neighbors[index]:
+            other_code = cells[other]
+            if not other_code:
+                continue
+            if code != RAINBOW_CODE and other_code != code and other_code != RAINBOW_CODE:
+                continue
+            label = self.labels[other]
+            if label == -1 or self.wild[label]:
+                break
+            ids = by_color.setdefault(other_code, [])
+            if label not in ids:
+                ids.append(label)
+        else:
+            best = []
+            for ids in by_color.values():
+                size = sum(len(self.members[label]) for label in ids)
+                if size > len(best):
+                    best = [cell for label in ids for cell in self.members[label]]
+            return [index] + best
+        
+        # Rainbows involved: flood fill with the bubble in place
+        cells[index] = code
+        group = board.rainbow_group(index) if code == RAINBOW_CODE else board.group(index)
+        cells[index] = 0
+        return list(group)
+    
+    def evaluate(self, index, code):
+        # Outcome of a bubble of this code attaching at board index, using
+        # the attach_bubble rules. None means the shot does not attach.
+        if index is None:
+            return {"cell": None, "matches": 0, "popped": [], "dropped": [], "score": 0, "game_over": False}
+        result = self.memo.get((index, code))
+        if result is not None:
+            return result
+        
+        board = self.board
+        cells = board.cells
+        cols = board.cols
+        group = self.group(index, code)
+        popped = group if len(group) >= 3 else []
+        
+        if popped or self.floating:
+            # Flood from the ceiling with the shot in place and the matched
+            # cells taken out
+            removed = bytearray(len(cells))
+            for other in popped:
+                removed[other] = 1
+            cells[index] = code
+            anchored = bytearray(len(cells))
+            stack = [i for i in range(cols) if cells[i] and not removed[i]]
+            for other in stack:
+                anchored[other] = 1
+            while stack:
+                other = stack.pop()
+                for next_index in board.neighbors[other]:
+                    if cells[next_index] and not anchored[next_index] and not removed[next_index]:
+                        anchored[next_index] = 1
+                        stack.append(next_index)
+            dropped = [i for i, c in enumerate(cells) if c and not anchored[i] and not removed[i]]
+            cells[index] = 0
+        elif index < cols or any(cells[other] for other in board.neighbors[index]):
+            dropped = []
+        else:
+            # Nothing to hang on to, the shot itself falls
+            dropped = [index]
+        
+        score = 0
+        if popped:
+            score += len(popped) * 10 * min(5, self.combo + 1)
+        score += len(dropped) * 5
+        
+        limit = self.limit_row * cols
+        left = self.below_limit + (index >= limit)
+        left -= sum(1 for other in popped if other >= limit)
+        left -= sum(1 for other in dropped if other >= limit)
+        
+        def to_world(other):
+            row, col = divmod(other, cols)
+            return row + self.row_origin, col
+        
+        result = {"cell": to_world(index), "matches": len(group),
+                  "popped": [to_world(other) for other in popped],
+                  "dropped": [to_world(other) for other in dropped],
+                  "score": score, "game_over": left > 0}
+        self.memo[(index, code)] = result
+        return result
+    
+    def evaluate_cells(self, indices, code):
+        # One outcome per candidate landing index
+        return [self.evaluate(index, code) for index in indices]
+    
+    def evaluate_angles(self, angles, code, speed=SHOOT_SPEED):
+        # One outcome per candidate angle, with the bounce path added
+        if self.pool is not None and len(angles) >= self.pool.min_batch:
+            if self.shared is None or self.shared != self.pool.version:
+                self.shared = self.pool.load(self.board, self.row_origin)
+            traces = [trace or self.trace(angle, speed)
+                      for angle, trace in zip(angles, self.pool.trace_angles(angles, speed))]
+        else:
+            traces = [self.trace(angle, speed) for angle in angles]
+        return [dict(self.evaluate(index, code), path=path) for path, index in traces]
+
+class SharedBoard:
+    # Board cells in shared memory for pool workers: a header (version, rows,
+    # cols, parity, row origin) then one byte per cell. Pass the name of an
+    # existing block to attach to it instead of creating one.
+    HEADER = struct.Struct("<IHHBi")
+    
+    def __init__(self, name=None, rows=GRID_ROWS, cols=GRID_COLS):
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.HEADER.size + rows * cols)
+            self.HEADER.pack_into(self.memory.buf, 0, 0, rows, cols, 0, 0)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.cells = None  # View handed out by view()
+    
+    def write(self, board, row_origin=0):
+        # Copy a SimBoard in and bump the version; returns the new version
+        version = self.HEADER.unpack_from(self.memory.buf, 0)[0] + 1
+        start = self.HEADER.size
+        self.memory.buf[start:start + len(board.cells)] = board.cells
+        self.HEADER.pack_into(self.memory.buf, 0, version, board.rows, board.cols, board.parity, row_origin)
+        return version
+    
+    def view(self):
+        # (version, SimBoard, row origin) with the cells read in place, not
+        # copied; only valid until the next write and never to be written to
+        version, rows, cols, parity, row_origin = self.HEADER.unpack_from(self.memory.buf, 0)
+        if self.cells is None or len(self.cells) != rows * cols:
+            self.release()
+            start = self.HEADER.size
+            self.cells = self.memory.buf[start:start + rows * cols]
+        return version, SimBoard(self.cells, rows, cols, parity), row_origin
+    
+    def release(self):
+        if self.cells is not None:
+            self.cells.release()
+            self.cells = None
+    
+    def close(self):
+        self.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+shot_worker = {}  # Per worker process: the shared blocks and a trace-only analyzer
+
+def attach_shot_worker(board_name, angles_name, results_name):
+    # Pool initializer: map the shared blocks once per worker
+    shot_worker["board"] = SharedBoard(board_name)
+    shot_worker["angles_memory"] = shared_memory.SharedMemory(name=angles_name)
+    shot_worker["results_memory"] = shared_memory.SharedMemory(name=results_name)
+    shot_worker["angles"] = shot_worker["angles_memory"].buf.cast("d")
+    shot_worker["analyzer"] = ShotAnalyzer()
+    shot_worker["version"] = None
+
+def trace_shot_range(task):
+    # Pool worker: trace candidates start..stop of the shared angle buffer
+    # against the shared board and pack landing cells and paths into the
+    # shared result buffer
+    version, speed, start, stop = task
+    analyzer = shot_worker["analyzer"]
+    if shot_worker["version"] != version:
+        shot_worker["version"], board, row_origin = shot_worker["board"].view()
+        analyzer.view(board, row_origin)
+    angles = shot_worker["angles"]
+    results = shot_worker["results_memory"].buf
+    for i in range(start, stop):
+        path, index = analyzer.trace(angles[i], speed)
+        ShotPool.pack_result(results, i, path, index)
+    return stop - start
+
+class ShotPool:
+    # Process pool for fanning shot tracing out per move. The board,
+    # candidate angles and results all live in preallocated shared memory,
+    # so a batch costs one small task tuple per worker rather than pickled
+    # game state. Workers only trace; the caller scores each landing cell
+    # once (see ShotAnalyzer.evaluate_angles).
+    PATH_POINTS = 16  # Longest path kept; longer ones are traced again by the caller
+    RESULT = struct.Struct(f"<hB{2 * PATH_POINTS}d")  # Landing index (-1 for none), path length, path
+    
+    def __init__(self, capacity=1024, workers=None, min_batch=64):
+        self.capacity = capacity  # Most candidates per round trip
+        self.workers = workers or os.cpu_count() or 1
+        self.min_batch = min_batch  # Smaller batches are cheaper in process
+        self.board = SharedBoard()
+        self.angles_memory = shared_memory.SharedMemory(create=True, size=8 * capacity)
+        self.results_memory = shared_memory.SharedMemory(create=True, size=self.RESULT.size * capacity)
+        self.angles = self.angles_memory.buf.cast("d")
+        self.version = 0
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=attach_shot_worker,
+                                        initargs=(self.board.name, self.angles_memory.name, self.results_memory.name))
+    
+    @classmethod
+    def pack_result(cls, buffer, i, path, index):
+        length = len(path) if len(path) <= cls.PATH_POINTS else 0
+        points = [value for point in path[:length] for value in point]
+        points += [0.0] * (2 * cls.PATH_POINTS - len(points))
+        cls.RESULT.pack_into(buffer, i * cls.RESULT.size, -1 if index is None else index, length, *points)
+    
+    def load(self, board, row_origin=0):
+        # Share a board for the next batches; returns its version
+        self.version = self.board.write(board, row_origin)
+        return self.version
+    
+    def trace_angles(self, angles, speed=SHOOT_SPEED):
+        # (path, landing index or None) per angle for the board last loaded,
+        # or None where the path was too long to pass back
+        traces = []
+        for offset in range(0, len(angles), self.capacity):
+            batch = angles[offset:offset + self.capacity]
+            count = len(batch)
+            for i, angle in enumerate(batch):
+                self.angles[i] = angle
+            
+            # One contiguous range per worker
+            chunk = max(1, -(-count // self.workers))
+            futures = [self.pool.submit(trace_shot_range, (self.version, speed, start, min(start + chunk, count)))
+                       for start in range(0, count, chunk)]
+            for future in futures:
+                future.result()
+            
+            for i, angle in enumerate(batch):
+                index, length, *points = self.RESULT.unpack_from(self.results_memory.buf, i * self.RESULT.size)
+                if not length:
+                    traces.append(None)
+                    continue
+                path = [(points[2 * n], points[2 * n + 1]) for n in range(length)]
+                traces.append((path, None if index == -1 else index))
+        return traces
+    
+    def close(self):
+        self.pool.shutdown()
+        self.angles.release()
+        for memory in (self.angles_memory, self.results_memory):
+            memory.close()
+            memory.unlink()
+        self.board.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+class LevelGenerator:
+    VERSION = 1  # Bump when generated layouts change, to invalidate cached packs
+    
+    def __init__(self, difficulty, colors=None, rows=None, density=None, cluster=None, max_shots=None):
+        # Difficulty 1-10 picks defaults; any parameter can be overridden
+        difficulty = max(1, min(10, difficulty))
+        self.difficulty = difficulty
+        self.colors = colors or min(len(BUBBLE_COLORS), 3 + difficulty // 2)
+        self.rows = rows or min(GRID_ROWS - 4, 3 + difficulty // 2)
+        self.density = density if density is not None else min(0.95, 0.6 + 0.035 * difficulty)
+        self.cluster = cluster if cluster is not None else max(0.15, 0.75 - 0.06 * difficulty)
+        self.max_shots = max_shots or 25 + 5 * difficulty
+    
+    def params(self):
+        return {"version": self.VERSION, "difficulty": self.difficulty, "colors": self.colors,
+                "rows": self.rows, "density": self.density, "cluster": self.cluster,
+                "max_shots": self.max_shots}
+    
+    def candidate(self, rng):
+        board = SimBoard()
+        cells = board.cells
+        palette = rng.sample(range(1, len(BUBBLE_COLORS) + 1), self.colors)
+        for row in range(self.rows):
+            for col in range(GRID_COLS):
+                if rng.random() > self.density:
+                    continue
+                index = row * GRID_COLS + col
+                # Grow clusters by copying an already placed neighbour
+                placed = [cells[other] for other in board.neighbors[index] if other < index and cells[other]]
+                if placed and rng.random() < self.cluster:
+                    cells[index] = rng.choice(placed)
+                else:
+                    cells[index] = rng.choice(palette)
+        
+        # Nothing may start out floating
+        for index in board.floating():
+            cells[index] = 0
+        return board
+    
+    def is_interesting(self, board):
+        codes = board.present_codes()
+        return len(codes) == self.colors and board.count() >= self.rows * GRID_COLS * self.density * 0.8
+    
+    def solve_greedy(self, board, rng):
+        # Fast check that the board can be cleared: shoot colors drawn from
+        # those still on the board and take the best landing cell each time.
+        # Returns the number of shots used, or None if it fails.
+        board = board.copy()
+        for shot in range(1, self.max_shots + 1):
+            code = rng.choice(board.present_codes())
+            best = None
+            best_key = None
+            for index in board.frontier():
+                trial = board.copy()
+                popped, dropped = trial.attach(index, code)
+                if trial.reaches_bottom():
+                    continue
+                same = sum(1 for other in board.neighbors[index] if board.cells[other] == code)
+                key = (len(popped) + len(dropped), same, -index)
+                if best_key is None or key > best_key:
+                    best, best_key = trial, key
+            if best is None:
+                return None
+            board = best
+            if not board.count():
+                return shot
+        return None
+    
+    def generate(self, seed, attempts=200):
+        # Deterministic for a given seed and parameters
+        rng = random.Random(seed)
+        for _ in range(attempts):
+            board = self.candidate(rng)
+            if not self.is_interesting(board):
+                continue
+            shots = self.solve_greedy(board, rng)
+            if shots is not None:
+                return {"seed": seed, "difficulty": self.difficulty, "colors": self.colors,
+                        "par": shots, "cells": list(board.cells)}
+        return None
+
+zobrist_tables = {}
+
+def get_zobrist_table(size):
+    # Random 64-bit key per (cell, code), plus one per queue position, for
+    # incrementally hashing boards. Fixed seed so hashes are reproducible.
+    if size not in zobrist_tables:
+        rng = random.Random(0x5EED)
+        cells = [[rng.getrandbits(64) for _ in range(len(BUBBLE_COLORS) + 1)] + [rng.getrandbits(64)]
+                 for _ in range(size)]
+        queue = [rng.getrandbits(64) for _ in range(1024)]
+        zobrist_tables[size] = (cells, queue)
+    return zobrist_tables[size]
+
+def zobrist_slot(code):
+    # Column of the Zobrist table for a cell code (rainbow gets the last one)
+    return len(BUBBLE_COLORS) + 1 if code == RAINBOW_CODE else code
+
+class PuzzleSolver:
+    # Finds the fewest shots that clear a board for a known bubble queue,
+    # using iterative deepening over landing cells. Positions are hashed
+    # with Zobrist keys into a fixed-size transposition table that remembers
+    # how deep a position was searched without finding a clear.
+    def __init__(self, queue, max_depth=None, table_bits=18, node_limit=None, max_moves=None):
+        self.queue = list(queue)  # Cell code of each upcoming shot
+        self.max_depth = min(max_depth or len(self.queue), len(self.queue))
+        self.mask = (1 << table_bits) - 1
+        self.table = [None] * (1 << table_bits)  # (key, depth searched) per slot
+        self.node_limit = node_limit  # Give up after this many nodes
+        self.max_moves = max_moves  # Only try the best ordered moves (bounded search)
+        self.nodes = 0
+        self.aborted = False
+        self.depth = 0  # Deepest iteration finished without a clear: no clear in this many shots or fewer
+    
+    def hash_board(self, board):
+        cell_keys, _ = get_zobrist_table(len(board.cells))
+        h = 0
+        for index, code in enumerate(board.cells):
+            if code:
+                h ^= cell_keys[index][zobrist_slot(code)]
+        return h
+    
+    def solve(self, board):
+        # Returns the landing cells of a shortest clearing sequence, [] for
+        # an empty board, or None if none exists within max_depth (or the
+        # node limit was hit, see self.aborted)
+        if not board.count():
+            return []
+        root = self.hash_board(board)
+        for depth in range(1, self.max_depth + 1):
+            path = self.search(board, root, 0, depth)
+            if path is not None or self.aborted:
+                return path
+            self.depth = depth
+        return None
+    
+    def search(self, board, h, pos, remaining):
+        cell_keys, queue_keys = get_zobrist_table(len(board.cells))
+        key = h ^ queue_keys[pos]
+        slot = key & self.mask
+        entry = self.table[slot]
+        if entry is not None and entry[0] == key and entry[1] >= remaining:
+            return None
+        
+        self.nodes += 1
+        if self.node_limit and self.nodes > self.node_limit:
+            self.aborted = True
+            return None
+        
+        code = self.queue[pos]
+        code_slot = zobrist_slot(code)
+        cells = board.cells
+        children = []
+        for index in board.frontier():
+            if remaining == 1 and code != RAINBOW_CODE:
+                # Last shot: only a match can clear the board, so skip the copy otherwise
+                cells[index] = code
+                matches = len(board.group(index))
+                cells[index] = 0
+                if matches < 3:
+                    continue
+            child = board.copy()
+            popped, dropped = child.attach(index, code)
+            if child.reaches_bottom():
+                continue
+            if popped and not child.count():
+                return [index]
+            
+            child_hash = h ^ cell_keys[index][code_slot]
+            for other in popped + dropped:
+                child_hash ^= cell_keys[other][code_slot if other == index else zobrist_slot(cells[other])]
+            
+            # Move ordering: biggest clears first, then shots that build groups
+            same = sum(1 for other in board.neighbors[index] if cells[other] == code)
+            children.append((-(len(popped) + len(dropped)), -same, index, child, child_hash))
+        
+        if remaining > 1:
+            children.sort(key=lambda child: child[:3])
+            for _, _, index, child, child_hash in children[:self.max_moves]:
+                path = self.search(child, child_hash, pos + 1, remaining - 1)
+                if path is not None:
+                    return [index] + path
+                if self.aborted:
+                    return None
+        
+        self.table[slot] = (key, remaining)
+        return None
+
+# Nodes per level when rating. Measured on generated packs (difficulty
+# 1-10): exhaustive depth 4 finishes within 6k nodes, while depth 5 takes
+# 28k-115k (10-30 s), so a bigger budget mostly ends mid-iteration.
+RATE_NODE_LIMIT = 8000
+
+def rate_level(job):
+    # Process pool worker: job is (level number, cells, seed, par, max_depth, node_limit).
+    # The queue is drawn from the level's colors with the level seed.
+    # "solved" levels have an exact shot count; otherwise min_shots is the
+    # proven lower bound and the greedy par from the pack the upper bound.
+    number, cells, seed, par, max_depth, node_limit = job
+    board = SimBoard(bytearray(cells))
+    rng = random.Random(seed)
+    codes = board.present_codes()
+    solver = PuzzleSolver([rng.choice(codes) for _ in range(max_depth)], max_depth, node_limit=node_limit)
+    start = time.time()
+    path = solver.solve(board)
+    if path is not None:
+        status = "solved"
+    elif solver.aborted:
+        status = "aborted"  # Node limit hit
+    else:
+        status = "too_deep"  # No clear within max_depth shots
+    return {"level": number, "status": status, "shots": len(path) if path is not None else None,
+            "min_shots": len(path) if path is not None else solver.depth + 1, "par": par,
+            "nodes": solver.nodes, "seconds": round(time.time() - start, 3)}
+
+def rate_level_pack(path, max_depth=8, node_limit=RATE_NODE_LIMIT, workers=None):
+    # Rate every level of a pack offline, one JSON line per level, then a
+    # summary line listing the levels of each status
+    with LevelPack(path) as pack:
+        jobs = [(n, bytes(pack.level(n)["cells"]), pack.level(n)["seed"], pack.level(n)["par"],
+                 max_depth, node_limit)
+                for n in range(1, len(pack) + 1)]
+    summary = {"solved": [], "aborted": [], "too_deep": []}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(rate_level, jobs):
+            summary[result["status"]].append(result["level"])
+            print(json.dumps(result))
+    print(json.dumps({"summary": summary}))
+
+class LevelPack:
+    # Binary level pack, read lazily through mmap. Layout (little endian):
+    #   header  magic, version, record size, level count, rows, cols, build key
+    #   index   one u32 file offset per level
+    #   records fixed size: seed, difficulty, colors, par, then rows*cols cell codes
+    MAGIC = b"PBLP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHIHHI")
+    RECORD = struct.Struct("<IBBH")
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.record_size, self.count, self.rows, self.cols, self.build_key = \
+            self.HEADER.unpack_from(self.data, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {self.VERSION} level pack")
+        # Levels are placed cell by cell on the game's grid
+        if (self.rows, self.cols) != (GRID_ROWS, GRID_COLS):
+            self.close()
+            raise ValueError(f"{path} has {self.rows}x{self.cols} levels, the grid is {GRID_ROWS}x{GRID_COLS}")
+        if not self.count:
+            self.close()
+            raise ValueError(f"{path} has no levels")
+        self.index_offset = self.HEADER.size
+    
+    @classmethod
+    def read_build_key(cls, path):
+        # Build key from the header only, for cache checks
+        try:
+            with open(path, 'rb') as f:
+                magic, version, _, _, _, _, build_key = cls.HEADER.unpack(f.read(cls.HEADER.size))
+        except (OSError, struct.error):
+            return None
+        return build_key if magic == cls.MAGIC and version == cls.VERSION else None
+    
+    @classmethod
+    def write(cls, path, levels, rows=GRID_ROWS, cols=GRID_COLS, build_key=0):
+        record_size = cls.RECORD.size + rows * cols
+        first_record = cls.HEADER.size + 4 * len(levels)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, record_size, len(levels), rows, cols, build_key))
+            f.write(struct.pack(f"<{len(levels)}I", *(first_record + i * record_size for i in range(len(levels)))))
+            for level in levels:
+                f.write(cls.RECORD.pack(level["seed"], level["difficulty"], level["colors"], level["par"]))
+                f.write(bytes(level["cells"]))
+        os.replace(tmp_path, path)
+    
+    def __len__(self):
+        return self.count
+    
+    def level(self, number):
+        # Levels are numbered from 1
+        if not 1 <= number <= self.count:
+            raise IndexError(f"level {number} not in pack ({self.count} levels)")
+        offset, = struct.unpack_from("<I", self.data, self.index_offset + 4 * (number - 1))
+        seed, difficulty, colors, par = self.RECORD.unpack_from(self.data, offset)
+        start = offset + self.RECORD.size
+        return {"seed": seed, "difficulty": difficulty, "colors": colors, "par": par,
+                "cells": self.data[start:start + self.rows * self.cols]}
+    
+    def close(self):
+        self.data.close()
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+def generate_level(job):
+    # Process pool worker: job is (difficulty, seed)
+    difficulty, seed = job
+    return LevelGenerator(difficulty).generate(seed)
+
+def build_level_pack(path, count, difficulty, max_difficulty=None, seed=0, workers=None):
+    # Generate count validated levels in parallel and write them to a pack
+    # file. An existing pack built with the same parameters is reused.
+    max_difficulty = max_difficulty or difficulty
+    jobs = []
+    for i in range(count):
+        level_difficulty = difficulty + (max_difficulty - difficulty) * i // max(1, count - 1)
+        jobs.append((level_difficulty, seed + i))
+    build = {"count": count, "difficulty": difficulty, "max_difficulty": max_difficulty,
+             "seed": seed, "generator": LevelGenerator.VERSION, "rows": GRID_ROWS, "cols": GRID_COLS}
+    build_key = zlib.crc32(json.dumps(build, sort_keys=True).encode())
+    
+    if LevelPack.read_build_key(path) == build_key:
+        print(f"Level pack {path} is up to date")
+        return path
+    
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        levels = list(pool.map(generate_level, jobs, chunksize=max(1, count // 64)))
+    levels = [level for level in levels if level is not None]
+    
+    LevelPack.write(path, levels, build_key=build_key)
+    print(f"Built {len(levels)}/{count} levels in {time.time() - start:.1f}s -> {path}")
+    return path
+
+ENDLESS_PUSH_SHOTS = 8  # Endless mode pushes a new row every this many shots...
+ENDLESS_PUSH_FRAMES = 60 * 20  # ...or after this many frames, whichever comes first
+
+def endless_row(rng, cluster=0.3):
+    # One endless mode row, generated only when it is pushed in
+    codes = list(range(1, len(BUBBLE_COLORS) + 1))
+    row = []
+    for col in range(GRID_COLS):
+        if row and rng.random() < cluster:
+            row.append(row[-1])
+        else:
+            row.append(rng.choice(codes))
+    return row
+
+# Gameplay events. Game emits these instead of creating effects or playing
+# sounds itself; presentation systems subscribe to the ones they draw.
+EVENT_SHOT = "shot"  # bubble, auto
+EVENT_ATTACHED = "attached"  # bubble
+EVENT_MATCHED = "matched"  # bubble, matches
+EVENT_POPPED = "popped"  # bubbles
+EVENT_DROPPED = "dropped"  # bubbles
+EVENT_EXPLODED = "exploded"  # kind, x, y, col, bubbles, radius
+EVENT_SCORED = "scored"  # x, y, points
+EVENT_POWERUP_SPAWNED = "powerup_spawned"  # powerup
+EVENT_POWERUP_COLLECTED = "powerup_collected"  # powerup, hit by a shot
+EVENT_POWERUP_STORED = "powerup_stored"  # powerup
+EVENT_POWERUP_ACTIVATED = "powerup_activated"  # powerup
+EVENT_MAGNET_PULL = "magnet_pull"  # bubble, target
+EVENT_GAME_OVER = "game_over"
+EVENT_LEVEL_STARTED = "level_started"  # level
+EVENT_ROW_PUSHED = "row_pushed"  # row
+
+# Player inputs, recorded by Game.apply_input for replays
+INPUT_AIM = "aim"  # Shooter angle in degrees
+INPUT_SHOOT = "shoot"
+INPUT_USE_POWERUP = "use_powerup"
+INPUT_SPAWN_POWERUP = "spawn_powerup"  # Powerup type (debug key)
+INPUT_AIM_ASSIST = "aim_assist"
+
+REPLAY_VERSION = 1
+
+class EventBus:
+    def __init__(self):
+        self.handlers = {}  # Event type -> list of handlers
+    
+    def subscribe(self, event_type, handler):
+        self.handlers.setdefault(event_type, []).append(handler)
+    
+    def unsubscribe(self, event_type, handler):
+        handlers = self.handlers.get(event_type)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+    
+    def emit(self, event_type, **data):
+        # Nothing is built for events nobody listens to
+        handlers = self.handlers.get(event_type)
+        if handlers:
+            for handler in handlers:
+                handler(**data)
+
+class Game:
+    def __init__(self, aim_assist=False, presentation=True, level_pack=None, level=1, endless=False, seed=None,
+                 record_inputs=False):
+        self.seed = seed if seed is not None else random.randrange(1 << 32)  # Gameplay randomness, for replays
+        self.aim_assist = aim_assist  # Show bounce path and predicted result
+        self.initial_aim_assist = aim_assist
+        self.presentation = presentation  # False for simulation-only games
+        self.level_pack = level_pack  # LevelPack to play, or None for a random board
+        self.start_level_number = level
+        self.endless = endless  # Push new rows in from the top
+        self.record_inputs = record_inputs  # Keep self.inputs for save_replay; it grows all game
+        self.events = EventBus()
+        self.scheduler = FrameScheduler()  # Deferred presentation work
+        if presentation:
+            EffectsPresenter(self)
+            SoundPresenter(self.events)
         self.reset_game()
     
     def reset_game(self):
-        self.grid = [[None for _ in range(GRID_COLS)] for _ in range(GRID_ROWS)]
-        self.bubbles = []  # All bubbles on the grid
+        # Everything that affects play draws from self.rng; effects keep
+        # using the global random module so they cannot change a replay
+        self.rng = random.Random(self.seed)
+        self.frames = 0  # Simulation steps so far
+        self.inputs = []  # (frame, kind, value) for every player input when recording, see apply_input
+        self.grid = RingGrid()  # Indexed by world row
+        self.row_origin = 0  # World row currently at the top of the grid
+        self.scroll_y = 0  # Pixel offset of the grid, row_origin * GRID_SIZE
+        self.bubbles = BubbleRegistry()  # All bubbles on the grid
         self.falling_bubbles = []  # Bubbles that are falling
         self.explosions = []  # Explosion animations
         self.particles = []  # Particle effects
@@ -585,8 +2304,9 @@ class Game:
         self.shooting_bubble = None
         self.next_bubble = self.create_random_bubble()
         self.score = 0
-        self.level = 1
+        self.level = self.start_level_number
         self.game_over = False
+        self.pack_complete = False  # Game over because the last pack level was cleared
         self.combo = 0  # Combo counter for consecutive matches
         self.active_powerup = None  # Currently active powerup effect
         self.powerup_timer = 0  # Timer for powerup effects
@@ -606,33 +2326,82 @@ class Game:
         self.stored_powerup = None  # Powerup stored for later use
         self.game_time = 0  # Game time in seconds
         self.shots_fired = 0  # Number of shots fired
+        self.board_version = 0  # Bumped whenever grid contents change
+        self.shots_since_push = 0
+        self.push_timer = ENDLESS_PUSH_FRAMES
+        self.aim_preview = AimPreview()
+        self.components = ColorComponents()  # Same-colour groups for the current board
+        self.analyzer = ShotAnalyzer()  # What-if shot outcomes for the current board
+        self.stats = BoardStats()  # Counts kept up to date on every grid change
         
         # Initialize the grid with bubbles
         self.initialize_grid()
     
     def initialize_grid(self):
+        if self.level_pack is not None:
+            self.load_level(self.level)
+            return
+        
         # Fill the top rows with bubbles
         rows_to_fill = min(5, GRID_ROWS)
         for row in range(rows_to_fill):
             for col in range(GRID_COLS):
                 # Skip some bubbles randomly for a more interesting pattern
-                if random.random() < 0.3:
+                if self.rng.random() < 0.3:
                     continue
                     
-                # Offset even rows
-                x_offset = BUBBLE_RADIUS if row % 2 == 0 else 0
-                x = col * GRID_SIZE + BUBBLE_RADIUS + x_offset
-                y = row * GRID_SIZE + BUBBLE_RADIUS
+                x, y = grid_to_pixel(row, col)
                 
-                color = random.choice(BUBBLE_COLORS)
-                bubble = Bubble(x, y, color)
-                bubble.row = row
-                bubble.col = col
-                self.bubbles.append(bubble)
-                self.grid[row][col] = bubble
+                color = self.rng.choice(BUBBLE_COLORS)
+                self.place_bubble(Bubble(x, y, color), row, col)
+    
+    def load_level(self, number):
+        # Replace the board with a level from the pack
+        self.unplace_bubbles(list(self.bubbles))
+        cells = self.level_pack.level(number)["cells"]
+        for index, code in enumerate(cells):
+            if code:
+                row, col = divmod(index, GRID_COLS)
+                row += self.row_origin
+                x, y = grid_to_pixel(row, col)
+                if code == RAINBOW_CODE:
+                    bubble = Bubble(x, y, RAINBOW_COLOR)
+                    bubble.is_rainbow = True
+                else:
+                    bubble = Bubble(x, y, BUBBLE_COLORS[code - 1])
+                self.place_bubble(bubble, row, col)
+        self.level = number
+        self.events.emit(EVENT_LEVEL_STARTED, level=number)
+    
+    def valid_cell(self, row, col):
+        return self.row_origin <= row < self.row_origin + GRID_ROWS and 0 <= col < GRID_COLS
+    
+    def place_bubble(self, bubble, row, col):
+        bubble.row = row
+        bubble.col = col
+        bubble.view = self
+        self.grid[row][col] = bubble
+        self.bubbles.add(bubble)
+        self.stats.add(bubble)
+        self.board_version += 1
+    
+    def unplace_bubbles(self, bubbles):
+        # Take bubbles off the grid in one batch, returning those that were on it
+        removed = self.bubbles.remove_many(bubbles)
+        for bubble in removed:
+            self.grid[bubble.row][bubble.col] = None
+            self.stats.remove(bubble)
+            
+            # Off the grid the bubble keeps its current screen position
+            screen_y = bubble.y
+            bubble.view = None
+            bubble.y = screen_y
+        if removed:
+            self.board_version += 1
+        return removed
     
     def create_random_bubble(self):
-        return Bubble(WIDTH // 2, SHOOTER_Y)
+        return Bubble(WIDTH // 2, SHOOTER_Y, self.rng.choice(BUBBLE_COLORS))
     
     def shoot_bubble(self, auto=False):
         if self.shooting_bubble is None and not self.game_over:
@@ -650,28 +2419,80 @@ class Game:
             # Increment shots fired counter
             if not auto:
                 self.shots_fired += 1
+                self.shots_since_push += 1
             
-            # Play sound
-            if sounds_loaded and not auto:
-                shoot_sound.play()
+            self.events.emit(EVENT_SHOT, bubble=self.shooting_bubble, auto=auto)
+    
+    def apply_input(self, kind, value=None):
+        # Every player action goes through here so it can be recorded and
+        # replayed on the same frame
+        if kind == INPUT_AIM:
+            angle = max(-MAX_ANGLE, min(MAX_ANGLE, value))
+            if angle == self.shooter_angle:
+                return
+            self.shooter_angle = angle
+        elif kind == INPUT_SHOOT:
+            if self.shooting_bubble is not None:
+                return
+            self.shoot_bubble()
+        elif kind == INPUT_USE_POWERUP:
+            if not self.stored_powerup:
+                return
+            self.activate_powerup(self.stored_powerup)
+            self.stored_powerup = None
+        elif kind == INPUT_SPAWN_POWERUP:
+            self.spawn_powerup(WIDTH // 2, HEIGHT // 2, value)
+        elif kind == INPUT_AIM_ASSIST:
+            self.aim_assist = not self.aim_assist
+        if self.record_inputs:
+            self.inputs.append((self.frames, kind, value))
+    
+    def save_replay(self, path):
+        replay = {"version": REPLAY_VERSION, "seed": self.seed, "endless": self.endless,
+                  "pack": self.level_pack.path if self.level_pack is not None else None, "level": self.start_level_number,
+                  "aim_assist": self.initial_aim_assist, "frames": self.frames, "inputs": self.inputs}
+        with open(path, 'w') as f:
+            json.dump(replay, f)
+    
+    def __getstate__(self):
+        # Replay keyframes pickle the game; the pack is reopened and the
+        # presenters re-subscribed by whoever restores it
+        state = self.__dict__.copy()
+        state["level_pack"] = None
+        state["events"] = EventBus()
+        state["scheduler"] = FrameScheduler()
+        state["inputs"] = []
+        return state
+    
+    def play_shot(self, angle, max_frames=600):
+        # Fire at this angle and step the simulation until the shot has
+        # landed, for headless sessions and bots
+        self.apply_input(INPUT_AIM, angle)
+        self.apply_input(INPUT_SHOOT)
+        for _ in range(max_frames):
+            if self.shooting_bubble is None:
+                break
+            self.update()
     
     def update(self):
+        self.frames += 1
+        if self.frames % 60 == 0:  # 60 FPS
+            self.game_time += 1
+        
         # Apply time slow effect if active
         time_factor = self.time_slow_factor if self.active_powerup == "time_slow" else 1.0
         
         # Update shooting bubble
         if self.shooting_bubble:
             # Apply time slow to shooting bubble
-            original_vx = self.shooting_bubble.vx
-            original_vy = self.shooting_bubble.vy
             self.shooting_bubble.vx *= time_factor
             self.shooting_bubble.vy *= time_factor
             
             self.shooting_bubble.update()
             
-            # Restore original velocity
-            self.shooting_bubble.vx = original_vx
-            self.shooting_bubble.vy = original_vy
+            # Restore original speed (keeping any wall bounce)
+            self.shooting_bubble.vx /= time_factor
+            self.shooting_bubble.vy /= time_factor
             
             # Check if bubble hits top
             if self.shooting_bubble.y - BUBBLE_RADIUS <= 0:
@@ -702,15 +2523,14 @@ class Game:
                 closest_bubble = None
                 closest_dist = float('inf')
                 
-                for bubble in self.bubbles:
-                    if bubble.color == self.shooting_bubble.color:
-                        dx = bubble.x - self.shooting_bubble.x
-                        dy = bubble.y - self.shooting_bubble.y
-                        dist = math.sqrt(dx*dx + dy*dy)
-                        
-                        if dist < closest_dist and dist < 200:  # Only attract within range
-                            closest_bubble = bubble
-                            closest_dist = dist
+                for bubble in self.stats.color_bubbles.get(self.shooting_bubble.color["main"], ()):
+                    dx = bubble.x - self.shooting_bubble.x
+                    dy = bubble.y - self.shooting_bubble.y
+                    dist = math.sqrt(dx*dx + dy*dy)
+                    
+                    if dist < closest_dist and dist < 200:  # Only attract within range
+                        closest_bubble = bubble
+                        closest_dist = dist
                 
                 # Apply attraction force
                 if closest_bubble:
@@ -730,15 +2550,7 @@ class Game:
                             self.shooting_bubble.vx = (self.shooting_bubble.vx / speed) * SHOOT_SPEED * 1.5
                             self.shooting_bubble.vy = (self.shooting_bubble.vy / speed) * SHOOT_SPEED * 1.5
                     
-                    # Add magnetic particles
-                    if random.random() < 0.2:
-                        mid_x = (self.shooting_bubble.x + closest_bubble.x) / 2
-                        mid_y = (self.shooting_bubble.y + closest_bubble.y) / 2
-                        self.particles.append(MagneticParticle(
-                            self.shooting_bubble.x, self.shooting_bubble.y,
-                            mid_x + random.uniform(-20, 20), mid_y + random.uniform(-20, 20),
-                            (255, 100, 200)
-                        ))
+                    self.events.emit(EVENT_MAGNET_PULL, bubble=self.shooting_bubble, target=closest_bubble)
         
         # Update falling bubbles
         for bubble in self.falling_bubbles[:]:
@@ -763,9 +2575,26 @@ class Game:
             if powerup.update(shooter_x, shooter_y):
                 self.powerups.remove(powerup)
             elif self.shooting_bubble and powerup.check_collision(self.shooting_bubble.x, self.shooting_bubble.y, self.shooting_bubble.radius):
+                self.events.emit(EVENT_POWERUP_COLLECTED, powerup=powerup)
                 self.activate_powerup(powerup)
                 self.powerups.remove(powerup)
         
+        # Endless mode pushes a row on a timer (shots are counted in attach_bubble)
+        if self.endless:
+            self.push_timer -= 1
+            if self.push_timer <= 0 and not self.shooting_bubble:
+                self.push_row()
+        
+        # Move on to the next pack level once the board is cleared; clearing
+        # the last one ends the game
+        if self.level_pack is not None and not self.stats.total and not self.game_over:
+            if self.level < len(self.level_pack):
+                self.load_level(self.level + 1)
+            else:
+                self.pack_complete = True
+                self.game_over = True
+                self.events.emit(EVENT_GAME_OVER)
+        
         # Update powerup timer
         if self.active_powerup:
             self.powerup_timer -= 1
@@ -778,6 +2607,11 @@ class Game:
                 
                 self.active_powerup = None
     
+    def spawn_powerup(self, x, y, powerup_type):
+        powerup = Powerup(x, y, powerup_type, trail=self.presentation)
+        self.powerups.append(powerup)
+        self.events.emit(EVENT_POWERUP_SPAWNED, powerup=powerup)
+    
     def activate_powerup(self, powerup):
         # If we already have a stored powerup and this isn't an instant effect,
         # store the new one and activate the old one
@@ -785,10 +2619,7 @@ class Game:
             old_powerup = self.stored_powerup
             self.stored_powerup = powerup
             
-            # Create a notification
-            self.particles.append(PowerupNotification(WIDTH - 100, 200, 
-                                                    f"{powerup.type.upper()} stored!",
-                                                    powerup.colors[powerup.type]))
+            self.events.emit(EVENT_POWERUP_STORED, powerup=powerup)
             
             # Activate the old powerup
             powerup = old_powerup
@@ -796,23 +2627,17 @@ class Game:
         self.active_powerup = powerup.type
         self.powerup_timer = 300  # 5 seconds at 60 FPS
         
-        # Create explosion effect
-        self.explosions.append(Explosion(powerup.x, powerup.y, powerup.colors[powerup.type]))
+        self.events.emit(EVENT_POWERUP_ACTIVATED, powerup=powerup)
         
         # Add score
         self.score += 50
-        self.add_score_popup(powerup.x, powerup.y, 50)
+        self.events.emit(EVENT_SCORED, x=powerup.x, y=powerup.y, points=50)
         
         # Update powerup stats
         self.powerup_collection_count += 1
         self.powerup_stats[powerup.type] += 1
         
-        # Debug print
-        print(f"Activated {powerup.type} powerup")
-        
-        # Play sound
-        if sounds_loaded:
-            pop_sound.play()
+        log.debug("powerup", "Activated %s powerup", powerup.type)
         
         # Apply powerup effect
         if powerup.type == "bomb":
@@ -825,14 +2650,9 @@ class Game:
             # Rainbow: Change shooting bubble to rainbow (matches any color)
             if self.shooting_bubble:
                 # Create rainbow color effect
-                rainbow_color = {
-                    "main": GOLD,
-                    "light": (255, 255, 150),
-                    "dark": (200, 150, 0)
-                }
-                self.shooting_bubble.color = rainbow_color
+                self.shooting_bubble.color = RAINBOW_COLOR
                 self.shooting_bubble.is_rainbow = True
-                print("Applied rainbow effect to shooting bubble")
+                log.debug("powerup", "Applied rainbow effect to shooting bubble")
                 
         elif powerup.type == "lightning":
             # Lightning: Clear a vertical column
@@ -867,7 +2687,8 @@ class Game:
         
         # Find all bubbles in blast radius
         bubbles_to_remove = []
-        for r in range(max(0, row - blast_radius), min(GRID_ROWS, row + blast_radius + 1)):
+        top = self.row_origin
+        for r in range(max(top, row - blast_radius), min(top + GRID_ROWS, row + blast_radius + 1)):
             for c in range(max(0, col - blast_radius), min(GRID_COLS, col + blast_radius + 1)):
                 if self.grid[r][c]:
                     # Check if within circular blast radius
@@ -876,21 +2697,8 @@ class Game:
                     if dr*dr + dc*dc <= blast_radius*blast_radius:
                         bubbles_to_remove.append(self.grid[r][c])
         
-        # Create explosion for each bubble
-        for bubble in bubbles_to_remove:
-            self.explosions.append(Explosion(bubble.x, bubble.y, bubble.color["main"]))
-            
-            # Add extra particles for bigger explosion
-            for _ in range(10):
-                angle = random.uniform(0, 2*math.pi)
-                distance = random.uniform(0, bubble.radius * 2)
-                particle_x = bubble.x + math.cos(angle) * distance
-                particle_y = bubble.y + math.sin(angle) * distance
-                self.particles.append(Particle(particle_x, particle_y, bubble.color["main"], random.uniform(2, 5)))
-        
-        # Create shockwave effect
-        for i in range(5):
-            self.particles.append(ShockwaveParticle(x, y, blast_radius * GRID_SIZE * (i+1) / 5))
+        self.events.emit(EVENT_EXPLODED, kind="bomb", x=x, y=y, col=col,
+                         bubbles=bubbles_to_remove, radius=blast_radius * GRID_SIZE)
         
         # Remove bubbles
         self.remove_bubbles(bubbles_to_remove)
@@ -898,49 +2706,27 @@ class Game:
         # Add score
         bomb_score = len(bubbles_to_remove) * 15
         self.score += bomb_score
-        self.add_score_popup(x, y, bomb_score)
+        self.events.emit(EVENT_SCORED, x=x, y=y, points=bomb_score)
         
         # Check for floating bubbles
         self.check_floating_bubbles()
     
     def apply_lightning_powerup(self):
-        # Find a column with the most bubbles
-        column_counts = [0] * GRID_COLS
-        for bubble in self.bubbles:
-            column_counts[bubble.col] += 1
-        
         # Find column with most bubbles
+        column_counts = self.stats.column_counts
         target_col = column_counts.index(max(column_counts))
         
         # Remove all bubbles in that column
         bubbles_to_remove = []
-        for r in range(GRID_ROWS):
+        for r in range(self.row_origin, self.row_origin + GRID_ROWS):
             if self.grid[r][target_col]:
                 bubbles_to_remove.append(self.grid[r][target_col])
         
-        # Create lightning effect
-        for y in range(0, HEIGHT, 10):  # More frequent lightning particles
-            x = target_col * GRID_SIZE + BUBBLE_RADIUS
-            if target_col % 2 == 1:
-                x += BUBBLE_RADIUS  # Offset for odd rows
-            
-            # Create lightning particle with random offset
-            offset = random.uniform(-10, 10)
-            self.particles.append(LightningParticle(x + offset, y))
-            
-            # Add some branching lightning
-            if random.random() < 0.2:
-                branch_x = x + random.uniform(-30, 30)
-                branch_y = y + random.uniform(-20, 20)
-                self.particles.append(LightningParticle(branch_x, branch_y))
-        
-        # Create explosion for each bubble
-        for bubble in bubbles_to_remove:
-            self.explosions.append(Explosion(bubble.x, bubble.y, bubble.color["main"]))
-            
-            # Add electric particles
-            for _ in range(5):
-                self.particles.append(ElectricParticle(bubble.x, bubble.y))
+        x = target_col * GRID_SIZE + BUBBLE_RADIUS
+        if target_col % 2 == 1:
+            x += BUBBLE_RADIUS  # Offset for odd rows
+        self.events.emit(EVENT_EXPLODED, kind="lightning", x=x, y=0, col=target_col,
+                         bubbles=bubbles_to_remove, radius=0)
         
         # Remove bubbles
         self.remove_bubbles(bubbles_to_remove)
@@ -949,48 +2735,46 @@ class Game:
         lightning_score = len(bubbles_to_remove) * 20
         self.score += lightning_score
         if bubbles_to_remove:
-            self.add_score_popup(bubbles_to_remove[0].x, bubbles_to_remove[0].y, lightning_score)
+            self.events.emit(EVENT_SCORED, x=bubbles_to_remove[0].x, y=bubbles_to_remove[0].y,
+                             points=lightning_score)
         
         # Check for floating bubbles
         self.check_floating_bubbles()
     
-    def attach_bubble(self, bubble):
+    def find_landing_cell(self, x, y):
         # Find the closest grid position
-        row, col = self.find_grid_position(bubble.x, bubble.y)
+        row, col = self.find_grid_position(x, y)
         
         # Ensure valid grid position
-        if row < 0 or row >= GRID_ROWS or col < 0 or col >= GRID_COLS:
-            self.shooting_bubble = None
-            return
+        if not self.valid_cell(row, col):
+            return None
         
         # If position is already occupied, find a nearby empty spot
         if self.grid[row][col]:
-            neighbors = self.get_neighbors(row, col)
-            for nrow, ncol in neighbors:
-                if 0 <= nrow < GRID_ROWS and 0 <= ncol < GRID_COLS and not self.grid[nrow][ncol]:
-                    row, col = nrow, ncol
-                    break
-            else:
-                # No empty spot found
-                self.shooting_bubble = None
-                return
+            for nrow, ncol in self.get_neighbors(row, col):
+                if self.valid_cell(nrow, ncol) and not self.grid[nrow][ncol]:
+                    return nrow, ncol
+            # No empty spot found
+            return None
         
-        # Adjust position to grid
-        x_offset = BUBBLE_RADIUS if row % 2 == 0 else 0
-        bubble.x = col * GRID_SIZE + BUBBLE_RADIUS + x_offset
-        bubble.y = row * GRID_SIZE + BUBBLE_RADIUS
-        bubble.row = row
-        bubble.col = col
+        return row, col
+    
+    def attach_bubble(self, bubble):
+        cell = self.find_landing_cell(bubble.x, bubble.y)
+        if cell is None:
+            self.shooting_bubble = None
+            return
+        row, col = cell
         
-        # Add to grid and bubbles list
-        self.grid[row][col] = bubble
-        self.bubbles.append(bubble)
+        # Adjust position to grid
+        bubble.x, bubble.y = grid_to_pixel(row, col)
+        self.place_bubble(bubble, row, col)
+        self.events.emit(EVENT_ATTACHED, bubble=bubble)
         
         # Check for matches
         matches = self.find_matches(bubble)
         
-        # Debug print
-        print(f"Found {len(matches)} matches")
+        log.debug("match", "Found %d matches", len(matches))
         
         if len(matches) >= 3:
             # Increase combo
@@ -1001,27 +2785,19 @@ class Game:
             match_score = len(matches) * 10 * combo_multiplier
             self.score += match_score
             
-            # Create score popup
-            self.add_score_popup(bubble.x, bubble.y, match_score)
-            
-            # Create explosions for each matched bubble
-            for match in matches:
-                self.explosions.append(Explosion(match.x, match.y, match.color["main"]))
+            self.events.emit(EVENT_SCORED, x=bubble.x, y=bubble.y, points=match_score)
+            self.events.emit(EVENT_MATCHED, bubble=bubble, matches=matches)
             
             # Remove matched bubbles
             self.remove_bubbles(matches)
             
             # Chance to spawn powerup (higher chance with bigger matches)
-            if random.random() < 0.1 + min(0.4, len(matches) * 0.05):
+            if self.rng.random() < 0.1 + min(0.4, len(matches) * 0.05):
                 # Choose a random powerup type
-                powerup_type = random.choice(["bomb", "rainbow", "lightning", "freeze"])
+                powerup_type = self.rng.choice(["bomb", "rainbow", "lightning", "freeze"])
                 
                 # Create powerup at bubble position
-                self.powerups.append(Powerup(bubble.x, bubble.y, powerup_type))
-            
-            # Play sound
-            if sounds_loaded:
-                pop_sound.play()
+                self.spawn_powerup(bubble.x, bubble.y, powerup_type)
         else:
             # Reset combo if no match
             self.combo = 0
@@ -1032,29 +2808,44 @@ class Game:
             # Add score for floating bubbles
             float_score = len(floating) * 5
             self.score += float_score
-            
-            # Create score popup
-            if floating:
-                self.add_score_popup(floating[0].x, floating[0].y, float_score)
-            
-            # Play sound
-            if sounds_loaded:
-                fall_sound.play()
+            self.events.emit(EVENT_SCORED, x=floating[0].x, y=floating[0].y, points=float_score)
         
         # Check for game over (bubbles reaching bottom)
-        for bubble in self.bubbles:
-            if bubble.row >= GRID_ROWS - 1:
-                self.game_over = True
-                if sounds_loaded:
-                    game_over_sound.play()
-                break
+        self.check_game_over()
         
         # Reset shooting bubble
         self.shooting_bubble = None
+        
+        if self.endless and self.shots_since_push >= ENDLESS_PUSH_SHOTS and not self.game_over:
+            self.push_row()
+    
+    def check_game_over(self):
+        if self.stats.lowest_row - self.row_origin >= GRID_ROWS - 1:
+            self.game_over = True
+            self.events.emit(EVENT_GAME_OVER)
+    
+    def push_pending(self):
+        # Whether the next shot is followed by an endless row push
+        return self.endless and self.shots_since_push + 1 >= ENDLESS_PUSH_SHOTS
+    
+    def push_row(self):
+        # Scroll everything down one row and fill the new top row. Only the
+        # scroll offset changes; existing bubbles keep their world rows.
+        self.row_origin -= 1
+        self.scroll_y = self.row_origin * GRID_SIZE
+        self.stats.set_top_row(self.row_origin)
+        for col, code in enumerate(endless_row(self.rng)):
+            if code:
+                x, y = grid_to_pixel(self.row_origin, col)
+                self.place_bubble(Bubble(x, y, BUBBLE_COLORS[code - 1]), self.row_origin, col)
+        self.shots_since_push = 0
+        self.push_timer = ENDLESS_PUSH_FRAMES
+        self.events.emit(EVENT_ROW_PUSHED, row=self.row_origin)
+        self.check_game_over()
     
     def find_grid_position(self, x, y):
-        # Convert pixel position to grid position
-        row = int(y / GRID_SIZE)
+        # Convert pixel position to grid position (world row)
+        row = int((y + self.scroll_y) / GRID_SIZE)
         
         # Adjust for offset in even rows
         if row % 2 == 0:
@@ -1065,26 +2856,8 @@ class Game:
         return row, col
     
     def get_neighbors(self, row, col):
-        neighbors = []
-        
         # Directions depend on whether row is even or odd
-        if row % 2 == 0:  # Even row
-            directions = [
-                (-1, -1), (-1, 0),  # Above
-                (0, -1), (0, 1),    # Left and right
-                (1, -1), (1, 0)     # Below
-            ]
-        else:  # Odd row
-            directions = [
-                (-1, 0), (-1, 1),  # Above
-                (0, -1), (0, 1),   # Left and right
-                (1, 0), (1, 1)     # Below
-            ]
-        
-        for dr, dc in directions:
-            neighbors.append((row + dr, col + dc))
-        
-        return neighbors
+        return [(row + dr, col + dc) for dr, dc in NEIGHBOR_DIRECTIONS[row % 2]]
     
     def find_matches(self, bubble):
         # Reset all marked flags
@@ -1093,50 +2866,51 @@ class Game:
         
         matches = []
         
-        # Handle rainbow bubble (matches any color)
+        # Handle rainbow bubble (takes the color that matches the most)
         if hasattr(bubble, 'is_rainbow') and bubble.is_rainbow:
-            # Find all adjacent bubbles
-            neighbors = []
-            for nrow, ncol in self.get_neighbors(bubble.row, bubble.col):
-                if 0 <= nrow < GRID_ROWS and 0 <= ncol < GRID_COLS and self.grid[nrow][ncol]:
-                    neighbors.append(self.grid[nrow][ncol])
-            
-            # If there are neighbors, pick the color with the most matches
-            if neighbors:
-                best_matches = []
-                for neighbor in neighbors:
-                    # Temporarily set the rainbow bubble to this color
-                    original_color = bubble.color
-                    bubble.color = neighbor.color
-                    
-                    # Find matches with this color
-                    temp_matches = []
-                    self.find_matching_neighbors(bubble, temp_matches)
-                    
-                    # Reset marked flags
-                    for b in self.bubbles:
-                        b.marked = False
-                    
-                    # Keep track of best matches
-                    if len(temp_matches) > len(best_matches):
-                        best_matches = temp_matches
-                    
-                    # Restore original color
-                    bubble.color = original_color
-                
-                # Use the best matches
-                matches = best_matches
-                
-                # Debug print
-                print(f"Rainbow bubble found {len(matches)} best matches")
+            best = self.components.update(self).best_rainbow_merge(self, bubble.row, bubble.col)
+            if best is not None:
+                matches = [bubble] + best
             else:
-                # No neighbors, just return the bubble itself
-                matches = [bubble]
+                # Other rainbow bubbles nearby, flood each candidate color
+                matches = self.find_rainbow_matches(bubble)
+            
+            log.debug("match", "Rainbow bubble found %d best matches", len(matches))
         else:
             # Normal matching
             self.find_matching_neighbors(bubble, matches)
         
-        return matches
+        return matches
+    
+    def largest_groups(self):
+        # Largest connected group per bubble color, for analytics and bots
+        return self.components.update(self).largest_by_color()
+    
+    def find_rainbow_matches(self, bubble):
+        # Find all adjacent bubbles
+        neighbors = []
+        for nrow, ncol in self.get_neighbors(bubble.row, bubble.col):
+            if self.valid_cell(nrow, ncol) and self.grid[nrow][ncol]:
+                neighbors.append(self.grid[nrow][ncol])
+        
+        # Try each neighbour's color as if the bubble were that color
+        best_matches = [bubble]
+        original_color = bubble.color
+        bubble.is_rainbow = False
+        for neighbor in neighbors:
+            bubble.color = neighbor.color
+            temp_matches = []
+            self.find_matching_neighbors(bubble, temp_matches)
+            
+            # Reset marked flags
+            for b in self.bubbles:
+                b.marked = False
+            
+            if len(temp_matches) > len(best_matches):
+                best_matches = temp_matches
+        bubble.color = original_color
+        bubble.is_rainbow = True
+        return best_matches
     
     def find_matching_neighbors(self, bubble, matches):
         if bubble is None or bubble.marked:
@@ -1148,7 +2922,7 @@ class Game:
         # Get neighbors
         neighbors = []
         for nrow, ncol in self.get_neighbors(bubble.row, bubble.col):
-            if 0 <= nrow < GRID_ROWS and 0 <= ncol < GRID_COLS:
+            if self.valid_cell(nrow, ncol):
                 neighbors.append(self.grid[nrow][ncol])
         
         # Check each neighbor
@@ -1169,14 +2943,9 @@ class Game:
                     self.find_matching_neighbors(neighbor, matches)
     
     def remove_bubbles(self, bubbles):
-        for bubble in bubbles:
-            if bubble in self.bubbles:
-                self.bubbles.remove(bubble)
-                self.grid[bubble.row][bubble.col] = None
-                
-                # Create particles
-                for _ in range(10):
-                    self.particles.append(Particle(bubble.x, bubble.y, bubble.color["main"]))
+        removed = self.unplace_bubbles(bubbles)
+        if removed:
+            self.events.emit(EVENT_POPPED, bubbles=removed)
     
     def check_floating_bubbles(self):
         # Mark all bubbles as not visited
@@ -1185,18 +2954,19 @@ class Game:
         
         # Mark all bubbles connected to the top
         for col in range(GRID_COLS):
-            if self.grid[0][col]:
-                self.mark_connected(self.grid[0][col])
+            if self.grid[self.row_origin][col]:
+                self.mark_connected(self.grid[self.row_origin][col])
         
         # Find all unmarked bubbles (floating)
         floating = [b for b in self.bubbles if not b.marked]
         
         # Make them fall
+        self.unplace_bubbles(floating)
         for bubble in floating:
             bubble.falling = True
             self.falling_bubbles.append(bubble)
-            self.bubbles.remove(bubble)
-            self.grid[bubble.row][bubble.col] = None
+        if floating:
+            self.events.emit(EVENT_DROPPED, bubbles=floating)
         
         return floating
     
@@ -1209,18 +2979,54 @@ class Game:
         # Mark all connected neighbors
         neighbors = []
         for nrow, ncol in self.get_neighbors(bubble.row, bubble.col):
-            if 0 <= nrow < GRID_ROWS and 0 <= ncol < GRID_COLS:
+            if self.valid_cell(nrow, ncol):
                 neighbors.append(self.grid[nrow][ncol])
         
         for neighbor in neighbors:
             if neighbor:
                 self.mark_connected(neighbor)
     
-    def add_score_popup(self, x, y, score):
-        # Create a score popup particle
-        for digit in str(score):
-            self.particles.append(ScoreParticle(x, y, digit))
-            x += 10  # Offset each digit
+    def predict_shot(self, angle, color, speed=SHOOT_SPEED):
+        # Work out where a shot at this angle lands and what it would pop
+        # and drop, using the same rules as attach_bubble without touching
+        # the board
+        code = COLOR_CODES.get(color["main"], RAINBOW_CODE)
+        return self.analyzer.update(self).evaluate_angles([angle], code, speed)[0]
+    
+    def aim_result(self):
+        return self.aim_preview.get(self)
+    
+    def draw_aim_preview(self):
+        preview = self.aim_result()
+        
+        # Dots along the reflected path, skipping the part inside the barrel
+        path = preview["path"]
+        travelled = 0
+        next_dot = 60
+        for (x1, y1), (x2, y2) in zip(path, path[1:]):
+            seg_len = math.hypot(x2 - x1, y2 - y1)
+            while seg_len > 0 and next_dot <= travelled + seg_len:
+                t = (next_dot - travelled) / seg_len
+                screen.circle((255, 255, 255),
+                              (int(x1 + (x2 - x1) * t), int(y1 + (y2 - y1) * t)), 2)
+                next_dot += 30
+            travelled += seg_len
+        
+        if preview["cell"] is None:
+            return
+        
+        def to_screen(row, col):
+            x, y = grid_to_pixel(row, col)
+            return x, y - self.scroll_y
+        
+        # Ghost bubble at the landing cell
+        screen.circle(self.next_bubble.color["main"], to_screen(*preview["cell"]), BUBBLE_RADIUS, 2)
+        
+        # Highlight what would pop and what would fall
+        for row, col in preview["popped"]:
+            screen.circle(WHITE, to_screen(row, col), BUBBLE_RADIUS - 2, 2)
+        for row, col in preview["dropped"]:
+            screen.circle(ORANGE, to_screen(row, col), BUBBLE_RADIUS - 2, 2)
     
     def draw(self):
         # Draw background
@@ -1229,16 +3035,14 @@ class Game:
         # Apply freeze effect if active
         if self.active_powerup == "freeze":
             # Draw freeze overlay
-            freeze_overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-            freeze_overlay.fill((200, 220, 255, 30))
-            screen.blit(freeze_overlay, (0, 0))
+            screen.tint((200, 220, 255, 30))
             
             # Add snowflakes
-            for _ in range(10):
+            for _ in range(quality.count(10) if quality.allows("snow") else 0):
                 x = random.randint(0, WIDTH)
                 y = random.randint(0, HEIGHT)
                 size = random.randint(1, 3)
-                pygame.draw.circle(screen, (255, 255, 255, 150), (x, y), size)
+                screen.circle((255, 255, 255, 150), (x, y), size)
         
         # Draw grid bubbles
         for bubble in self.bubbles:
@@ -1252,67 +3056,25 @@ class Game:
         if self.shooting_bubble:
             self.shooting_bubble.draw()
         
-        # Draw explosions
+        # Draw explosions, then particles, one batched blit per layer
+        batch = []
         for explosion in self.explosions:
-            explosion.draw()
+            explosion.submit(batch)
+        screen.blits(batch, False)
         
-        # Draw particles
+        batch = []
         for particle in self.particles:
-            particle.draw()
+            particle.submit(batch)
+        screen.blits(batch, False)
         
         # Draw powerups
         for powerup in self.powerups:
             powerup.draw()
         
-        # Draw next bubble
-        next_bubble_text = font.render("Next:", True, WHITE)
-        screen.blit(next_bubble_text, (WIDTH - 150, 50))
-        
-        # Draw next bubble with gradient
-        next_x, next_y = WIDTH - 100, 100
-        pygame.draw.circle(screen, self.next_bubble.color["dark"], (next_x, next_y), BUBBLE_RADIUS)
-        pygame.draw.circle(screen, self.next_bubble.color["main"], (next_x, next_y), BUBBLE_RADIUS - 3)
-        pygame.draw.circle(screen, self.next_bubble.color["light"], (next_x, next_y), BUBBLE_RADIUS - 6)
-        
-        # Draw stored powerup if available
-        if self.stored_powerup:
-            stored_text = font.render("Stored:", True, WHITE)
-            screen.blit(stored_text, (WIDTH - 150, 150))
-            
-            # Draw mini powerup
-            stored_x, stored_y = WIDTH - 100, 180
-            
-            # Create a temporary surface for the powerup
-            powerup_surf = pygame.Surface((BUBBLE_RADIUS*2, BUBBLE_RADIUS*2), pygame.SRCALPHA)
-            pygame.draw.circle(powerup_surf, self.stored_powerup.colors[self.stored_powerup.type], 
-                             (BUBBLE_RADIUS, BUBBLE_RADIUS), BUBBLE_RADIUS)
-            
-            # Draw the powerup icon
-            screen.blit(powerup_surf, (stored_x - BUBBLE_RADIUS, stored_y - BUBBLE_RADIUS))
-            
-            # Draw powerup name
-            powerup_names = {
-                "bomb": "BOMB",
-                "rainbow": "RAINBOW",
-                "lightning": "LIGHTNING",
-                "freeze": "FREEZE",
-                "magnet": "MAGNET",
-                "time_slow": "TIME SLOW",
-                "multi_shot": "MULTI-SHOT"
-            }
-            
-            name_text = font.render(powerup_names[self.stored_powerup.type], True, 
-                                  self.stored_powerup.colors[self.stored_powerup.type])
-            screen.blit(name_text, (WIDTH - 150, 210))
-            
-            # Draw use instruction
-            use_text = pygame.font.SysFont('Arial', 16).render("Press SPACE to use", True, WHITE)
-            screen.blit(use_text, (WIDTH - 150, 235))
-        
         # Draw shooter
         # Base
-        pygame.draw.circle(screen, (100, 100, 100), (WIDTH // 2, SHOOTER_Y), 25)
-        pygame.draw.circle(screen, (150, 150, 150), (WIDTH // 2, SHOOTER_Y), 20)
+        screen.circle((100, 100, 100), (WIDTH // 2, SHOOTER_Y), 25)
+        screen.circle((150, 150, 150), (WIDTH // 2, SHOOTER_Y), 20)
         
         # Barrel
         angle_rad = math.radians(self.shooter_angle)
@@ -1320,111 +3082,33 @@ class Game:
         end_y = SHOOTER_Y - 60 * math.cos(angle_rad)
         
         # Draw barrel with gradient
-        pygame.draw.line(screen, (100, 100, 100), (WIDTH // 2, SHOOTER_Y), (end_x, end_y), 12)
-        pygame.draw.line(screen, (150, 150, 150), (WIDTH // 2, SHOOTER_Y), (end_x, end_y), 8)
+        screen.line((100, 100, 100), (WIDTH // 2, SHOOTER_Y), (end_x, end_y), 12)
+        screen.line((150, 150, 150), (WIDTH // 2, SHOOTER_Y), (end_x, end_y), 8)
         
         # Draw aiming line
-        for i in range(10):
-            point_x = WIDTH // 2 + (i * 30 + 60) * math.sin(angle_rad)
-            point_y = SHOOTER_Y - (i * 30 + 60) * math.cos(angle_rad)
-            
-            if 0 <= point_x < WIDTH and 0 <= point_y < HEIGHT:
-                alpha = 255 - i * 25  # Fade out
-                pygame.draw.circle(screen, (255, 255, 255, alpha), (int(point_x), int(point_y)), 2)
-        
-        # Draw score and level with shadow effect
-        score_text = font.render(f"Score: {self.score}", True, WHITE)
-        level_text = font.render(f"Level: {self.level}", True, WHITE)
-        combo_text = font.render(f"Combo: x{self.combo}" if self.combo > 0 else "", True, (255, 255, 0))
-        time_text = font.render(f"Time: {self.game_time//60}:{self.game_time%60:02d}", True, WHITE)
-        shots_text = font.render(f"Shots: {self.shots_fired}", True, WHITE)
-        
-        # Draw text shadow
-        shadow_offset = 2
-        score_shadow = font.render(f"Score: {self.score}", True, BLACK)
-        level_shadow = font.render(f"Level: {self.level}", True, BLACK)
-        
-        screen.blit(score_shadow, (20 + shadow_offset, 20 + shadow_offset))
-        screen.blit(level_shadow, (20 + shadow_offset, 50 + shadow_offset))
-        
-        screen.blit(score_text, (20, 20))
-        screen.blit(level_text, (20, 50))
-        screen.blit(combo_text, (20, 80))
-        screen.blit(time_text, (20, 110))
-        screen.blit(shots_text, (20, 140))
-        
-        # Draw active powerup indicator
-        if self.active_powerup:
-            powerup_colors = {
-                "bomb": (255, 50, 50),
-                "rainbow": (255, 215, 0),
-                "lightning": (100, 100, 255),
-                "freeze": (200, 200, 255),
-                "magnet": (255, 105, 180),
-                "time_slow": (50, 205, 50),
-                "multi_shot": (0, 128, 128)
-            }
-            
-            powerup_names = {
-                "bomb": "BOMB",
-                "rainbow": "RAINBOW",
-                "lightning": "LIGHTNING",
-                "freeze": "FREEZE",
-                "magnet": "MAGNET",
-                "time_slow": "TIME SLOW",
-                "multi_shot": "MULTI-SHOT"
-            }
-            
-            # Draw powerup name with timer
-            powerup_text = font.render(f"Active: {powerup_names[self.active_powerup]}: {self.powerup_timer//60}s", 
-                                     True, powerup_colors[self.active_powerup])
-            screen.blit(powerup_text, (20, 170))
-            
-            # Draw additional info for multi-shot
-            if self.active_powerup == "multi_shot" and self.multi_shot_count > 0:
-                shots_text = font.render(f"Shots left: {self.multi_shot_count}", True, powerup_colors["multi_shot"])
-                screen.blit(shots_text, (20, 200))
-        
-        # Draw powerup collection stats in corner
-        if self.powerup_collection_count > 0:
-            stats_x = WIDTH - 180
-            stats_y = HEIGHT - 120
-            stats_text = font.render("Powerups:", True, WHITE)
-            screen.blit(stats_text, (stats_x, stats_y))
-            
-            # Draw mini icons for each collected powerup type
-            y_offset = 30
-            for powerup_type, count in self.powerup_stats.items():
-                if count > 0:
-                    # Draw mini powerup icon
-                    powerup_colors = {
-                        "bomb": (255, 50, 50),
-                        "rainbow": (255, 215, 0),
-                        "lightning": (100, 100, 255),
-                        "freeze": (200, 200, 255),
-                        "magnet": (255, 105, 180),
-                        "time_slow": (50, 205, 50),
-                        "multi_shot": (0, 128, 128)
-                    }
-                    
-                    pygame.draw.circle(screen, powerup_colors[powerup_type], 
-                                     (stats_x + 15, stats_y + y_offset), 10)
-                    
-                    # Draw count
-                    count_text = font.render(f"x{count}", True, WHITE)
-                    screen.blit(count_text, (stats_x + 30, stats_y + y_offset - 10))
-                    
-                    y_offset += 25
+        if self.aim_assist:
+            self.draw_aim_preview()
+        else:
+            for i in range(10):
+                point_x = WIDTH // 2 + (i * 30 + 60) * math.sin(angle_rad)
+                point_y = SHOOTER_Y - (i * 30 + 60) * math.cos(angle_rad)
+                
+                if 0 <= point_x < WIDTH and 0 <= point_y < HEIGHT:
+                    alpha = 255 - i * 25  # Fade out
+                    screen.circle((255, 255, 255, alpha), (int(point_x), int(point_y)), 2)
+        
+        # Score, timers, next bubble and powerup panels
+        hud.draw(self)
         
         # Draw game over
         if self.game_over:
-            overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 180))
-            screen.blit(overlay, (0, 0))
+            screen.tint((0, 0, 0, 180))
             
-            # Draw game over text with glow effect
+            # Draw game over text with glow effect; text comes from the sprite
+            # cache so it is rendered (and scaled) once, not every frame
+            title, title_color = ("Pack Complete!", (0, 255, 0)) if self.pack_complete else ("Game Over", (255, 0, 0))
+            game_over_glow = sprites.text(24, title, title_color + (50,))
             for offset in range(5, 0, -1):
-                game_over_glow = font.render("Game Over", True, (255, 0, 0, 50))
                 screen.blit(game_over_glow, 
                            (WIDTH // 2 - game_over_glow.get_width() // 2 + offset, 
                             HEIGHT // 2 - 100 + offset))
@@ -1432,14 +3116,14 @@ class Game:
                            (WIDTH // 2 - game_over_glow.get_width() // 2 - offset, 
                             HEIGHT // 2 - 100 - offset))
             
-            game_over_text = font.render("Game Over", True, (255, 0, 0))
-            final_score_text = font.render(f"Final Score: {self.score}", True, WHITE)
-            time_text = font.render(f"Time: {self.game_time//60}:{self.game_time%60:02d}", True, WHITE)
-            shots_text = font.render(f"Shots: {self.shots_fired}", True, WHITE)
-            efficiency_text = font.render(f"Efficiency: {int(self.score / max(1, self.shots_fired))} pts/shot", True, WHITE)
+            game_over_text = sprites.text(24, title, title_color)
+            final_score_text = sprites.text(24, f"Final Score: {self.score}", WHITE)
+            time_text = sprites.text(24, f"Time: {self.game_time//60}:{self.game_time%60:02d}", WHITE)
+            shots_text = sprites.text(24, f"Shots: {self.shots_fired}", WHITE)
+            efficiency_text = sprites.text(24, f"Efficiency: {int(self.score / max(1, self.shots_fired))} pts/shot", WHITE)
             
-            restart_text = font.render("Press R to restart", True, WHITE)
-            save_score_text = font.render("Press S to save score to leaderboard", True, (255, 255, 0))
+            restart_text = sprites.text(24, "Press R to restart", WHITE)
+            save_score_text = sprites.text(24, "Press S to save score to leaderboard", (255, 255, 0))
             
             screen.blit(game_over_text, (WIDTH // 2 - game_over_text.get_width() // 2, HEIGHT // 2 - 100))
             screen.blit(final_score_text, (WIDTH // 2 - final_score_text.get_width() // 2, HEIGHT // 2 - 60))
@@ -1450,6 +3134,220 @@ class Game:
             screen.blit(restart_text, (WIDTH // 2 - restart_text.get_width() // 2, HEIGHT // 2 + 70))
             screen.blit(save_score_text, (WIDTH // 2 - save_score_text.get_width() // 2, HEIGHT // 2 + 100))
 
+def clone(obj):
+    # Shallow copy of a plain object, cheaper than copy.copy and without
+    # going through __getstate__
+    copy = object.__new__(type(obj))
+    copy.__dict__.update(obj.__dict__)
+    return copy
+
+class GameSnapshot(Game):
+    # Frozen copy of everything Game.draw reads, so it can be drawn on one
+    # thread while the simulation keeps changing the live game on another.
+    # Whatever the simulation mutates in place is copied one level deep;
+    # the rest is shared.
+    def __init__(self, game):
+        self.__dict__.update(game.__dict__)
+        self.bubbles = []
+        for bubble in game.bubbles:
+            bubble = clone(bubble)
+            bubble.view = self  # Scroll offset as of this snapshot
+            self.bubbles.append(bubble)
+        self.falling_bubbles = [clone(bubble) for bubble in game.falling_bubbles]
+        if game.shooting_bubble:
+            self.shooting_bubble = clone(game.shooting_bubble)
+        self.explosions = [self.freeze_emitter(explosion) for explosion in game.explosions]
+        self.particles = [clone(particle) for particle in game.particles]
+        self.powerups = [self.freeze_emitter(powerup) for powerup in game.powerups]
+        self.powerup_stats = dict(game.powerup_stats)
+        # The preview runs the shot analyzer, which belongs to the simulation
+        self.preview = game.aim_result() if game.aim_assist else None
+    
+    @staticmethod
+    def freeze_emitter(emitter):
+        emitter = clone(emitter)
+        emitter.particles = [clone(particle) for particle in emitter.particles]
+        return emitter
+    
+    def aim_result(self):
+        return self.preview
+
+class SimulationThread:
+    # Runs the game at a fixed 60 Hz on its own thread, so a slow frame on
+    # the render side delays neither the simulation nor input. Inputs are
+    # queued and applied at the start of the next tick (and recorded on
+    # that frame, so replays stay exact). After every tick a fresh
+    # GameSnapshot is built in the back buffer and swapped to the front,
+    # where the render thread picks up the latest one.
+    def __init__(self, game, versus=None, rate=60):
+        self.game = game
+        self.versus = versus  # Polled each tick; its events fire on this thread
+        self.period = 1 / rate
+        self.inputs = queue.SimpleQueue()
+        self.paused = False  # Set while menus are up
+        self.running = True
+        self.lock = threading.Lock()
+        self.front = GameSnapshot(game)
+        self.thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+        self.thread.start()
+    
+    def apply_input(self, kind, value=None):
+        # Same call as Game.apply_input, from the render thread
+        self.inputs.put((kind, value))
+    
+    def snapshot(self):
+        with self.lock:
+            return self.front
+    
+    def run(self):
+        next_tick = time.perf_counter()
+        while self.running:
+            while not self.inputs.empty():
+                self.game.apply_input(*self.inputs.get())
+            if not self.paused and not self.game.game_over:
+                update_start = time.perf_counter()
+                self.game.update()
+                update_seconds.observe(time.perf_counter() - update_start)
+            if self.versus:
+                self.versus.update()
+            back = GameSnapshot(self.game)
+            with self.lock:
+                self.front = back
+            
+            # Deferred work gets the rest of the tick
+            next_tick += self.period
+            self.game.scheduler.run((next_tick - time.perf_counter()) * 1000)
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.period * 5:
+                next_tick = time.perf_counter()  # Too far behind to catch up; drop the backlog
+    
+    def stop(self):
+        # Joins, so the game is safe to read (e.g. saving its replay) afterwards
+        self.running = False
+        self.thread.join()
+        self.game.scheduler.flush()
+
+class HudWidget:
+    # A HUD element bound to a game value; its surface is re-rendered only
+    # when that value changes
+    UNSET = object()
+    
+    def __init__(self, pos, bind, render):
+        self.pos = pos
+        self.bind = bind  # Game -> value
+        self.render = render  # Value -> Surface, or None to draw nothing
+        self.value = HudWidget.UNSET
+        self.surface = None
+    
+    def update(self, game):
+        value = self.bind(game)
+        if value == self.value:
+            return False
+        self.value = value
+        self.surface = self.render(value)
+        return True
+
+class Hud:
+    # Retained-mode HUD: the widgets are composited into one cached surface
+    # that is rebuilt only when one of them changed, so a steady frame
+    # costs a single blit. The composite is per-pixel alpha and starts out
+    # transparent, so antialiased edges still blend with the game beneath.
+    # It is kept at the target's own size with the widgets scaled into it.
+    def __init__(self, widgets):
+        self.widgets = widgets
+        self.surface = None
+    
+    def draw(self, game):
+        changed = self.surface is None or self.surface.get_size() != screen.get_size()
+        for widget in self.widgets:
+            changed = widget.update(game) or changed
+        if changed:
+            # A fresh surface each time: one already RLE encoded does not
+            # blend the same when drawn on again
+            self.surface = pygame.Surface(screen.get_size(), pygame.SRCALPHA)
+            sequence = [(widget.surface, widget.pos) for widget in self.widgets if widget.surface]
+            if not screen.native:
+                sequence = [(screen.scale_surface(surface), screen.point(pos)) for surface, pos in sequence]
+            self.surface.blits(sequence, False)
+            self.surface.set_alpha(255, pygame.RLEACCEL)  # Blits skip the transparent runs
+        screen.surface.blit(self.surface, (0, 0))
+
+def render_text(text, color=WHITE, shadow=False):
+    surface = font.render(text, True, color)
+    if not shadow:
+        return surface
+    shadowed = pygame.Surface((surface.get_width() + 2, surface.get_height() + 2), pygame.SRCALPHA)
+    shadowed.blit(font.render(text, True, BLACK), (2, 2))
+    shadowed.blit(surface, (0, 0))
+    return shadowed
+
+def create_hud():
+    small_font = pygame.font.SysFont('Arial', 16)
+    
+    def next_panel(color):
+        # Label with the next bubble drawn as a gradient below it
+        panel = pygame.Surface((130, 80), pygame.SRCALPHA)
+        panel.blit(render_text("Next:"), (0, 0))
+        pygame.draw.circle(panel, color["dark"], (50, 50), BUBBLE_RADIUS)
+        pygame.draw.circle(panel, color["main"], (50, 50), BUBBLE_RADIUS - 3)
+        pygame.draw.circle(panel, color["light"], (50, 50), BUBBLE_RADIUS - 6)
+        return panel
+    
+    def stored_panel(kind):
+        if kind is None:
+            return None
+        panel = pygame.Surface((150, 110), pygame.SRCALPHA)
+        panel.blit(render_text("Stored:"), (0, 0))
+        pygame.draw.circle(panel, POWERUP_COLORS[kind], (50, 30), BUBBLE_RADIUS)
+        panel.blit(render_text(POWERUP_NAMES[kind], POWERUP_COLORS[kind]), (0, 60))
+        panel.blit(small_font.render("Press SPACE to use", True, WHITE), (0, 85))
+        return panel
+    
+    def active_panel(value):
+        # Active powerup with its remaining seconds, plus shots left for multi-shot
+        kind, seconds, shots_left = value
+        if kind is None:
+            return None
+        panel = pygame.Surface((400, 60), pygame.SRCALPHA)
+        panel.blit(render_text(f"Active: {POWERUP_NAMES[kind]}: {seconds}s", POWERUP_COLORS[kind]), (0, 0))
+        if shots_left > 0:
+            panel.blit(render_text(f"Shots left: {shots_left}", POWERUP_COLORS["multi_shot"]), (0, 30))
+        return panel
+    
+    def stats_panel(counts):
+        # Collected powerups by type, one mini icon and count per row
+        if not counts:
+            return None
+        panel = pygame.Surface((180, 30 + 25 * len(counts)), pygame.SRCALPHA)
+        panel.blit(render_text("Powerups:"), (0, 0))
+        for i, (kind, count) in enumerate(counts):
+            pygame.draw.circle(panel, POWERUP_COLORS[kind], (15, 30 + 25 * i), 10)
+            panel.blit(render_text(f"x{count}"), (30, 20 + 25 * i))
+        return panel
+    
+    return Hud([
+        HudWidget((20, 20), lambda game: game.score, lambda score: render_text(f"Score: {score}", shadow=True)),
+        HudWidget((20, 50), lambda game: game.level, lambda level: render_text(f"Level: {level}", shadow=True)),
+        HudWidget((20, 80), lambda game: game.combo,
+                  lambda combo: render_text(f"Combo: x{combo}", (255, 255, 0)) if combo > 0 else None),
+        HudWidget((20, 110), lambda game: game.game_time,
+                  lambda seconds: render_text(f"Time: {seconds//60}:{seconds%60:02d}")),
+        HudWidget((20, 140), lambda game: game.shots_fired, lambda shots: render_text(f"Shots: {shots}")),
+        HudWidget((20, 170), lambda game: (game.active_powerup, game.powerup_timer // 60,
+                                           game.multi_shot_count if game.active_powerup == "multi_shot" else 0),
+                  active_panel),
+        HudWidget((WIDTH - 150, 50), lambda game: game.next_bubble.color, next_panel),
+        HudWidget((WIDTH - 150, 150), lambda game: game.stored_powerup.type if game.stored_powerup else None,
+                  stored_panel),
+        HudWidget((WIDTH - 180, HEIGHT - 120),
+                  lambda game: tuple((kind, count) for kind, count in game.powerup_stats.items() if count),
+                  stats_panel),
+    ])
+
+hud = create_hud()
+
 class ShockwaveParticle:
     def __init__(self, x, y, radius):
         self.x = x
@@ -1463,39 +3361,30 @@ class ShockwaveParticle:
         self.lifetime -= 1
         return self.lifetime <= 0
     
-    def draw(self):
-        alpha = min(255, self.lifetime * 12)
+    def submit(self, batch):
+        alpha = alpha_bucket(self.lifetime * 12)
         progress = 1 - (self.lifetime / 20)
-        current_radius = self.max_radius * progress
-        pygame.draw.circle(screen, (255, 255, 255, alpha), (int(self.x), int(self.y)), int(current_radius), self.width)
+        current_radius = int(self.max_radius * progress)
+        if current_radius > 0 and alpha:
+            batch.append((sprites.circle(current_radius, WHITE, alpha, self.width),
+                          (int(self.x) - current_radius, int(self.y) - current_radius)))
 
 class ElectricParticle:
     def __init__(self, x, y):
         self.x = x
         self.y = y
         self.lifetime = random.randint(10, 20)
-        self.points = []
-        
-        # Generate zigzag points
-        num_points = random.randint(3, 6)
-        angle = random.uniform(0, 2*math.pi)
-        max_dist = random.uniform(10, 30)
-        
-        for i in range(num_points):
-            dist = max_dist * (i / (num_points - 1))
-            offset = random.uniform(-10, 10)
-            point_x = self.x + math.cos(angle) * dist + offset
-            point_y = self.y + math.sin(angle) * dist + offset
-            self.points.append((point_x, point_y))
+        self.variant = random.randrange(SpriteCache.BOLT_VARIANTS)  # Zigzag shape
     
     def update(self):
         self.lifetime -= 1
         return self.lifetime <= 0
     
-    def draw(self):
-        alpha = min(255, self.lifetime * 12)
-        if len(self.points) > 1:
-            pygame.draw.lines(screen, (200, 200, 255, alpha), False, self.points, 2)
+    def submit(self, batch):
+        alpha = alpha_bucket(self.lifetime * 12)
+        if alpha:
+            surface, (dx, dy) = sprites.bolt(self.variant, alpha)
+            batch.append((surface, (int(self.x) + dx, int(self.y) + dy)))
 
 class MagneticParticle:
     def __init__(self, start_x, start_y, end_x, end_y, color):
@@ -1514,13 +3403,12 @@ class MagneticParticle:
             self.progress = 1
         return self.lifetime <= 0
     
-    def draw(self):
-        alpha = min(255, self.lifetime * 12)
+    def submit(self, batch):
+        alpha = alpha_bucket(self.lifetime * 12)
         x = self.start_x + (self.end_x - self.start_x) * self.progress
         y = self.start_y + (self.end_y - self.start_y) * self.progress
-        
-        # Draw particle
-        pygame.draw.circle(screen, self.color + (alpha,), (int(x), int(y)), 2)
+        if alpha:
+            batch.append((sprites.circle(2, self.color, alpha), (int(x) - 2, int(y) - 2)))
 
 class LightningParticle:
     def __init__(self, x, y):
@@ -1534,13 +3422,12 @@ class LightningParticle:
         self.lifetime -= 1
         return self.lifetime <= 0
     
-    def draw(self):
-        # Draw lightning bolt
-        alpha = min(255, self.lifetime * 15)
-        pygame.draw.line(screen, (200, 200, 255, alpha), 
-                       (self.x + self.offset, self.y), 
-                       (self.x + self.offset, self.y + 20), 
-                       self.width)
+    def submit(self, batch):
+        # Lightning bolt segment
+        alpha = alpha_bucket(self.lifetime * 15)
+        if alpha:
+            batch.append((sprites.bar(self.width, 21, (200, 200, 255), alpha),
+                          (int(self.x + self.offset) - self.width // 2, int(self.y))))
 
 class PowerupNotification:
     def __init__(self, x, y, text, color):
@@ -1549,7 +3436,6 @@ class PowerupNotification:
         self.text = text
         self.color = color
         self.lifetime = 60  # 1 second at 60 FPS
-        self.font = pygame.font.SysFont('Arial', 18)
         self.alpha = 255
         self.scale = 0
         self.growing = True
@@ -1566,25 +3452,15 @@ class PowerupNotification:
         
         return self.lifetime <= 0
     
-    def draw(self):
-        # Draw background
-        text_surface = self.font.render(self.text, True, self.color)
-        text_width, text_height = text_surface.get_size()
-        
-        # Apply scale
-        scaled_width = int(text_width * self.scale)
-        scaled_height = int(text_height * self.scale)
-        
-        if scaled_width > 0 and scaled_height > 0:
-            scaled_surface = pygame.transform.scale(text_surface, (scaled_width, scaled_height))
-            
-            # Apply alpha
-            scaled_surface.set_alpha(self.alpha)
-            
-            # Draw centered at position
-            screen.blit(scaled_surface, 
-                       (self.x - scaled_width // 2, 
-                        self.y - scaled_height // 2))
+    def submit(self, batch):
+        # Scale grows in 0.1 steps, so the rounded value is an exact bucket
+        scale = min(1.0, round(self.scale, 1))
+        alpha = alpha_bucket(self.alpha)
+        if scale > 0 and alpha:
+            surface = sprites.text(18, self.text, self.color, alpha, scale)
+            width, height = surface.get_size()
+            # Centered at position
+            batch.append((surface, (self.x - width // 2, self.y - height // 2)))
 
 class ScoreParticle:
     def __init__(self, x, y, text):
@@ -1593,19 +3469,692 @@ class ScoreParticle:
         self.text = text
         self.vy = -2  # Move upward
         self.lifetime = 30
-        self.font = pygame.font.SysFont('Arial', 20)
     
     def update(self):
         self.y += self.vy
         self.lifetime -= 1
         return self.lifetime <= 0
     
-    def draw(self):
-        alpha = min(255, self.lifetime * 8)
-        text_surface = self.font.render(self.text, True, (255, 255, 255, alpha))
-        screen.blit(text_surface, (int(self.x), int(self.y)))
+    def submit(self, batch):
+        alpha = alpha_bucket(self.lifetime * 8)
+        if alpha:
+            batch.append((sprites.text(20, self.text, WHITE, alpha), (int(self.x), int(self.y))))
+
+class EffectsPresenter:
+    # Turns gameplay events into particles, explosions and score popups.
+    # Spawning is deferred to the game's scheduler so a cascade or powerup
+    # does not land all of its effects on the frame that resolved it.
+    def __init__(self, game):
+        self.game = game
+        events = game.events
+        HIGH, NORMAL, LOW = FrameScheduler.HIGH, FrameScheduler.NORMAL, FrameScheduler.LOW
+        events.subscribe(EVENT_MATCHED, self.deferred(self.on_matched, HIGH))
+        events.subscribe(EVENT_POPPED, self.deferred(self.on_popped, NORMAL))
+        events.subscribe(EVENT_EXPLODED, self.deferred(self.on_exploded, NORMAL))
+        events.subscribe(EVENT_SCORED, self.deferred(self.on_scored, HIGH))
+        events.subscribe(EVENT_POWERUP_STORED, self.deferred(self.on_powerup_stored, HIGH))
+        events.subscribe(EVENT_POWERUP_ACTIVATED, self.deferred(self.on_powerup_activated, HIGH))
+        events.subscribe(EVENT_MAGNET_PULL, self.deferred(self.on_magnet_pull, LOW))
+    
+    def deferred(self, handler, priority, deadline=2):
+        # Effects may slip a frame or two, never more
+        scheduler = self.game.scheduler
+        def schedule(**data):
+            scheduler.schedule(lambda: handler(**data), priority, deadline)
+        return schedule
+    
+    def add_particle(self, particle):
+        # Everything except score popups goes through the particle cap
+        if quality.has_room("particles", len(self.game.particles)):
+            self.game.particles.append(particle)
+    
+    def add_explosion(self, x, y, color):
+        if quality.has_room("explosions", len(self.game.explosions)):
+            self.game.explosions.append(Explosion(x, y, color, quality.count(20)))
+    
+    def on_matched(self, bubble, matches):
+        # Create explosions for each matched bubble
+        for match in matches:
+            self.add_explosion(match.x, match.y, match.color["main"])
+    
+    def on_popped(self, bubbles):
+        for bubble in bubbles:
+            for _ in range(quality.count(10)):
+                self.add_particle(Particle(bubble.x, bubble.y, bubble.color["main"]))
+    
+    def on_exploded(self, kind, x, y, col, bubbles, radius):
+        if kind == "bomb":
+            # Create explosion for each bubble
+            for bubble in bubbles:
+                self.add_explosion(bubble.x, bubble.y, bubble.color["main"])
+                
+                # Add extra particles for bigger explosion
+                for _ in range(quality.count(10)):
+                    angle = random.uniform(0, 2*math.pi)
+                    distance = random.uniform(0, bubble.radius * 2)
+                    particle_x = bubble.x + math.cos(angle) * distance
+                    particle_y = bubble.y + math.sin(angle) * distance
+                    self.add_particle(Particle(particle_x, particle_y, bubble.color["main"], random.uniform(2, 5)))
+            
+            # Create shockwave effect
+            rings = max(1, quality.count(5))
+            for i in range(rings):
+                self.add_particle(ShockwaveParticle(x, y, radius * (i+1) / rings))
+        
+        elif kind == "lightning":
+            # Create lightning effect, sparser at lower quality
+            for bolt_y in range(0, HEIGHT, int(10 / quality.level)):
+                # Create lightning particle with random offset
+                offset = random.uniform(-10, 10)
+                self.add_particle(LightningParticle(x + offset, bolt_y))
+                
+                # Add some branching lightning
+                if quality.chance(0.2):
+                    branch_x = x + random.uniform(-30, 30)
+                    branch_y = bolt_y + random.uniform(-20, 20)
+                    self.add_particle(LightningParticle(branch_x, branch_y))
+            
+            # Create explosion for each bubble
+            for bubble in bubbles:
+                self.add_explosion(bubble.x, bubble.y, bubble.color["main"])
+                
+                # Add electric particles
+                for _ in range(quality.count(5)):
+                    self.add_particle(ElectricParticle(bubble.x, bubble.y))
+    
+    def on_scored(self, x, y, points):
+        # Create a score popup particle
+        for digit in str(points):
+            self.game.particles.append(ScoreParticle(x, y, digit))
+            x += 10  # Offset each digit
+    
+    def on_powerup_stored(self, powerup):
+        self.game.particles.append(PowerupNotification(WIDTH - 100, 200, 
+                                                     f"{powerup.type.upper()} stored!",
+                                                     powerup.colors[powerup.type]))
+    
+    def on_powerup_activated(self, powerup):
+        self.add_explosion(powerup.x, powerup.y, powerup.colors[powerup.type])
+    
+    def on_magnet_pull(self, bubble, target):
+        # Add magnetic particles
+        if quality.chance(0.2):
+            mid_x = (bubble.x + target.x) / 2
+            mid_y = (bubble.y + target.y) / 2
+            self.add_particle(MagneticParticle(
+                bubble.x, bubble.y,
+                mid_x + random.uniform(-20, 20), mid_y + random.uniform(-20, 20),
+                (255, 100, 200)
+            ))
+
+class SoundPresenter:
+    def __init__(self, events):
+        if not sounds_loaded:
+            return
+        events.subscribe(EVENT_SHOT, self.on_shot)
+        events.subscribe(EVENT_MATCHED, self.on_pop)
+        events.subscribe(EVENT_POWERUP_ACTIVATED, self.on_pop)
+        events.subscribe(EVENT_DROPPED, self.on_dropped)
+        events.subscribe(EVENT_GAME_OVER, self.on_game_over)
+    
+    def on_shot(self, bubble, auto):
+        if not auto:
+            shoot_sound.play()
+    
+    def on_pop(self, **_):
+        pop_sound.play()
+    
+    def on_dropped(self, bubbles):
+        fall_sound.play()
+    
+    def on_game_over(self):
+        game_over_sound.play()
+
+class TelemetryLog:
+    # Buffered JSONL event log. Events are collected in a list on whichever
+    # thread runs the game and handed to a writer thread in batches, which
+    # does the JSON encoding and file writes.
+    def __init__(self, path, batch=256):
+        self.path = path
+        self.batch = batch
+        self.buffer = []
+        self.queue = queue.SimpleQueue()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+    
+    def record(self, event, **fields):
+        # Fields must not be mutated afterwards, they are encoded later
+        fields["event"] = event
+        fields["time"] = round(time.time(), 3)
+        self.buffer.append(fields)
+        if len(self.buffer) >= self.batch:
+            self.flush()
+    
+    def flush(self):
+        if self.buffer:
+            self.queue.put(self.buffer)
+            self.buffer = []
+    
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+    
+    def write(self):
+        with open(self.path, "a") as f:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                f.write("".join(json.dumps(fields, separators=(",", ":")) + "\n" for fields in batch))
+                f.flush()
+
+class TelemetryPresenter:
+    # Records one game's gameplay events to a TelemetryLog, tagged with an
+    # id for the game and the frame they happened on
+    def __init__(self, game, telemetry):
+        self.game = game
+        self.telemetry = telemetry
+        self.id = os.urandom(6).hex()
+        events = game.events
+        events.subscribe(EVENT_LEVEL_STARTED, self.on_level_started)
+        events.subscribe(EVENT_SHOT, self.on_shot)
+        events.subscribe(EVENT_MATCHED, self.on_matched)
+        events.subscribe(EVENT_DROPPED, self.on_dropped)
+        events.subscribe(EVENT_POWERUP_SPAWNED, self.on_powerup_spawned)
+        events.subscribe(EVENT_POWERUP_COLLECTED, self.on_powerup_collected)
+        events.subscribe(EVENT_POWERUP_ACTIVATED, self.on_powerup_activated)
+        events.subscribe(EVENT_GAME_OVER, self.on_game_over)
+        self.record("game_started", level=game.level, endless=game.endless, seed=game.seed)
+    
+    def record(self, event, **fields):
+        self.telemetry.record(event, game=self.id, frame=self.game.frames, **fields)
+    
+    def on_level_started(self, level):
+        self.record("level_started", level=level)
+    
+    def on_shot(self, bubble, auto):
+        self.record("shot", angle=self.game.shooter_angle, auto=auto)
+    
+    def on_matched(self, bubble, matches):
+        self.record("match", size=len(matches), combo=self.game.combo, rainbow=bubble.is_rainbow)
+    
+    def on_dropped(self, bubbles):
+        self.record("drop", size=len(bubbles))
+    
+    def on_powerup_spawned(self, powerup):
+        self.record("powerup_spawned", type=powerup.type)
+    
+    def on_powerup_collected(self, powerup):
+        self.record("powerup_collected", type=powerup.type)
+    
+    def on_powerup_activated(self, powerup):
+        self.record("powerup_activated", type=powerup.type)
+    
+    def on_game_over(self):
+        game = self.game
+        self.record("game_over", level=game.level, score=game.score, game_time=game.game_time,
+                    shots_fired=game.shots_fired, powerup_stats=dict(game.powerup_stats))
+        self.telemetry.flush()
+
+class Histogram:
+    # Fixed-width buckets, so memory depends on the value range, not on
+    # how many values were added
+    def __init__(self, width=1):
+        self.width = width
+        self.buckets = {}  # Bucket start -> count
+        self.count = 0
+        self.total = 0
+    
+    def add(self, value):
+        bucket = value // self.width * self.width
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+    
+    def quantile(self, q):
+        # Start of the bucket holding the q-th value
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= q * self.count:
+                return bucket
+        return None
+    
+    def summary(self):
+        return {"count": self.count, "mean": round(self.total / self.count, 2) if self.count else None,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+                "buckets": {str(bucket): self.buckets[bucket] for bucket in sorted(self.buckets)}}
+
+# Funnel stages, in order; a game reaches a stage when any event of it is seen
+TELEMETRY_FUNNEL = ("game_started", "shot", "match", "drop", "powerup_collected",
+                    "powerup_activated", "game_over")
+
+def telemetry_report(paths, max_open_games=10000):
+    # Streams telemetry logs one line at a time. Only per-game funnel
+    # progress is kept until the game ends, capped at max_open_games, so
+    # memory stays bounded. Past the cap the oldest game is counted as it
+    # stands and its id remembered (up to max_open_games of those too), so
+    # events that still arrive for it count only stages it had not reached.
+    events = {}
+    stages = dict.fromkeys(TELEMETRY_FUNNEL, 0)
+    open_games = {}  # Game id -> set of stages reached, oldest first
+    closed_early = {}  # Game id -> stages already counted, oldest first
+    histograms = {
+        "shot_angle": Histogram(10), "match_size": Histogram(), "match_combo": Histogram(),
+        "drop_size": Histogram(), "final_score": Histogram(500), "game_time": Histogram(30),
+        "shots_per_game": Histogram(10),
+    }
+    powerups = {}  # Type -> {spawned, collected, activated}
+    
+    def close(reached):
+        for stage in reached:
+            stages[stage] += 1
+    
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                event = record["event"]
+                events[event] = events.get(event, 0) + 1
+                
+                game = record.get("game")
+                reached = open_games.get(game)
+                if reached is None and game in closed_early:
+                    counted = closed_early[game]
+                    if event in stages and event not in counted:
+                        counted.add(event)
+                        stages[event] += 1
+                    if event == "game_over":
+                        del closed_early[game]
+                elif reached is None:
+                    if len(open_games) >= max_open_games:
+                        oldest = next(iter(open_games))
+                        close(open_games[oldest])
+                        if len(closed_early) >= max_open_games:
+                            del closed_early[next(iter(closed_early))]
+                        closed_early[oldest] = open_games.pop(oldest)
+                    reached = open_games[game] = set()
+                if reached is not None and event in stages:
+                    reached.add(event)
+                
+                if event == "shot":
+                    histograms["shot_angle"].add(record["angle"])
+                elif event == "match":
+                    histograms["match_size"].add(record["size"])
+                    histograms["match_combo"].add(record["combo"])
+                elif event == "drop":
+                    histograms["drop_size"].add(record["size"])
+                elif event.startswith("powerup_"):
+                    counts = powerups.setdefault(record["type"], {"spawned": 0, "collected": 0, "activated": 0})
+                    counts[event[len("powerup_"):]] += 1
+                elif event == "game_over":
+                    histograms["final_score"].add(record["score"])
+                    histograms["game_time"].add(record["game_time"])
+                    histograms["shots_per_game"].add(record["shots_fired"])
+                    if game in open_games:
+                        close(open_games.pop(game))
+    
+    for reached in open_games.values():
+        close(reached)
+    return {"events": events, "funnel": stages, "abandoned_games": stages["game_started"] - stages["game_over"],
+            "powerups": powerups, "distributions": {name: h.summary() for name, h in histograms.items()}}
+
+class FrameRecorder:
+    # Records the screen without stalling the game loop. Frames are copied
+    # out on the main thread and passed through a bounded queue to an
+    # encoder thread; when the encoder falls behind, frames are dropped.
+    # "png" writes an image sequence, "raw" one RGB24 stream with a JSON
+    # sidecar (ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r FPS).
+    def __init__(self, directory, every=1, format="png", queue_size=30):
+        self.directory = directory
+        self.every = max(1, every)  # Capture every Nth frame
+        self.format = format
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.frame = 0  # Frames offered
+        self.written = 0
+        self.dropped = 0
+        self.size = None
+        self.error = None  # Why the encoder gave up, if it did
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.encode, daemon=True)
+        self.thread.start()
+    
+    def capture(self, surface):
+        self.frame += 1
+        if (self.frame - 1) % self.every:
+            return
+        # Only this thread adds to the queue, so it cannot fill up in between
+        if self.error or self.queue.full():
+            self.dropped += 1
+            return
+        self.size = surface.get_size()
+        self.queue.put_nowait((self.frame, self.size, pygame.image.tostring(surface, "RGB")))
+    
+    def encode(self):
+        # A write error (disk full, directory gone) ends the recording but
+        # the queue keeps being drained, so capture and stop never block
+        raw = None
+        try:
+            if self.format == "raw":
+                raw = open(os.path.join(self.directory, "frames.rgb"), "wb")
+        except OSError as e:
+            self.fail(e)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error:
+                self.dropped += 1
+                continue
+            number, size, data = item
+            try:
+                if raw:
+                    raw.write(data)
+                else:
+                    pygame.image.save(pygame.image.frombuffer(data, size, "RGB"),
+                                      os.path.join(self.directory, f"frame_{number:06d}.png"))
+                self.written += 1
+            except (OSError, pygame.error) as e:
+                self.dropped += 1
+                self.fail(e)
+        try:
+            if raw:
+                raw.close()
+                width, height = self.size or (0, 0)
+                with open(os.path.join(self.directory, "frames.json"), "w") as f:
+                    json.dump({"width": width, "height": height, "fps": 60 / self.every, "pix_fmt": "rgb24",
+                               "frames": self.written, "dropped": self.dropped}, f)
+        except OSError as e:
+            self.fail(e)
+    
+    def fail(self, error):
+        if not self.error:
+            self.error = error
+            log.error("record", "Recording to %s stopped: %s", self.directory, error)
+    
+    def stop(self, timeout=5):
+        # Let the encoder drain the queue and finish; give up waiting on an
+        # encoder thread that is stuck or gone rather than hang the game
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout)
+        if self.thread.is_alive():
+            log.error("record", "Recording to %s did not finish within %ss", self.directory, timeout)
+        log.info("record", "Recorded %d frames to %s (%d dropped)", self.written, self.directory, self.dropped)
+
+class ProfileCapture:
+    # Profiles the next `frames` frames of main() and tags everything with
+    # the game phase the frame was in: aiming, shot in flight, clear
+    # cascade, or powerup (with its type). "sample" mode walks every
+    # thread's stack from a background thread each interval and writes
+    # collapsed stacks (flamegraph.pl, speedscope); "trace" runs one
+    # cProfile per phase on the main thread and writes a .pstats for each.
+    def __init__(self, frames, directory="profiles", mode="sample", interval=0.001):
+        self.frames = frames
+        self.mode = mode
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        # Numbered so captures started within the same second keep apart
+        stamp = datetime.now().strftime("profile-%Y%m%d-%H%M%S")
+        taken = os.listdir(directory)
+        number = 1
+        while any(name.startswith(f"{stamp}-{number}.") or name.startswith(f"{stamp}-{number}-") for name in taken):
+            number += 1
+        self.path = os.path.join(directory, f"{stamp}-{number}")
+        self.phase = "aiming"
+        self.effect = None  # Last instant powerup, while its effects are alive
+        self.game = None
+        self.stacks = {}  # Collapsed stack -> samples
+        self.profilers = {}  # Phase -> cProfile.Profile
+        self.profiler = None
+        self.running = True
+        if mode == "sample":
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        log.info("profile", "Profiling %d frames (%s) to %s", frames, mode, self.path)
+    
+    def on_powerup_activated(self, powerup):
+        self.effect = powerup.type
+    
+    def watch(self, game):
+        # Called for every new game while capturing
+        if self.game:
+            self.game.events.unsubscribe(EVENT_POWERUP_ACTIVATED, self.on_powerup_activated)
+        self.game = game
+        game.events.subscribe(EVENT_POWERUP_ACTIVATED, self.on_powerup_activated)
+    
+    def game_phase(self, game):
+        if game.active_powerup:
+            return "powerup:" + game.active_powerup
+        if self.effect and (game.explosions or game.particles):
+            return "powerup:" + self.effect
+        self.effect = None
+        if game.explosions or game.falling_bubbles:
+            return "cascade"
+        if game.shooting_bubble:
+            return "shot"
+        return "aiming"
+    
+    def frame(self, game):
+        # Called at the start of each frame; returns False once done
+        if self.game is not game:
+            self.watch(game)
+        if not self.frames:
+            self.finish()
+            return False
+        self.frames -= 1
+        self.phase = self.game_phase(game)
+        if self.mode == "trace":
+            profiler = self.profilers.get(self.phase)
+            if profiler is None:
+                profiler = self.profilers[self.phase] = cProfile.Profile()
+            if profiler is not self.profiler:
+                if self.profiler:
+                    self.profiler.disable()
+                profiler.enable()
+                self.profiler = profiler
+        return True
+    
+    def sample(self):
+        me = threading.get_ident()
+        names = {}
+        while self.running:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.append(self.phase)
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            time.sleep(self.interval)
+    
+    def finish(self):
+        if self.mode == "sample":
+            self.running = False
+            self.thread.join()
+            with open(self.path + ".collapsed", "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.items())
+            log.info("profile", "Wrote %d samples to %s.collapsed", sum(self.stacks.values()), self.path)
+        else:
+            if self.profiler:
+                self.profiler.disable()
+            for phase, profiler in self.profilers.items():
+                profiler.dump_stats(f"{self.path}-{phase.replace(':', '-')}.pstats")
+            log.info("profile", "Wrote profiles of %s to %s-*.pstats", ", ".join(self.profilers), self.path)
+        if self.game:
+            self.game.events.unsubscribe(EVENT_POWERUP_ACTIVATED, self.on_powerup_activated)
+
+def load_replay(path):
+    with open(path) as f:
+        replay = json.load(f)
+    if replay.get("version") != REPLAY_VERSION:
+        raise ValueError(f"{path} is not a version {REPLAY_VERSION} replay")
+    return replay
+
+def replay_inputs(replay):
+    # Inputs grouped by the frame they were applied on
+    inputs = {}
+    for frame, kind, value in replay["inputs"]:
+        inputs.setdefault(frame, []).append((kind, value))
+    return inputs
+
+def step_replay(game, inputs):
+    # One frame the way main() runs it: inputs first, then the update
+    for kind, value in inputs.get(game.frames, ()):
+        game.apply_input(kind, value)
+    game.update()
+
+def replay_keyframes(replay, interval):
+    # Re-simulate without effects, pickling the game every interval frames
+    game = Game(aim_assist=replay["aim_assist"], presentation=False,
+                level_pack=LevelPack(replay["pack"]) if replay["pack"] else None,
+                level=replay["level"], endless=replay["endless"], seed=replay["seed"])
+    inputs = replay_inputs(replay)
+    keyframes = {}
+    while game.frames < replay["frames"]:
+        if game.frames % interval == 0:
+            keyframes[game.frames] = pickle.dumps(game)
+        step_replay(game, inputs)
+    return keyframes
+
+def render_replay_range(job):
+    # Process pool worker: restore a keyframe, re-simulate with effects on
+    # up to start so they are warmed up, then render frames start+1..stop
+    path, keyframe, start, stop, size, out_dir, format = job
+    replay = load_replay(path)
+    inputs = replay_inputs(replay)
+    game = pickle.loads(keyframe)
+    if replay["pack"]:
+        game.level_pack = LevelPack(replay["pack"])
+    game.presentation = True
+    EffectsPresenter(game)
+    while game.frames < start:
+        step_replay(game, inputs)
+        game.scheduler.flush()
+    
+    chunk = os.path.join(out_dir, f"chunk_{start:08d}.rgb")
+    raw = open(chunk, "wb") if format == "raw" else None
+    while game.frames < stop:
+        step_replay(game, inputs)
+        game.scheduler.flush()  # Offline frames have no budget to defer to
+        game.draw()
+        frame = screen.surface if size == screen.get_size() else pygame.transform.smoothscale(screen.surface, size)
+        if raw:
+            raw.write(pygame.image.tostring(frame, "RGB"))
+        else:
+            pygame.image.save(frame, os.path.join(out_dir, f"frame_{game.frames:06d}.png"))
+    if raw:
+        raw.close()
+        return chunk
+    return None
+
+def render_replay(path, out_dir, size=(WIDTH, HEIGHT), workers=None, format="png",
+                  keyframe_interval=600, preroll=120):
+    # Render every frame of a replay across a process pool, one keyframe
+    # interval per job. Frames come out as a numbered PNG sequence or one
+    # raw RGB24 stream (same layout as FrameRecorder).
+    start_time = time.time()
+    replay = load_replay(path)
+    total = replay["frames"]
+    keyframes = replay_keyframes(replay, keyframe_interval)
+    os.makedirs(out_dir, exist_ok=True)
+    
+    jobs = []
+    for start in range(0, total, keyframe_interval):
+        key = max(0, start - preroll) // keyframe_interval * keyframe_interval
+        jobs.append((path, keyframes[key], start, min(start + keyframe_interval, total), size, out_dir, format))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = list(pool.map(render_replay_range, jobs))
+    
+    # Stitch the ranges back together in order
+    if format == "raw":
+        with open(os.path.join(out_dir, "frames.rgb"), "wb") as out:
+            for chunk in chunks:
+                with open(chunk, "rb") as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(chunk)
+        with open(os.path.join(out_dir, "frames.json"), "w") as f:
+            json.dump({"width": size[0], "height": size[1], "fps": 60, "pix_fmt": "rgb24",
+                       "frames": total, "dropped": 0}, f)
+    print(f"Rendered {total} frames in {time.time() - start_time:.1f}s -> {out_dir}")
+
+class Window:
+    # Presents the internal render target in a window of any size (or full
+    # screen). The target keeps its own resolution, so fill-rate stays the
+    # same however big the display is. Integer scaling is nearest
+    # neighbour and letterboxed; smooth scaling fills as much as fits.
+    def __init__(self, size=(WIDTH, HEIGHT), fullscreen=False, smooth=False):
+        self.size = size  # Windowed size, kept for leaving full screen
+        self.smooth = smooth
+        self.open(fullscreen)
+    
+    def open(self, fullscreen):
+        self.fullscreen = fullscreen
+        if fullscreen:
+            self.surface = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)  # Desktop resolution
+        else:
+            self.surface = pygame.display.set_mode(self.size, pygame.RESIZABLE)
+        self.layout()
+    
+    def toggle_fullscreen(self):
+        self.open(not self.fullscreen)
+    
+    def resized(self):
+        # VIDEORESIZE: the display surface has already changed size
+        self.surface = pygame.display.get_surface()
+        if not self.fullscreen:
+            self.size = self.surface.get_size()
+        self.layout()
+    
+    def layout(self):
+        window_width, window_height = self.surface.get_size()
+        target_width, target_height = screen.get_size()
+        scale = min(window_width / target_width, window_height / target_height)
+        if not self.smooth and scale >= 1:
+            scale = int(scale)
+        self.scale = scale
+        width, height = max(1, int(target_width * scale)), max(1, int(target_height * scale))
+        self.rect = pygame.Rect((window_width - width) // 2, (window_height - height) // 2, width, height)
+        self.surface.fill(BLACK)  # Letterbox bars
+        # Scaling writes straight into this part of the window
+        self.target = self.surface.subsurface(self.rect)
+    
+    def present(self):
+        if self.scale == 1:
+            self.target.blit(screen.surface, (0, 0))
+        elif self.smooth or self.scale < 1:
+            pygame.transform.smoothscale(screen.surface, self.rect.size, self.target)
+        else:
+            pygame.transform.scale(screen.surface, self.rect.size, self.target)
+        pygame.display.flip()
+    
+    def to_internal(self, pos):
+        # Window pixel -> layout coordinates, for mouse input
+        return ((pos[0] - self.rect.x) / self.scale / screen.sx, (pos[1] - self.rect.y) / self.scale / screen.sy)
+    
+    def handle(self, event):
+        # Window events main() and the title screen share; True when consumed
+        if event.type == pygame.VIDEORESIZE and not self.fullscreen:
+            self.resized()
+            return True
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F11:
+            self.toggle_fullscreen()
+            return True
+        return False
 
-def show_instructions():
+def show_instructions(window):
     # Create animated background bubbles
     background_bubbles = []
     for _ in range(30):  # Increased number of bubbles
@@ -1678,21 +4227,10 @@ def show_instructions():
         ]
         
         # Draw powerup icons in a row
-        powerup_types = ["bomb", "rainbow", "lightning", "freeze", "magnet", "time_slow", "multi_shot"]
-        powerup_colors = {
-            "bomb": (255, 50, 50),
-            "rainbow": (255, 215, 0),
-            "lightning": (100, 100, 255),
-            "freeze": (200, 200, 255),
-            "magnet": (255, 105, 180),
-            "time_slow": (50, 205, 50),
-            "multi_shot": (0, 128, 128)
-        }
-        
         # Create a temporary powerup object for each type to draw
         powerup_y = HEIGHT - 120
-        spacing = WIDTH / (len(powerup_types) + 1)
-        for i, p_type in enumerate(powerup_types):
+        spacing = WIDTH / (len(POWERUP_TYPES) + 1)
+        for i, p_type in enumerate(POWERUP_TYPES):
             powerup = Powerup(spacing * (i + 1), powerup_y, p_type)
             powerup.draw()
         
@@ -1703,27 +4241,77 @@ def show_instructions():
             screen.blit(text, (WIDTH // 2 - text.get_width() // 2, y_pos))
             y_pos += 40
         
-        pygame.display.flip()
+        window.present()
         
         # Process events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
+            if window.handle(event):
+                continue
             if event.type == pygame.KEYDOWN:
                 waiting = False
         
         # Cap the frame rate
         clock.tick(60)
 
-def main():
-    game = Game()
-    leaderboard = Leaderboard()
-    show_instructions()
+def main(level_pack=None, level=1, endless=False, versus=None,
+         record=False, record_dir="recordings", record_every=1, record_format="png", replay_dir=None,
+         window_size=(WIDTH, HEIGHT), fullscreen=False, smooth=False, threaded=False, telemetry=None,
+         profile_frames=0, profile_dir="profiles", profile_mode="sample", internal_size=(WIDTH, HEIGHT)):
+    def new_game(aim_assist=False):
+        game = Game(aim_assist=aim_assist, level_pack=level_pack, level=level, endless=endless,
+                    record_inputs=bool(replay_dir))
+        if telemetry:
+            TelemetryPresenter(game, telemetry)
+        if versus:
+            versus.bind(game)
+        return game
+    
+    def simulate(game):
+        # With --threaded the game runs on its own thread and we only draw
+        # its snapshots; otherwise it is updated inline below
+        return SimulationThread(game, versus) if threaded else None
+    
+    def restart(game, sim):
+        # The simulation has to stop before the replay is saved
+        if sim:
+            sim.stop()
+        finish_game(game)
+        game = new_game(game.aim_assist)
+        return game, simulate(game)
+    
+    def finish_game(game):
+        if game.frames:
+            games_total.inc()
+            score_histogram.observe(game.score)
+        if telemetry:
+            telemetry.flush()
+        # Keep a replay of every game that was played at all
+        if replay_dir and game.frames:
+            path = os.path.join(replay_dir, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+            def save():
+                os.makedirs(replay_dir, exist_ok=True)
+                game.save_replay(path)
+                log.info("replay", "Saved replay to %s", path)
+            tasks.schedule(save, FrameScheduler.LOW, deadline=120)
     
-    # For tracking game time
-    clock_time = 0
-    frame_count = 0
+    def start_recording():
+        # Each recording gets its own timestamped directory
+        directory = os.path.join(record_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        log.info("record", "Recording to %s", directory)
+        return FrameRecorder(directory, record_every, record_format)
+    
+    screen.resize(internal_size)
+    window = Window(window_size, fullscreen, smooth)
+    tasks = FrameScheduler()  # Deferred file writes on this thread
+    game = new_game()
+    leaderboard = Leaderboard()
+    show_instructions(window)
+    if threaded:
+        sys.setswitchinterval(0.001)  # Let the simulation thread in on time
+    sim = simulate(game)
     
     # For entering player name
     entering_name = False
@@ -1734,19 +4322,63 @@ def main():
     # For showing leaderboard
     showing_leaderboard = False
     
+    recorder = start_recording() if record else None
+    profiler = ProfileCapture(profile_frames, profile_dir, profile_mode) if profile_frames else None
+    
     while True:
+        if profiler and not profiler.frame(game):
+            profiler = None
+        frame_start = time.perf_counter()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                if recorder:
+                    recorder.stop()
+                if profiler:
+                    profiler.finish()
+                if sim:
+                    sim.stop()
+                finish_game(game)
+                tasks.flush()
+                if telemetry:
+                    telemetry.close()
+                log.close()
                 pygame.quit()
                 sys.exit()
             
+            # Player actions go to whoever runs the game
+            control = sim or game
+            
+            # Resizing and F11 (full screen)
+            if window.handle(event):
+                continue
+            
+            # F10 writes out the recent log history
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F10:
+                log.dump()
+                continue
+            
+            # F9 starts and stops recording on any screen
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+                if recorder:
+                    recorder.stop()
+                    recorder = None
+                else:
+                    recorder = start_recording()
+                continue
+            
+            # F12 profiles the next frames (as many as --profile asks, or 300)
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F12:
+                if not profiler:
+                    profiler = ProfileCapture(profile_frames or 300, profile_dir, profile_mode)
+                continue
+            
             if entering_name:
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         # Save score and exit name entry mode
                         if player_name:
                             leaderboard.add_score(player_name, game.score, game.game_time, game.shots_fired)
-                            leaderboard.save()
+                            tasks.schedule(leaderboard.save, FrameScheduler.LOW, deadline=60)
                             entering_name = False
                             showing_leaderboard = True
                     elif event.key == pygame.K_BACKSPACE:
@@ -1759,35 +4391,33 @@ def main():
             elif showing_leaderboard:
                 if event.type == pygame.KEYDOWN:
                     showing_leaderboard = False
-                    game = Game()  # Reset game
+                    game, sim = restart(game, sim)  # Reset game
             else:
                 if event.type == pygame.MOUSEMOTION:
                     if not game.game_over:
                         # Calculate angle based on mouse position
-                        mouse_x, mouse_y = event.pos
+                        mouse_x, mouse_y = window.to_internal(event.pos)
                         dx = mouse_x - WIDTH // 2
                         dy = SHOOTER_Y - mouse_y
                         angle = math.degrees(math.atan2(dx, dy))
-                        
-                        # Limit angle
-                        game.shooter_angle = max(-MAX_ANGLE, min(MAX_ANGLE, angle))
+                        control.apply_input(INPUT_AIM, angle)
                 
                 if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    if not game.game_over and game.shooting_bubble is None:
-                        game.shoot_bubble()
+                    if not game.game_over:
+                        control.apply_input(INPUT_SHOOT)
                 
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_r and game.game_over:
-                        game = Game()
+                        game, sim = restart(game, sim)
+                    # Toggle aim assist
+                    elif event.key == pygame.K_a:
+                        control.apply_input(INPUT_AIM_ASSIST)
                     # Debug key to spawn powerups (for testing)
                     elif event.key == pygame.K_p and not game.game_over:
-                        powerup_type = random.choice(["bomb", "rainbow", "lightning", "freeze", 
-                                                    "magnet", "time_slow", "multi_shot"])
-                        game.powerups.append(Powerup(WIDTH // 2, HEIGHT // 2, powerup_type))
+                        control.apply_input(INPUT_SPAWN_POWERUP, random.choice(POWERUP_TYPES))
                     # Use stored powerup
                     elif event.key == pygame.K_SPACE and game.stored_powerup and not game.game_over:
-                        game.activate_powerup(game.stored_powerup)
-                        game.stored_powerup = None
+                        control.apply_input(INPUT_USE_POWERUP)
                     # Save score to leaderboard
                     elif event.key == pygame.K_s and game.game_over:
                         entering_name = True
@@ -1797,16 +4427,19 @@ def main():
                         showing_leaderboard = True
         
         # Update game state
-        if not game.game_over and not entering_name and not showing_leaderboard:
-            game.update()
+        if sim:
+            sim.paused = entering_name or showing_leaderboard
+        else:
+            if not game.game_over and not entering_name and not showing_leaderboard:
+                update_start = time.perf_counter()
+                game.update()
+                update_seconds.observe(time.perf_counter() - update_start)
             
-            # Update game time (every second)
-            frame_count += 1
-            if frame_count >= 60:  # Assuming 60 FPS
-                game.game_time += 1
-                frame_count = 0
+            if versus:
+                versus.update()
         
         # Draw everything
+        draw_start = time.perf_counter()
         if entering_name:
             # Draw name entry screen
             screen.blit(background, (0, 0))
@@ -1818,8 +4451,8 @@ def main():
             
             # Draw name box
             name_box_rect = pygame.Rect(WIDTH // 2 - 200, HEIGHT // 2 - 30, 400, 60)
-            pygame.draw.rect(screen, (50, 50, 50), name_box_rect)
-            pygame.draw.rect(screen, WHITE, name_box_rect, 2)
+            screen.rect((50, 50, 50), name_box_rect)
+            screen.rect(WHITE, name_box_rect, 2)
             
             # Draw entered name
             name_font = pygame.font.SysFont('Arial', 32)
@@ -1834,9 +4467,9 @@ def main():
                 
             if name_cursor_visible:
                 cursor_x = name_box_rect.x + 10 + name_text.get_width()
-                pygame.draw.line(screen, WHITE, 
-                               (cursor_x, name_box_rect.y + 15),
-                               (cursor_x, name_box_rect.y + 45), 2)
+                screen.line(WHITE, 
+                            (cursor_x, name_box_rect.y + 15),
+                            (cursor_x, name_box_rect.y + 45), 2)
             
             # Draw instructions
             inst_font = pygame.font.SysFont('Arial', 24)
@@ -1850,10 +4483,32 @@ def main():
             # Draw leaderboard screen
             leaderboard.draw(screen)
         else:
-            game.draw()
+            view = sim.snapshot() if sim else game
+            view.draw()
+            if versus:
+                versus.draw()
+            entity_gauges["bubbles"].set(len(view.bubbles))
+            entity_gauges["falling"].set(len(view.falling_bubbles))
+            entity_gauges["particles"].set(len(view.particles))
+            entity_gauges["explosions"].set(len(view.explosions))
+            entity_gauges["powerups"].set(len(view.powerups))
+        draw_seconds.observe(time.perf_counter() - draw_start)
         
-        pygame.display.flip()
+        if recorder:
+            recorder.capture(screen.surface)
+        
+        window.present()
+        
+        # Deferred work fills what is left of the frame budget
+        spare = quality.budget_ms - (time.perf_counter() - frame_start) * 1000
+        if not sim:
+            game.scheduler.run(spare)
+            spare = quality.budget_ms - (time.perf_counter() - frame_start) * 1000
+        tasks.run(spare)
         clock.tick(60)
+        quality.update(clock.get_rawtime())
+        frame_seconds.observe(clock.get_time() / 1000)
+        fps_gauge.set(clock.get_fps())
 
 class Leaderboard:
     def __init__(self):
@@ -1867,15 +4522,17 @@ class Leaderboard:
                 with open(self.filename, 'r') as f:
                     self.scores = json.load(f)
         except Exception as e:
-            print(f"Error loading leaderboard: {e}")
+            log.error("leaderboard", "Error loading leaderboard: %s", e)
             self.scores = []
     
     def save(self):
+        start = time.perf_counter()
         try:
             with open(self.filename, 'w') as f:
                 json.dump(self.scores, f)
         except Exception as e:
-            print(f"Error saving leaderboard: {e}")
+            log.error("leaderboard", "Error saving leaderboard: %s", e)
+        leaderboard_write_seconds.observe(time.perf_counter() - start)
     
     def add_score(self, name, score, game_time, shots):
         # Calculate efficiency
@@ -1921,7 +4578,7 @@ class Leaderboard:
             header_x += header_widths[i]
         
         # Draw horizontal line
-        pygame.draw.line(screen, WHITE, (50, 150), (WIDTH - 50, 150), 2)
+        screen.line(WHITE, (50, 150), (WIDTH - 50, 150), 2)
         
         # Draw scores
         score_font = pygame.font.SysFont('Arial', 20)
@@ -1977,5 +4634,498 @@ class Leaderboard:
         inst_text = inst_font.render("Press any key to continue", True, WHITE)
         screen.blit(inst_text, (WIDTH // 2 - inst_text.get_width() // 2, HEIGHT - 50))
 
+# Session server protocol. Every message is a FRAME header (payload length,
+# message type) and then the payload; all fields are little endian.
+MSG_NEW = 1  # Client: NEW (flags, bit 0 endless; level, 0 for a random board)
+MSG_SHOOT = 2  # Client: SHOOT (session id, angle in degrees)
+MSG_SNAPSHOT = 3  # Client: SESSION, asks for a full STATE
+MSG_CLOSE = 4  # Client: SESSION
+MSG_STATE = 16  # Server: STATE then rows*cols cell codes from the top row
+MSG_RESULT = 17  # Server: RESULT for one shot
+MSG_DELTA = 18  # Server: DELTA then one CHANGE per cell changed since the last STATE or DELTA
+MSG_CLOSED = 19  # Server: SESSION
+MSG_ERROR = 31  # Server: UTF-8 message
+
+class ServerSession:
+    # One simulation-only game plus what the client was last sent
+    def __init__(self, session_id, game):
+        self.id = session_id
+        self.game = game
+        self.cells = None  # Board as of the last STATE or DELTA
+        self.row_origin = None
+        self.landed = None  # Landing cell index of the current shot
+        self.popped = 0
+        self.dropped = 0
+        game.events.subscribe(EVENT_ATTACHED, self.on_attached)
+        game.events.subscribe(EVENT_POPPED, self.on_popped)
+        game.events.subscribe(EVENT_DROPPED, self.on_dropped)
+    
+    def on_attached(self, bubble):
+        self.landed = (bubble.row - self.game.row_origin) * GRID_COLS + bubble.col
+    
+    def on_popped(self, bubbles):
+        self.popped += len(bubbles)
+    
+    def on_dropped(self, bubbles):
+        self.dropped += len(bubbles)
+    
+    def shoot(self, angle):
+        # Returns (landing index or -1, popped, dropped, points)
+        self.landed = None
+        self.popped = self.dropped = 0
+        score = self.game.score
+        self.game.play_shot(angle)
+        landed = -1 if self.landed is None else self.landed
+        return landed, self.popped, self.dropped, self.game.score - score
+
+class SessionServer:
+    # Hosts many headless Game sessions in one asyncio loop for bots and
+    # integration tests. Sessions belong to the connection that created them.
+    FRAME = struct.Struct("<IB")
+    NEW = struct.Struct("<BH")
+    SESSION = struct.Struct("<I")
+    SHOOT = struct.Struct("<If")
+    STATE = struct.Struct("<IiiB?")  # Session, score, row origin, next bubble code, game over
+    RESULT = struct.Struct("<IhHHi?")  # Session, landing index (-1 for none), popped, dropped, points, game over
+    DELTA = struct.Struct("<IiB?H")  # Session, score, next bubble code, game over, changes
+    CHANGE = struct.Struct("<HB")  # Cell index, new code
+    MAX_PAYLOAD = 1 << 16
+    BACKLOG = 1024  # Bot tournaments open hundreds of connections at once
+    
+    def __init__(self, level_pack=None):
+        self.level_pack = level_pack  # Pack that NEW level numbers refer to
+        self.sessions = {}
+        self.next_id = 1
+    
+    @classmethod
+    def frame(cls, kind, payload=b""):
+        return cls.FRAME.pack(len(payload), kind) + payload
+    
+    async def serve(self, address):
+        # address is HOST:PORT for TCP, anything else is a Unix socket path
+        if ":" in address:
+            host, port = address.rsplit(":", 1)
+            server = await asyncio.start_server(self.handle, host, int(port), backlog=self.BACKLOG)
+        else:
+            server = await asyncio.start_unix_server(self.handle, address, backlog=self.BACKLOG)
+        # SIGTERM (supervisors, containers) stops serving and returns
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+        print(f"Serving game sessions on {address}")
+        async with server:
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                pass  # server.close() ends serve_forever this way
+    
+    async def handle(self, reader, writer):
+        owned = set()
+        try:
+            while True:
+                length, kind = self.FRAME.unpack(await reader.readexactly(self.FRAME.size))
+                if length > self.MAX_PAYLOAD:
+                    writer.write(self.frame(MSG_ERROR, b"message too large"))
+                    break
+                payload = await reader.readexactly(length)
+                try:
+                    writer.write(self.dispatch(kind, payload, owned))
+                except (struct.error, KeyError, ValueError) as e:
+                    writer.write(self.frame(MSG_ERROR, f"{type(e).__name__}: {e}".encode()))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for session_id in owned:
+                del self.sessions[session_id]
+            sessions_gauge.set(len(self.sessions))
+            writer.close()
+    
+    def dispatch(self, kind, payload, owned):
+        # Handle one client message and return the reply bytes
+        if kind == MSG_NEW:
+            flags, level = self.NEW.unpack(payload)
+            if level and self.level_pack is None:
+                raise ValueError("server has no level pack")
+            if level and level > len(self.level_pack):
+                raise ValueError(f"level pack has {len(self.level_pack)} levels")
+            game = Game(presentation=False, level_pack=self.level_pack if level else None,
+                        level=level or 1, endless=bool(flags & 1))
+            session = ServerSession(self.next_id, game)
+            self.sessions[session.id] = session
+            sessions_gauge.set(len(self.sessions))
+            owned.add(session.id)
+            self.next_id += 1
+            return self.state(session)
+        
+        session_id = self.SESSION.unpack_from(payload)[0]
+        if session_id not in owned:
+            raise KeyError(f"no session {session_id}")
+        session = self.sessions[session_id]
+        if kind == MSG_SHOOT:
+            _, angle = self.SHOOT.unpack(payload)
+            over = session.game.game_over
+            result = self.RESULT.pack(session.id, *session.shoot(angle), session.game.game_over)
+            session_shots_total.inc()
+            if session.game.game_over and not over:
+                games_total.inc()
+                score_histogram.observe(session.game.score)
+            return self.frame(MSG_RESULT, result) + self.delta(session)
+        if kind == MSG_SNAPSHOT:
+            return self.state(session)
+        if kind == MSG_CLOSE:
+            owned.discard(session_id)
+            del self.sessions[session_id]
+            sessions_gauge.set(len(self.sessions))
+            return self.frame(MSG_CLOSED, self.SESSION.pack(session_id))
+        raise ValueError(f"unknown message type {kind}")
+    
+    def state(self, session):
+        game = session.game
+        session.cells = SimBoard.from_game(game).cells
+        session.row_origin = game.row_origin
+        header = self.STATE.pack(session.id, game.score, game.row_origin,
+                                 COLOR_CODES.get(game.next_bubble.color["main"], RAINBOW_CODE), game.game_over)
+        return self.frame(MSG_STATE, header + bytes(session.cells))
+    
+    def delta(self, session):
+        # Changed cells since the client's last copy; after a row push every
+        # cell moves, so a full STATE is sent instead
+        game = session.game
+        if game.row_origin != session.row_origin:
+            return self.state(session)
+        cells = SimBoard.from_game(game).cells
+        changes = [self.CHANGE.pack(index, code)
+                   for index, (old, code) in enumerate(zip(session.cells, cells)) if old != code]
+        session.cells = cells
+        header = self.DELTA.pack(session.id, game.score, COLOR_CODES.get(game.next_bubble.color["main"], RAINBOW_CODE),
+                                 game.game_over, len(changes))
+        return self.frame(MSG_DELTA, header + b"".join(changes))
+
+# Versus mode messages, framed like the session server's
+MSG_VERSUS_DELTA = 32  # SCALARS, then crc32 and count (DELTA), then one CHANGE per cell
+MSG_VERSUS_KEYFRAME = 33  # SCALARS, then rows*cols cell codes from the top row
+MSG_VERSUS_RESYNC = 34  # Checksum mismatch, asks for a keyframe
+
+class VersusLink:
+    # Framed messages over a non-blocking TCP socket, polled once a frame
+    # from the game loop. The host waits for the opponent to connect.
+    FRAME = SessionServer.FRAME
+    
+    def __init__(self, address, host):
+        name, port = address.rsplit(":", 1)
+        self.listener = None
+        self.sock = None
+        if host:
+            self.listener = socket.create_server((name, int(port)))
+            self.listener.setblocking(False)
+        else:
+            self.connect(socket.create_connection((name, int(port)), timeout=10))
+        self.closed = False  # Opponent went away
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+    
+    def connect(self, sock):
+        # Small messages every frame, so no Nagle delay
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+    
+    @property
+    def connected(self):
+        return self.sock is not None and not self.closed
+    
+    def send(self, kind, payload):
+        self.outbox += self.FRAME.pack(len(payload), kind) + payload
+    
+    def poll(self):
+        # Accept, flush and read what is available; returns (kind, payload) messages
+        if self.sock is None:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return []
+            self.connect(sock)
+            self.listener.close()
+        if self.closed:
+            return []
+        try:
+            if self.outbox:
+                sent = self.sock.send(self.outbox)
+                del self.outbox[:sent]
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    self.closed = True
+                    break
+                self.inbox += data
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.closed = True
+        
+        messages = []
+        while len(self.inbox) >= self.FRAME.size:
+            length, kind = self.FRAME.unpack_from(self.inbox)
+            if len(self.inbox) < self.FRAME.size + length:
+                break
+            messages.append((kind, bytes(self.inbox[self.FRAME.size:self.FRAME.size + length])))
+            del self.inbox[:self.FRAME.size + length]
+        return messages
+
+class RemoteBoard:
+    # The opponent's board as rebuilt from their deltas and keyframes
+    CELL = 8  # Minimap cell size in pixels
+    
+    def __init__(self):
+        self.rows = [bytearray(GRID_COLS) for _ in range(GRID_ROWS)]  # Indexed by world row
+        self.row_origin = 0
+        self.score = 0
+        self.combo = 0
+        self.active_powerup = 0
+        self.stored_powerup = 0
+        self.game_over = False
+        self.synced = False  # A keyframe has arrived
+    
+    def cells(self):
+        return b"".join(bytes(self.rows[(self.row_origin + row) % GRID_ROWS]) for row in range(GRID_ROWS))
+    
+    def set_scalars(self, row_origin, score, combo, active_powerup, stored_powerup, game_over):
+        # Rows scrolling in at the top reuse the slots of rows that left at the bottom
+        for row in range(row_origin, min(self.row_origin, row_origin + GRID_ROWS)):
+            self.rows[row % GRID_ROWS][:] = bytes(GRID_COLS)
+        self.row_origin = row_origin
+        self.score = score
+        self.combo = combo
+        self.active_powerup = active_powerup
+        self.stored_powerup = stored_powerup
+        self.game_over = game_over
+    
+    def apply_keyframe(self, cells):
+        for row in range(GRID_ROWS):
+            self.rows[(self.row_origin + row) % GRID_ROWS][:] = cells[row * GRID_COLS:(row + 1) * GRID_COLS]
+        self.synced = True
+    
+    def apply_change(self, row, col, code):
+        if self.row_origin <= row < self.row_origin + GRID_ROWS and 0 <= col < GRID_COLS:
+            self.rows[row % GRID_ROWS][col] = code
+    
+    def draw(self, x, y, status=None):
+        # Minimap of the opponent's board with their score underneath
+        size = self.CELL
+        screen.rect((20, 20, 40), (x - 2, y - 2, GRID_COLS * size + size // 2 + 4, GRID_ROWS * size + 4))
+        screen.rect(GRAY, (x - 2, y - 2, GRID_COLS * size + size // 2 + 4, GRID_ROWS * size + 4), 1)
+        for row in range(GRID_ROWS):
+            world_row = self.row_origin + row
+            offset = size // 2 if world_row % 2 == 0 else 0
+            for col, code in enumerate(self.rows[world_row % GRID_ROWS]):
+                if code:
+                    color = GOLD if code == RAINBOW_CODE else BUBBLE_COLORS[code - 1]["main"]
+                    screen.circle(color, (x + col * size + offset + size // 2, y + row * size + size // 2),
+                                  size // 2)
+        label = status or (f"Opponent: {self.score}" + (" (out)" if self.game_over else ""))
+        screen.blit(sprites.text(16, label, WHITE), (x, y + GRID_ROWS * size + 6))
+
+class VersusSync:
+    # Two-player versus mode: sends this game's board changes after each
+    # shot and rebuilds the opponent's board from theirs. Changes come
+    # from the attach/pop/drop events; a keyframe goes out every
+    # KEYFRAME_INTERVAL deltas, and the checksum in each delta lets the
+    # receiver ask for one early when it has drifted.
+    SCALARS = struct.Struct("<iiBBB?")  # Row origin, score, combo, active and stored powerup codes, game over
+    DELTA = struct.Struct("<IH")  # Board crc32, number of changes
+    CHANGE = struct.Struct("<hBB")  # World row, col, new code (0 for empty)
+    KEYFRAME_INTERVAL = 10
+    
+    def __init__(self, link):
+        self.link = link
+        self.remote = RemoteBoard()
+        self.game = None
+    
+    def bind(self, game):
+        # Follow a (new) local game; the opponent gets a keyframe of it
+        self.game = game
+        self.changes = {}  # (world row, col) -> code, since the last message
+        self.scalars = None
+        self.keyframe_due = True
+        self.deltas_sent = 0
+        game.events.subscribe(EVENT_ATTACHED, self.on_attached)
+        game.events.subscribe(EVENT_POPPED, self.on_removed)
+        game.events.subscribe(EVENT_DROPPED, self.on_removed)
+        game.events.subscribe(EVENT_ROW_PUSHED, self.on_row_pushed)
+        game.events.subscribe(EVENT_LEVEL_STARTED, self.on_level_started)
+    
+    def on_attached(self, bubble):
+        code = RAINBOW_CODE if bubble.is_rainbow else COLOR_CODES.get(bubble.color["main"], RAINBOW_CODE)
+        self.changes[(bubble.row, bubble.col)] = code
+    
+    def on_removed(self, bubbles):
+        for bubble in bubbles:
+            self.changes[(bubble.row, bubble.col)] = 0
+    
+    def on_row_pushed(self, row):
+        for col in range(GRID_COLS):
+            bubble = self.game.grid[row][col]
+            if bubble:
+                self.on_attached(bubble)
+    
+    def on_level_started(self, level):
+        self.keyframe_due = True
+    
+    def pack_scalars(self):
+        game = self.game
+        active = POWERUP_TYPES.index(game.active_powerup) + 1 if game.active_powerup else 0
+        stored = POWERUP_TYPES.index(game.stored_powerup.type) + 1 if game.stored_powerup else 0
+        return self.SCALARS.pack(game.row_origin, game.score, min(game.combo, 255), active, stored, game.game_over)
+    
+    def update(self):
+        # Once a frame: exchange messages and send what changed
+        for kind, payload in self.link.poll():
+            self.receive(kind, payload)
+        if not self.link.connected:
+            return
+        
+        scalars = self.pack_scalars()
+        if self.keyframe_due or (self.changes and self.deltas_sent >= self.KEYFRAME_INTERVAL):
+            cells = SimBoard.from_game(self.game).cells
+            self.link.send(MSG_VERSUS_KEYFRAME, scalars + bytes(cells))
+            self.keyframe_due = False
+            self.deltas_sent = 0
+        elif self.changes or scalars != self.scalars:
+            crc = zlib.crc32(SimBoard.from_game(self.game).cells)
+            changes = b"".join(self.CHANGE.pack(row, col, code) for (row, col), code in self.changes.items())
+            self.link.send(MSG_VERSUS_DELTA, scalars + self.DELTA.pack(crc, len(self.changes)) + changes)
+            self.deltas_sent += 1
+        else:
+            return
+        self.changes.clear()
+        self.scalars = scalars
+    
+    def receive(self, kind, payload):
+        remote = self.remote
+        if kind == MSG_VERSUS_RESYNC:
+            self.keyframe_due = True
+            return
+        remote.set_scalars(*self.SCALARS.unpack_from(payload))
+        offset = self.SCALARS.size
+        if kind == MSG_VERSUS_KEYFRAME:
+            remote.apply_keyframe(payload[offset:])
+        elif kind == MSG_VERSUS_DELTA and remote.synced:
+            crc, count = self.DELTA.unpack_from(payload, offset)
+            offset += self.DELTA.size
+            for _ in range(count):
+                remote.apply_change(*self.CHANGE.unpack_from(payload, offset))
+                offset += self.CHANGE.size
+            if zlib.crc32(remote.cells()) != crc:
+                log.warning("versus", "Versus board out of sync, asking for a keyframe")
+                remote.synced = False
+                self.link.send(MSG_VERSUS_RESYNC, b"")
+    
+    def draw(self):
+        if self.link.closed:
+            status = "Opponent left"
+        elif not self.link.connected:
+            status = "Waiting for opponent..."
+        else:
+            status = None if self.remote.synced else "Syncing..."
+        self.remote.draw(WIDTH - 150, 270, status)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Puzzle Bobble")
+    parser.add_argument("--pack", metavar="PATH", help="play levels from a level pack")
+    parser.add_argument("--level", type=int, default=1, help="level to start on when playing a pack")
+    parser.add_argument("--endless", action="store_true", help="endless mode: new rows keep coming")
+    parser.add_argument("--build-pack", metavar="PATH", help="generate a level pack and exit")
+    parser.add_argument("--levels", type=int, default=100, help="number of levels to generate")
+    parser.add_argument("--difficulty", type=int, default=1, help="difficulty of the first level (1-10)")
+    parser.add_argument("--max-difficulty", type=int, help="difficulty of the last level (default: same)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first level")
+    parser.add_argument("--rate-pack", metavar="PATH", help="find the fewest shots for each pack level and exit")
+    parser.add_argument("--solve-depth", type=int, default=8, help="deepest search when rating levels")
+    parser.add_argument("--solve-nodes", type=int, default=RATE_NODE_LIMIT, help="node limit per level when rating")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="host headless game sessions on HOST:PORT or a Unix socket path")
+    parser.add_argument("--versus-host", metavar="HOST:PORT", help="host a two-player versus game")
+    parser.add_argument("--versus-join", metavar="HOST:PORT", help="join a two-player versus game")
+    parser.add_argument("--record", action="store_true", help="start recording frames right away (F9 toggles)")
+    parser.add_argument("--record-dir", metavar="DIR", default="recordings", help="where recordings are written")
+    parser.add_argument("--record-every", type=int, default=1, metavar="N", help="capture every Nth frame")
+    parser.add_argument("--record-format", choices=("png", "raw"), default="png",
+                        help="PNG image sequence or one raw RGB24 stream")
+    parser.add_argument("--quality", type=float, metavar="LEVEL",
+                        help="fix effects quality (0.1-1.0) instead of adapting to frame times")
+    parser.add_argument("--window", metavar="WxH", default=f"{WIDTH}x{HEIGHT}",
+                        help=f"window size; the game always renders at {WIDTH}x{HEIGHT} and is scaled to fit")
+    parser.add_argument("--internal-res", metavar="WxH", default=f"{WIDTH}x{HEIGHT}",
+                        help="resolution the game renders at before scaling to the window")
+    parser.add_argument("--fullscreen", action="store_true", help="start full screen (F11 toggles)")
+    parser.add_argument("--smooth-scale", action="store_true",
+                        help="smooth scaling to fill the window instead of integer nearest-neighbour")
+    parser.add_argument("--threaded", action="store_true",
+                        help="run the simulation on its own thread at a fixed 60 Hz")
+    parser.add_argument("--replay-dir", metavar="DIR", help="save a replay of every game played")
+    parser.add_argument("--render-replay", metavar="PATH", help="render every frame of a replay and exit")
+    parser.add_argument("--render-out", metavar="DIR", default="render", help="where rendered frames are written")
+    parser.add_argument("--render-size", metavar="WxH", default=f"{WIDTH}x{HEIGHT}", help="rendered frame size")
+    parser.add_argument("--render-format", choices=("png", "raw"), default="png",
+                        help="PNG image sequence or one raw RGB24 stream")
+    parser.add_argument("--telemetry", metavar="PATH", help="append gameplay events to a JSONL log")
+    parser.add_argument("--telemetry-report", metavar="PATH", nargs="+",
+                        help="print funnels and distributions over telemetry logs and exit")
+    parser.add_argument("--metrics", metavar="HOST:PORT",
+                        help="serve Prometheus metrics at http://HOST:PORT/metrics")
+    parser.add_argument("--profile", type=int, default=0, metavar="N",
+                        help="profile the first N frames (F12 profiles the next N at any time)")
+    parser.add_argument("--profile-mode", choices=("sample", "trace"), default="sample",
+                        help="collapsed stacks from a sampler, or cProfile .pstats per game phase")
+    parser.add_argument("--profile-dir", metavar="DIR", default="profiles", help="where profiles are written")
+    parser.add_argument("--log-level", choices=("debug", "info", "warning", "error"), default="info",
+                        help="least severe log records kept")
+    parser.add_argument("--log-debug", metavar="CATEGORIES",
+                        help="comma-separated categories to log at debug level (e.g. match,powerup)")
+    parser.add_argument("--log-file", metavar="PATH", help="append log records to a file (F10 dumps recent history)")
+    args = parser.parse_args(argv)
+    if args.level < 1:
+        parser.error("--level starts at 1")
+    if args.pack:
+        try:
+            with LevelPack(args.pack) as pack:
+                levels = len(pack)
+        except (OSError, ValueError) as e:
+            parser.error(f"--pack: {e}")
+        if args.level > levels:
+            parser.error(f"--level {args.level}: {args.pack} has {levels} levels")
+    return args
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    log.configure(GameLog.parse_level(args.log_level),
+                  dict.fromkeys(args.log_debug.split(","), GameLog.DEBUG) if args.log_debug else None,
+                  args.log_file)
+    if args.metrics:
+        metrics.serve(args.metrics)
+    if args.quality is not None:
+        quality.fix(args.quality)
+    if args.build_pack:
+        build_level_pack(args.build_pack, args.levels, args.difficulty, args.max_difficulty,
+                         args.seed, args.workers)
+    elif args.rate_pack:
+        rate_level_pack(args.rate_pack, args.solve_depth, args.solve_nodes, args.workers)
+    elif args.render_replay:
+        width, height = (int(n) for n in args.render_size.lower().split("x"))
+        render_replay(args.render_replay, args.render_out, (width, height), args.workers, args.render_format)
+    elif args.telemetry_report:
+        print(json.dumps(telemetry_report(args.telemetry_report), indent=2))
+    elif args.serve:
+        asyncio.run(SessionServer(LevelPack(args.pack) if args.pack else None).serve(args.serve))
+    else:
+        versus = None
+        if args.versus_host or args.versus_join:
+            versus = VersusSync(VersusLink(args.versus_host or args.versus_join, host=bool(args.versus_host)))
+        window_size = tuple(int(n) for n in args.window.lower().split("x"))
+        main(LevelPack(args.pack) if args.pack else None, args.level, args.endless, versus,
+             args.record, args.record_dir, args.record_every, args.record_format, args.replay_dir,
+             window_size, args.fullscreen, args.smooth_scale, args.threaded,
+             TelemetryLog(args.telemetry) if args.telemetry else None,
+             args.profile, args.profile_dir, args.profile_mode,
+             tuple(int(n) for n in args.internal_res.lower().split("x")))
+    log.close()
@@ -0,0 +1,47 @@
+import pygame
+import pytest
+
+import puzzle_bobble as pb
+
+
+def reference(size, widgets):
+    # The widgets blitted one by one straight onto the same background
+    target = pygame.Surface(size)
+    target.fill((200, 180, 120))
+    sequence = [(widget.surface, widget.pos) for widget in widgets if widget.surface]
+    if not pb.screen.native:
+        sequence = [(pb.screen.scale_surface(surface), pb.screen.point(pos)) for surface, pos in sequence]
+    target.blits(sequence, False)
+    return target
+
+
+def assert_matches(expected):
+    width, height = expected.get_size()
+    actual = pb.screen.surface
+    assert all(abs(a - b) <= 1 for x in range(0, width, 2) for y in range(0, height, 2)
+               for a, b in zip(expected.get_at((x, y)), actual.get_at((x, y))))
+
+
+@pytest.mark.parametrize("size", [(pb.WIDTH, pb.HEIGHT), (400, 300)])
+def test_composite_is_rebuilt_only_on_change(size):
+    pb.screen.resize(size)
+    try:
+        hud = pb.create_hud()
+        game = pb.Game(presentation=False, seed=1)
+        game.combo = 2
+        
+        pb.screen.surface.fill((200, 180, 120))
+        hud.draw(game)
+        assert_matches(reference(size, hud.widgets))
+        
+        # Steady frames reuse the composite; a change rebuilds it
+        composite = hud.surface
+        hud.draw(game)
+        assert hud.surface is composite
+        game.score = 12345
+        pb.screen.surface.fill((200, 180, 120))
+        hud.draw(game)
+        assert hud.surface is not composite
+        assert_matches(reference(size, hud.widgets))
+    finally:
+        pb.screen.resize((pb.WIDTH, pb.HEIGHT))
@@ -0,0 +1,109 @@
+import pytest
+
+import puzzle_bobble as pb
+
+
+def generated_levels(count=5):
+    levels = []
+    for seed in range(count):
+        level = pb.LevelGenerator(1 + seed).generate(seed)
+        assert level is not None
+        levels.append(level)
+    return levels
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "levels.pack")
+    levels = generated_levels()
+    pb.LevelPack.write(path, levels, build_key=1234)
+    
+    assert pb.LevelPack.read_build_key(path) == 1234
+    with pb.LevelPack(path) as pack:
+        assert len(pack) == len(levels)
+        for number, level in enumerate(levels, 1):
+            stored = pack.level(number)
+            assert {key: stored[key] for key in ("seed", "difficulty", "colors", "par")} == \
+                   {key: level[key] for key in ("seed", "difficulty", "colors", "par")}
+            assert bytes(stored["cells"]) == bytes(level["cells"])
+
+
+def test_level_numbers_out_of_range(tmp_path):
+    path = str(tmp_path / "levels.pack")
+    pb.LevelPack.write(path, generated_levels(2))
+    with pb.LevelPack(path) as pack:
+        for number in (0, 3):
+            with pytest.raises(IndexError):
+                pack.level(number)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not.pack"
+    path.write_bytes(b"JUNK" + bytes(64))
+    assert pb.LevelPack.read_build_key(str(path)) is None
+    with pytest.raises(ValueError):
+        pb.LevelPack(str(path))
+
+
+def test_generated_level_plays_from_pack(tmp_path):
+    path = str(tmp_path / "levels.pack")
+    levels = generated_levels(2)
+    pb.LevelPack.write(path, levels)
+    with pb.LevelPack(path) as pack:
+        game = pb.Game(presentation=False, level_pack=pack, level=2, seed=1)
+        assert bytes(pb.SimBoard.from_game(game).cells) == bytes(levels[1]["cells"])
+
+
+def test_build_reuses_an_up_to_date_pack(tmp_path, capsys):
+    path = str(tmp_path / "levels.pack")
+    pb.build_level_pack(path, 3, 1, 3, workers=1)
+    with pb.LevelPack(path) as pack:
+        built = [bytes(pack.level(n)["cells"]) for n in range(1, 4)]
+    capsys.readouterr()
+    
+    pb.build_level_pack(path, 3, 1, 3, workers=1)
+    assert "up to date" in capsys.readouterr().out
+    with pb.LevelPack(path) as pack:
+        assert [bytes(pack.level(n)["cells"]) for n in range(1, 4)] == built
+
+
+def test_rejects_packs_that_do_not_fit_the_grid(tmp_path):
+    path = str(tmp_path / "levels.pack")
+    level = dict(generated_levels(1)[0], cells=bytes(10 * 10))
+    pb.LevelPack.write(path, [level], rows=10, cols=10)
+    with pytest.raises(ValueError, match="10x10"):
+        pb.LevelPack(path)
+    
+    pb.LevelPack.write(path, [])
+    with pytest.raises(ValueError, match="no levels"):
+        pb.LevelPack(path)
+
+
+def test_clearing_the_last_level_ends_the_game(tmp_path):
+    path = str(tmp_path / "levels.pack")
+    levels = generated_levels(2)
+    pb.LevelPack.write(path, levels)
+    with pb.LevelPack(path) as pack:
+        game = pb.Game(presentation=False, level_pack=pack, seed=1)
+        ended = []
+        game.events.subscribe(pb.EVENT_GAME_OVER, lambda: ended.append(game.level))
+        for level in (1, 2):
+            assert game.level == level and not game.game_over
+            game.unplace_bubbles(list(game.bubbles))
+            game.update()
+        assert game.game_over and game.pack_complete
+        assert ended == [2]
+
+
+@pytest.mark.parametrize("argv, message", [
+    (["--level", "0"], "starts at 1"),
+    (["--pack", "{pack}", "--level", "3"], "has 2 levels"),
+    (["--pack", "{missing}"], "--pack"),
+])
+def test_command_line_checks_the_level(tmp_path, capsys, argv, message):
+    path = str(tmp_path / "levels.pack")
+    pb.LevelPack.write(path, generated_levels(2))
+    argv = [arg.format(pack=path, missing=str(tmp_path / "missing.pack")) for arg in argv]
+    with pytest.raises(SystemExit):
+        pb.parse_args(argv)
+    assert message in capsys.readouterr().err
+    assert pb.parse_args(["--pack", path, "--level", "2"]).level == 2
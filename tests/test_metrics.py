@@ -0,0 +1,101 @@
+import threading
+import urllib.request
+
+import pytest
+
+import puzzle_bobble as pb
+
+
+def scrape(url):
+    # A minimal stand-in for the monitoring stack: sample -> value, plus
+    # the HELP and TYPE comment lines
+    with urllib.request.urlopen(url, timeout=10) as response:
+        assert response.headers["Content-Type"].startswith("text/plain")
+        text = response.read().decode()
+    samples = {}
+    comments = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            comments.append(line)
+        else:
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+    return samples, comments
+
+
+@pytest.fixture
+def endpoint():
+    pb.metrics.serve("127.0.0.1:0")
+    host, port = pb.metrics.server.server_address[:2]
+    yield f"http://{host}:{port}"
+    pb.metrics.server.shutdown()
+    pb.metrics.server.server_close()
+    pb.metrics.server = None
+
+
+def cumulative(histogram, name, labels=""):
+    counts, value_sum = histogram.read()
+    inner = labels + "," if labels else ""
+    expected = {}
+    total = 0
+    for bound, count in zip(list(histogram.bounds) + ["+Inf"], counts):
+        total += count
+        expected[f'{name}_bucket{{{inner}le="{bound}"}}'] = total
+    return expected, total, value_sum
+
+
+def test_scrape(endpoint):
+    frames = pb.frame_seconds
+    before, frames_before, sum_before = cumulative(frames, "puzzle_bobble_frame_seconds")
+    for seconds in (0.001, 0.015, 0.015, 0.02, 0.5):
+        frames.observe(seconds)
+    pb.leaderboard_write_seconds.observe(0.003)
+    pb.fps_gauge.set(58.5)
+    
+    samples, comments = scrape(endpoint + "/metrics")
+    assert "# HELP puzzle_bobble_frame_seconds Time between frames" in comments
+    assert "# TYPE puzzle_bobble_frame_seconds histogram" in comments
+    assert "# TYPE puzzle_bobble_fps gauge" in comments
+    assert "# TYPE puzzle_bobble_games_total counter" in comments
+    assert comments.count("# TYPE puzzle_bobble_phase_seconds histogram") == 1
+    
+    # 0.001 -> le 0.004; 0.015s -> le 0.0167; 0.02 -> le 0.025; 0.5 -> +Inf only
+    added = {"0.004": 1, "0.008": 1, "0.0125": 1, "0.0167": 3, "0.025": 4, "0.0333": 4, "0.05": 4,
+             "0.1": 4, "0.25": 4, "+Inf": 5}
+    for bound, count in added.items():
+        sample = f'puzzle_bobble_frame_seconds_bucket{{le="{bound}"}}'
+        assert samples[sample] == before[sample] + count
+    assert samples["puzzle_bobble_frame_seconds_count"] == frames_before + 5
+    assert samples["puzzle_bobble_frame_seconds_sum"] == pytest.approx(sum_before + 0.551)
+    
+    expected, count, value_sum = cumulative(pb.leaderboard_write_seconds, "puzzle_bobble_leaderboard_write_seconds")
+    assert {sample: samples[sample] for sample in expected} == expected
+    assert samples["puzzle_bobble_leaderboard_write_seconds_count"] == count >= 1
+    assert samples["puzzle_bobble_leaderboard_write_seconds_sum"] == pytest.approx(value_sum)
+    assert samples["puzzle_bobble_fps"] == 58.5
+    assert samples['puzzle_bobble_phase_seconds_count{phase="draw"}'] >= 0
+
+
+def test_unknown_path(endpoint):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(endpoint + "/other", timeout=10)
+    assert error.value.code == 404
+
+
+def test_scrape_waits_for_a_half_done_observation():
+    histogram = pb.MetricHistogram((0.5, 2))
+    histogram.observe(1)
+    
+    # An observe() interrupted between the bucket and the sum
+    histogram.sequence += 1
+    histogram.counts[1] += 1
+    scraped = []
+    reader = threading.Thread(target=lambda: scraped.append(dict(histogram.samples("h"))))
+    reader.start()
+    reader.join(0.1)
+    assert reader.is_alive() and not scraped
+    
+    histogram.sum += 1
+    histogram.sequence += 1
+    reader.join(10)
+    assert scraped[0]["h_sum"] == scraped[0]["h_count"] == 2
@@ -0,0 +1,43 @@
+import json
+import shutil
+import threading
+
+import pygame
+
+import puzzle_bobble as pb
+
+
+def surface(shade):
+    frame = pygame.Surface((32, 24))
+    frame.fill((shade, 0, 0))
+    return frame
+
+
+def stop(recorder):
+    # stop() must come back even when the encoder failed
+    thread = threading.Thread(target=recorder.stop, kwargs={"timeout": 2})
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_raw_recording(tmp_path):
+    recorder = pb.FrameRecorder(str(tmp_path), every=2, format="raw")
+    for shade in range(10):
+        recorder.capture(surface(shade))
+    stop(recorder)
+    assert (tmp_path / "frames.rgb").stat().st_size == 5 * 32 * 24 * 3
+    sidecar = json.loads((tmp_path / "frames.json").read_text())
+    assert (sidecar["width"], sidecar["height"], sidecar["frames"], sidecar["fps"]) == (32, 24, 5, 30)
+
+
+def test_stop_after_the_directory_is_removed(tmp_path):
+    directory = tmp_path / "frames"
+    recorder = pb.FrameRecorder(str(directory), queue_size=4)
+    recorder.capture(surface(0))
+    shutil.rmtree(directory)
+    for shade in range(50):
+        recorder.capture(surface(shade))
+    stop(recorder)
+    assert recorder.error is not None
+    assert recorder.written + recorder.dropped == 51
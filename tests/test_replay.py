@@ -0,0 +1,80 @@
+import pickle
+import random
+
+import pytest
+
+import puzzle_bobble as pb
+
+
+def state(game):
+    return (game.frames, game.score, game.level, game.shots_fired, game.game_over,
+            game.row_origin, bytes(pb.SimBoard.from_game(game).cells))
+
+
+def play(game, frames, seed=0):
+    # A scripted player: wander the aim, shoot and use powerups, the way
+    # main() applies input before each update
+    script = random.Random(seed)
+    for _ in range(frames):
+        if game.game_over:
+            break
+        roll = script.random()
+        if roll < 0.1:
+            game.apply_input(pb.INPUT_AIM, script.uniform(-pb.MAX_ANGLE, pb.MAX_ANGLE))
+        elif roll < 0.14:
+            game.apply_input(pb.INPUT_SHOOT)
+        elif roll < 0.145:
+            game.apply_input(pb.INPUT_USE_POWERUP)
+        if game.frames == 30:
+            game.apply_input(pb.INPUT_SPAWN_POWERUP, "bomb")
+        game.update()
+        game.scheduler.flush()
+
+
+def recorded_game(tmp_path, frames=3000):
+    game = pb.Game(seed=1234, record_inputs=True)
+    play(game, frames)
+    path = str(tmp_path / "game.replay")
+    game.save_replay(path)
+    return game, path
+
+
+def test_replay_resimulates_the_game(tmp_path):
+    game, path = recorded_game(tmp_path)
+    assert game.shots_fired > 20
+    
+    replay = pb.load_replay(path)
+    assert replay["frames"] == game.frames
+    copy = pb.Game(aim_assist=replay["aim_assist"], presentation=False, level=replay["level"],
+                   endless=replay["endless"], seed=replay["seed"])
+    inputs = pb.replay_inputs(replay)
+    while copy.frames < replay["frames"]:
+        pb.step_replay(copy, inputs)
+    assert state(copy) == state(game)
+
+
+def test_keyframes_continue_identically(tmp_path):
+    game, path = recorded_game(tmp_path, 1200)
+    replay = pb.load_replay(path)
+    inputs = pb.replay_inputs(replay)
+    keyframes = pb.replay_keyframes(replay, 400)
+    assert sorted(keyframes) == [0, 400, 800]
+    for frame, keyframe in keyframes.items():
+        copy = pickle.loads(keyframe)
+        assert copy.frames == frame
+        while copy.frames < replay["frames"]:
+            pb.step_replay(copy, inputs)
+        assert state(copy) == state(game)
+
+
+def test_inputs_are_only_kept_when_recording():
+    game = pb.Game(presentation=False, seed=5)
+    play(game, 600)
+    assert game.shots_fired and game.inputs == []
+
+
+def test_replay_version_is_checked(tmp_path):
+    path = tmp_path / "old.replay"
+    path.write_text('{"version": -1}')
+    with pytest.raises(ValueError):
+        pb.load_replay(str(path))
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import pytest
+
+import puzzle_bobble as pb
+
+Server = pb.SessionServer
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+    
+    async def send(self, kind, payload=b""):
+        self.writer.write(Server.frame(kind, payload))
+        await self.writer.drain()
+    
+    async def receive(self):
+        length, kind = Server.FRAME.unpack(await self.reader.readexactly(Server.FRAME.size))
+        return kind, await self.reader.readexactly(length)
+    
+    async def request(self, kind, payload=b""):
+        await self.send(kind, payload)
+        return await self.receive()
+
+
+def run(level_pack, scenario):
+    # Serve on a free local port and run scenario(server, client)
+    async def main():
+        server = Server(level_pack)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        client = Client(*await asyncio.open_connection("127.0.0.1", port))
+        try:
+            await asyncio.wait_for(scenario(server, client), 30)
+        finally:
+            client.writer.close()
+            listener.close()
+            await listener.wait_closed()
+    asyncio.run(main())
+
+
+def test_new_shoot_snapshot_close():
+    async def scenario(server, client):
+        kind, payload = await client.request(pb.MSG_NEW, Server.NEW.pack(0, 0))
+        assert kind == pb.MSG_STATE
+        session, score, row_origin, next_code, game_over = Server.STATE.unpack_from(payload)
+        assert len(payload) == Server.STATE.size + pb.GRID_ROWS * pb.GRID_COLS
+        assert (score, game_over) == (0, False)
+        
+        kind, payload = await client.request(pb.MSG_SHOOT, Server.SHOOT.pack(session, 10.0))
+        assert kind == pb.MSG_RESULT
+        assert Server.RESULT.unpack(payload)[0] == session
+        kind, _ = await client.receive()
+        assert kind in (pb.MSG_DELTA, pb.MSG_STATE)
+        
+        kind, _ = await client.request(pb.MSG_SNAPSHOT, Server.SESSION.pack(session))
+        assert kind == pb.MSG_STATE
+        kind, payload = await client.request(pb.MSG_CLOSE, Server.SESSION.pack(session))
+        assert (kind, payload) == (pb.MSG_CLOSED, Server.SESSION.pack(session))
+        assert not server.sessions
+    run(None, scenario)
+
+
+def test_errors_keep_the_connection(tmp_path):
+    path = str(tmp_path / "levels.pack")
+    pb.LevelPack.write(path, [pb.LevelGenerator(1).generate(seed) for seed in range(2)])
+    
+    async def scenario(server, client):
+        kind, payload = await client.request(pb.MSG_NEW, Server.NEW.pack(0, 1))
+        assert kind == pb.MSG_STATE
+        session = Server.STATE.unpack_from(payload)[0]
+        
+        # Past the end of the pack, unknown sessions, unknown types, bad payloads
+        for message in ((pb.MSG_NEW, Server.NEW.pack(0, 3)),
+                        (pb.MSG_SHOOT, Server.SHOOT.pack(session + 100, 0.0)),
+                        (99, Server.SESSION.pack(session)),
+                        (pb.MSG_SHOOT, b"\x01")):
+            kind, payload = await client.request(*message)
+            assert kind == pb.MSG_ERROR, message
+            assert payload
+        
+        # The session opened before the errors is still there
+        kind, _ = await client.request(pb.MSG_SNAPSHOT, Server.SESSION.pack(session))
+        assert kind == pb.MSG_STATE
+        assert session in server.sessions
+    
+    with pb.LevelPack(path) as pack:
+        run(pack, scenario)
+
+
+def test_level_without_a_pack_is_an_error():
+    async def scenario(server, client):
+        kind, payload = await client.request(pb.MSG_NEW, Server.NEW.pack(0, 1))
+        assert kind == pb.MSG_ERROR
+        assert b"no level pack" in payload
+    run(None, scenario)
+
+
+def test_oversized_message_closes_only_that_connection():
+    async def scenario(server, client):
+        await client.request(pb.MSG_NEW, Server.NEW.pack(0, 0))
+        client.writer.write(Server.FRAME.pack(Server.MAX_PAYLOAD + 1, pb.MSG_NEW))
+        await client.writer.drain()
+        kind, payload = await client.receive()
+        assert kind == pb.MSG_ERROR
+        assert await client.reader.read() == b""
+        await asyncio.sleep(0.05)
+        assert not server.sessions  # Sessions belong to the connection
+    run(None, scenario)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs SIGTERM")
+def test_serve_exits_on_sigterm():
+    port = free_port()
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "puzzle_bobble.py")
+    process = subprocess.Popen([sys.executable, script, "--serve", f"127.0.0.1:{port}"],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                assert time.time() < deadline, "server did not start"
+                time.sleep(0.1)
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) is not None
+    finally:
+        if process.poll() is None:
+            process.kill()
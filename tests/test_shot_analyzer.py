@@ -0,0 +1,94 @@
+import pytest
+
+import puzzle_bobble as pb
+
+
+def play(game, angle):
+    # What actually happens when the game plays the shot
+    landed = []
+    popped = []
+    dropped = []
+    game.events.subscribe(pb.EVENT_ATTACHED, lambda bubble: landed.append((bubble.row, bubble.col)))
+    game.events.subscribe(pb.EVENT_POPPED, lambda bubbles: popped.extend(bubbles))
+    game.events.subscribe(pb.EVENT_DROPPED, lambda bubbles: dropped.extend(bubbles))
+    score = game.score
+    game.play_shot(angle)
+    return {"cell": landed[0] if landed else None, "popped": len(popped), "dropped": len(dropped),
+            "score": game.score - score, "game_over": game.game_over}
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_predictions_match_the_game(seed):
+    # Keep shooting one game, checking each prediction before the shot
+    game = pb.Game(presentation=False, seed=seed)
+    for shot in range(25):
+        if game.game_over:
+            break
+        angle = (shot * 37) % 151 - 75
+        game.powerups.clear()  # A shot hitting a free powerup is outside the board rules
+        predicted = game.predict_shot(angle, game.next_bubble.color)
+        actual = play(game, angle)
+        assert actual == {"cell": predicted["cell"], "popped": len(predicted["popped"]),
+                          "dropped": len(predicted["dropped"]), "score": predicted["score"],
+                          "game_over": predicted["game_over"]}, (seed, shot, angle)
+
+
+def test_batch_matches_single_candidates():
+    game = pb.Game(presentation=False, seed=9)
+    analyzer = pb.ShotAnalyzer().load(pb.SimBoard.from_game(game))
+    angles = [angle / 2 for angle in range(-150, 151, 7)]
+    batch = analyzer.evaluate_angles(angles, 1)
+    assert batch == [analyzer.evaluate_angles([angle], 1)[0] for angle in angles]
+    
+    cells = [result["cell"] for result in batch if result["cell"]]
+    indices = [row * pb.GRID_COLS + col for row, col in cells]
+    assert analyzer.evaluate_cells(indices, 1) == [
+        {key: value for key, value in result.items() if key != "path"} for result in batch if result["cell"]]
+
+
+def board_after_shots(seed, shots):
+    game = pb.Game(presentation=False, seed=seed)
+    for shot in range(shots):
+        game.play_shot((shot * 37) % 151 - 75)
+    return pb.SimBoard.from_game(game), game.row_origin
+
+
+def test_worker_traces_the_shared_board_into_the_result_buffer():
+    board, row_origin = board_after_shots(2, 6)
+    analyzer = pb.ShotAnalyzer().load(board, row_origin=row_origin)
+    angles = [-70.0, -12.5, 0.0, 33.0, 79.0]
+    with pb.ShotPool(capacity=8, workers=1) as pool:
+        version = pool.load(board, row_origin)
+        for i, angle in enumerate(angles):
+            pool.angles[i] = angle
+        
+        # Run the worker side in this process against the pool's blocks
+        pb.attach_shot_worker(pool.board.name, pool.angles_memory.name, pool.results_memory.name)
+        try:
+            assert pb.trace_shot_range((version, pb.SHOOT_SPEED, 1, 4)) == 3
+            assert pb.shot_worker["analyzer"].board.cells.obj is pb.shot_worker["board"].memory.buf.obj
+        finally:
+            pb.shot_worker["angles"].release()
+            pb.shot_worker["board"].close()
+            for name in ("angles_memory", "results_memory"):
+                pb.shot_worker[name].close()
+            pb.shot_worker.clear()
+        
+        results = pool.results_memory.buf
+        for i in range(1, 4):
+            index, length, *points = pool.RESULT.unpack_from(results, i * pool.RESULT.size)
+            path, expected = analyzer.trace(angles[i], pb.SHOOT_SPEED)
+            assert (None if index == -1 else index) == expected
+            assert [tuple(points[2 * n:2 * n + 2]) for n in range(length)] == path
+        assert pool.RESULT.unpack_from(results, 0) == pool.RESULT.unpack_from(bytes(pool.RESULT.size))
+
+
+def test_pool_batches_match_in_process():
+    angles = [angle / 4 for angle in range(-320, 321, 3)]
+    with pb.ShotPool(capacity=64, workers=2, min_batch=16) as pool:
+        for seed in (4, 5):
+            board, row_origin = board_after_shots(seed, 8)
+            expected = pb.ShotAnalyzer().load(board, row_origin=row_origin).evaluate_angles(angles, 2)
+            analyzer = pb.ShotAnalyzer(pool).load(board, row_origin=row_origin)
+            assert analyzer.evaluate_angles(angles, 2) == expected
+            assert analyzer.shared == pool.version
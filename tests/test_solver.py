@@ -0,0 +1,64 @@
+import puzzle_bobble as pb
+
+RED, BLUE = 1, 2
+
+
+def board_with(cells):
+    board = pb.SimBoard()
+    for index, code in cells.items():
+        board.cells[index] = code
+    return board
+
+
+def test_finds_single_shot_clear():
+    board = board_with({0: RED, 1: RED})
+    solver = pb.PuzzleSolver([RED], 4)
+    path = solver.solve(board)
+    assert len(path) == 1
+    popped, dropped = board.copy().attach(path[0], RED)
+    assert len(popped) == 3
+
+
+def test_finds_fewest_shots_and_proves_the_bound():
+    board = board_with({0: RED, 1: RED, 3: BLUE, 4: BLUE})
+    solver = pb.PuzzleSolver([RED, BLUE, RED, BLUE], 4)
+    path = solver.solve(board)
+    assert len(path) == 2
+    assert solver.depth == 1  # No clear in one shot
+    
+    # The sequence it returns really clears the board
+    board = board.copy()
+    for index, code in zip(path, [RED, BLUE]):
+        board.attach(index, code)
+    assert board.count() == 0
+
+
+def test_gives_up_beyond_max_depth():
+    board = board_with({0: RED, 1: RED})
+    solver = pb.PuzzleSolver([BLUE], 1)
+    assert solver.solve(board) is None
+    assert not solver.aborted
+    assert solver.depth == 1
+
+
+def test_node_limit_aborts():
+    board = board_with({index: RED if index % 3 else BLUE for index in range(pb.GRID_COLS * 3)})
+    solver = pb.PuzzleSolver([BLUE, RED] * 4, 8, node_limit=20)
+    assert solver.solve(board) is None
+    assert solver.aborted
+    assert solver.nodes > 20
+
+
+def test_rate_level_reports_status_and_bounds():
+    board = board_with({0: RED, 1: RED})
+    result = pb.rate_level((7, bytes(board.cells), 0, 3, 4, 1000))
+    assert result["level"] == 7
+    assert result["status"] == "solved"
+    assert result["shots"] == result["min_shots"] == 1
+    assert result["par"] == 3
+    
+    board = board_with({index: RED if index % 3 else BLUE for index in range(pb.GRID_COLS * 3)})
+    result = pb.rate_level((8, bytes(board.cells), 0, 30, 8, 20))
+    assert result["status"] == "aborted"
+    assert result["shots"] is None
+    assert result["min_shots"] >= 1
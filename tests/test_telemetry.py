@@ -0,0 +1,96 @@
+import json
+
+import puzzle_bobble as pb
+
+
+def write_log(path, records):
+    telemetry = pb.TelemetryLog(str(path), batch=2)
+    for event, fields in records:
+        telemetry.record(event, **fields)
+    telemetry.close()
+    return str(path)
+
+
+def test_log_writes_every_record_on_close(tmp_path):
+    path = write_log(tmp_path / "logs" / "t.jsonl", [("shot", {"game": "a", "angle": n}) for n in range(5)])
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["angle"] for record in records] == list(range(5))
+    assert all(record["event"] == "shot" and "time" in record for record in records)
+
+
+def test_presenter_records_debug_spawned_powerups(tmp_path):
+    telemetry = pb.TelemetryLog(str(tmp_path / "t.jsonl"))
+    game = pb.Game(presentation=False, seed=3)
+    pb.TelemetryPresenter(game, telemetry)
+    game.apply_input(pb.INPUT_SPAWN_POWERUP, "freeze")
+    game.play_shot(0)
+    telemetry.close()
+    
+    report = pb.telemetry_report([telemetry.path])
+    assert report["events"]["game_started"] == 1
+    assert report["events"]["shot"] == 1
+    assert report["powerups"]["freeze"]["spawned"] == 1
+    assert report["abandoned_games"] == 1
+
+
+def game(id, score, shots, matches=(), drops=(), powerups=()):
+    yield "game_started", {"game": id, "level": 1}
+    for n in range(shots):
+        yield "shot", {"game": id, "angle": -45 + 10 * n}
+    for size in matches:
+        yield "match", {"game": id, "size": size, "combo": 1, "rainbow": False}
+    for size in drops:
+        yield "drop", {"game": id, "size": size}
+    for event, type in powerups:
+        yield event, {"game": id, "type": type}
+    if score is not None:
+        yield "game_over", {"game": id, "score": score, "game_time": 60, "shots_fired": shots}
+
+
+def test_report(tmp_path):
+    first = write_log(tmp_path / "1.jsonl", [
+        *game("a", 1200, 3, matches=(3, 4), drops=(2,),
+              powerups=(("powerup_spawned", "bomb"), ("powerup_collected", "bomb"))),
+        *game("b", None, 2, matches=(3,)),
+    ])
+    second = write_log(tmp_path / "2.jsonl", [
+        *game("c", 300, 1),
+        *game("d", 700, 4, matches=(5,), powerups=(("powerup_spawned", "bomb"), ("powerup_spawned", "magnet"))),
+    ])
+    report = pb.telemetry_report([first, second])
+    
+    assert report["funnel"] == {"game_started": 4, "shot": 4, "match": 3, "drop": 1, "powerup_collected": 1,
+                                "powerup_activated": 0, "game_over": 3}
+    assert report["abandoned_games"] == 1
+    assert report["powerups"] == {"bomb": {"spawned": 2, "collected": 1, "activated": 0},
+                                  "magnet": {"spawned": 1, "collected": 0, "activated": 0}}
+    
+    scores = report["distributions"]["final_score"]
+    assert (scores["count"], scores["mean"], scores["p50"], scores["p99"]) == (3, 733.33, 500, 1000)
+    assert scores["buckets"] == {"0": 1, "500": 1, "1000": 1}
+    sizes = report["distributions"]["match_size"]
+    assert (sizes["count"], sizes["p50"], sizes["p90"]) == (4, 3, 5)
+
+
+def test_report_closes_the_oldest_games_when_too_many_are_open(tmp_path):
+    path = write_log(tmp_path / "t.jsonl", [record for id in "abcde" for record in game(id, None, 1)])
+    report = pb.telemetry_report([path], max_open_games=2)
+    assert report["funnel"]["game_started"] == 5
+    assert report["funnel"]["shot"] == 5
+    assert report["abandoned_games"] == 5
+
+
+def test_games_closed_early_are_not_counted_twice(tmp_path):
+    # Interleaved games with room for only one open at a time: each start
+    # closes the other game early, and its remaining events arrive later
+    a, b, c = (list(game(id, 500, 2, matches=(3,))) for id in "abc")
+    path = write_log(tmp_path / "t.jsonl", [a[0], b[0], *a[1:], c[0], *b[1:], *c[1:3]])
+    report = pb.telemetry_report([path], max_open_games=1)
+    assert report["funnel"] == {"game_started": 3, "shot": 3, "match": 2, "drop": 0, "powerup_collected": 0,
+                                "powerup_activated": 0, "game_over": 2}
+    assert report["abandoned_games"] == 1
+    assert report["distributions"]["final_score"]["count"] == 2
+    
+    # With room for everything the counts are the same
+    assert pb.telemetry_report([path])["funnel"] == report["funnel"]